@@ -0,0 +1,222 @@
+import argparse
+import json
+import sys
+
+from tomasulo import Config, Hook, Simulator, load_program
+
+# where the latency of every instruction goes, and which chain of instructions
+# decided the length of the run
+#
+# the latency of an instruction, from the first cycle it was next to issue to its
+# write back, is split into
+#   structural  cycles it waited in issue() because its stations, or the reorder
+#               buffer (rob_size), were all busy
+#   raw         cycles between issue and the arrival of its last operand (fn1/fn2)
+#   unit        cycles it then waited for a shared functional unit (num_add_units, num_mul_units)
+#   execution   its execute latency plus the write back cycle; the latency of a LD/SD
+#               is that of its own access (a cache hit or miss, or a forwarded load)
+#   cdb         cycles its finished result waited for a common data bus, never for
+#               a SD, stores do not use the bus
+#
+# python analysis.py input2.txt [--json report.json]
+
+
+class StallAnalysis(Hook):
+    # watches issue() to learn when each instruction was first next to issue, which
+    # in-flight instructions it took its operands from and its latency, and execute()
+    # to learn when a shared functional unit started it
+    def __init__(self):
+        self.first = {} # index -> first cycle the instruction was next to issue
+        self.producers = {} # index -> indices of the instructions it waited for
+        self.latencies = {} # index -> execute latency of its station, set at issue
+        self.started = {} # index -> cycle a shared functional unit started it
+        self.pc = 0
+        self.stations = None
+
+    def before(self, simulator, phase):
+        if phase != "issue":
+            return
+        self.pc = simulator.pc
+        if simulator.fetch.get(simulator.pc) is not None and simulator.pc not in self.first:
+            self.first[simulator.pc] = simulator.cycle
+
+    def after(self, simulator, phase, result):
+        if phase == "execute":
+            for pool in simulator.pools:
+                if pool.units is not None:
+                    for station in pool.units.started:
+                        self.started[station.instruction] = simulator.cycle
+            return
+        if phase != "issue" or not result:
+            return
+        if self.stations is None:
+            self.stations = {}
+            for pool in simulator.pools:
+                for station in pool.stations:
+                    self.stations[station.name] = station
+        # the tags the stations just issued wait for name the stations of their producers
+        issued = {}
+        for pool in simulator.pools:
+            for i in pool.busy:
+                station = pool.stations[i]
+                if self.pc <= station.instruction < simulator.pc:
+                    issued[station.instruction] = station
+        for index, station in issued.items():
+            self.latencies[index] = station.latency()
+            producers = []
+            for fn in (station.fn1, station.fn2):
+                if fn == "":
+                    continue
+                # with a reorder buffer the tags name its entries
+                if simulator.rob is not None:
+                    producer = simulator.rob.named[fn].instruction
+                else:
+                    producer = self.stations[fn].instruction
+                if producer not in producers:
+                    producers.append(producer)
+            # a load that waited for an older store to write memory
+            if station.type == "LOAD" and station.store is not None:
+                producers.append(station.store.instruction)
+            self.producers[index] = tuple(producers)
+
+    def skipped(self, simulator, cycles):
+        # the skipped cycles start right after the one being skipped from
+        if simulator.fetch.get(simulator.pc) is not None and simulator.pc not in self.first:
+            self.first[simulator.pc] = simulator.cycle + 1
+
+    def release(self, simulator, index):
+        # cycle the station of an instruction became free again: stores free
+        # themselves in execute one write back before their write time, or at
+        # their commit when there is a reorder buffer
+        instruction = simulator.instructions[index]
+        if instruction.op == "SD":
+            if instruction.commitTime != -1:
+                return instruction.commitTime
+            return instruction.writeTime - simulator.config.cycle_writeback
+        return instruction.writeTime
+
+    def done(self, simulator, index):
+        # cycle an instruction stops holding up the ones that wait for it: the write
+        # back of a result, or for a store that a load waits for, the cycle its
+        # station frees and memory holds the data
+        if simulator.instructions[index].op == "SD":
+            return self.release(simulator, index)
+        return simulator.instructions[index].writeTime
+
+    def report(self, simulator):
+        # one row per instruction with its latency split in the five parts
+        config = simulator.config
+        rows = []
+        for i in range(len(simulator.instructions)):
+            instruction = simulator.instructions[i]
+            first = self.first.get(i, instruction.issueTime)
+            ready = instruction.issueTime
+            for j in self.producers.get(i, ()):
+                ready = max(ready, self.done(simulator, j))
+            latency = self.latencies.get(i, config.getExecuteTime(instruction.op))
+            execution = latency + config.cycle_writeback
+            unit = self.started[i] - ready - 1 if i in self.started else 0
+            cdb = 0
+            if instruction.op != "SD":
+                cdb = max(0, instruction.writeTime - ready - unit - execution)
+            rows.append({
+                "index": i,
+                "instruction": instruction.toString(),
+                "first": first,
+                "issue": instruction.issueTime,
+                "ready": ready,
+                "write": instruction.writeTime,
+                "structural": instruction.issueTime - first,
+                "raw": ready - instruction.issueTime,
+                "unit": unit,
+                "execution": execution,
+                "cdb": cdb,
+                "total": instruction.writeTime - first,
+            })
+        return rows
+
+    def criticalPath(self, simulator, rows=None):
+        # walk back from the instruction that wrote last, following whatever held
+        # each instruction up: its last operand (raw), the instruction that freed its
+        # station (structural), the commit that freed a reorder buffer entry (rob),
+        # or the instruction issued before it (issue)
+        if rows is None:
+            rows = self.report(simulator)
+        if not rows:
+            return []
+        instructions = simulator.instructions
+        pool_of = {}
+        for i in range(len(instructions)):
+            pool_of[i] = simulator.poolFor(instructions[i].op)
+        current = max(range(len(rows)), key=lambda i: (rows[i]["write"], -i))
+        path = []
+        while True:
+            row = rows[current]
+            previous = None
+            reason = "start"
+            if row["raw"] > 0:
+                previous = max(self.producers[current], key=lambda j: self.done(simulator, j))
+                reason = "raw"
+            elif row["structural"] > 0:
+                for j in range(current - 1, -1, -1):
+                    if pool_of[j] is pool_of[current] and self.release(simulator, j) == row["issue"]:
+                        previous = j
+                        reason = "structural"
+                        break
+                    if instructions[j].commitTime == row["issue"]:
+                        previous = j
+                        reason = "rob"
+                        break
+            if previous is None and current > 0:
+                previous = current - 1
+                reason = "issue"
+            path.append({"index": current, "instruction": row["instruction"], "reason": reason,
+                         "write": row["write"]})
+            if previous is None:
+                break
+            current = previous
+        path.reverse()
+        return path
+
+
+def analyze(program, config=None, engine="cycle"):
+    analysis = StallAnalysis()
+    simulator = Simulator(program, config, engine=engine, hooks=[analysis])
+    simulator.run()
+    rows = analysis.report(simulator)
+    return rows, analysis.criticalPath(simulator, rows)
+
+
+def format_report(rows, path):
+    lines = ["%-26s %5s %5s %5s %5s | %10s %5s %5s %9s %5s %5s" % ("instruction", "first", "issue", "ready", "write",
+                                                                   "structural", "raw", "unit", "execution", "cdb", "total")]
+    for row in rows:
+        lines.append("%-26s %5d %5d %5d %5d | %10d %5d %5d %9d %5d %5d" % (
+            str(row["index"]) + ": " + row["instruction"], row["first"], row["issue"], row["ready"], row["write"],
+            row["structural"], row["raw"], row["unit"], row["execution"], row["cdb"], row["total"]))
+    totals = [sum(row[name] for row in rows) for name in ("structural", "raw", "unit", "execution", "cdb")]
+    lines.append("%-50s | %10d %5d %5d %9d %5d" % ("sum", totals[0], totals[1], totals[2], totals[3], totals[4]))
+    lines.append("")
+    lines.append("critical path:")
+    for hop in path:
+        lines.append("  %-8s %3d: %-20s write %d" % (hop["reason"], hop["index"], hop["instruction"], hop["write"]))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="stall attribution and critical path of a trace")
+    parser.add_argument("input")
+    parser.add_argument("--engine", choices=("cycle", "event"), default="cycle")
+    parser.add_argument("--json", help="write the rows and the path to this file instead")
+    args = parser.parse_args(argv)
+
+    rows, path = analyze(load_program(args.input), Config(), args.engine)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"instructions": rows, "critical_path": path}, file, indent=1)
+    else:
+        sys.stdout.write(format_report(rows, path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import numpy as np
+
+from decode import DecodedProgram, LoopProgram, decode_fields, latency_table
+from tomasulo import Config, as_tuple, load_program
+
+# batch engine: B machine configurations, or B programs of the same length, advance
+# in lockstep. The stations are a struct of arrays with a leading batch dimension
+# (busy flags, remaining times, the tags they wait for, their instruction) and every
+# phase of a cycle is a handful of vectorized operations over the whole batch
+#
+#   result = run_batch(load_program("input1.txt"), [Config(cycle_mul=m) for m in range(1, 40)])
+#   result.cycles, result.issue[b], result.write[b]
+#
+# it gives the cycle counts and issue/write times of Simulator, but keeps no symbolic
+# values and models the original machine only: one issue and a bus for every result
+# per cycle, no reorder buffer, shared units, memory ordering or cache
+
+POOL_OF_OP = np.array([0, 0, 1, 1, 2, 3]) # add, mul, load, store
+WAITING = 9999 # time of a station waiting for its operands, as Reservation.free() leaves it
+
+# what a config must leave at its default for this engine
+UNSUPPORTED = {"issue_width": 1, "num_cdb": 0, "num_add_units": 0, "num_mul_units": 0, "rob_size": 0,
+               "disambiguate": 0, "forward": 0, "cache_size": 0}
+
+
+def check(config):
+    for name, value in UNSUPPORTED.items():
+        if getattr(config, name) != value:
+            raise ValueError("the batch engine does not model " + name + "=" + str(getattr(config, name)))
+
+
+def decode(program):
+    # (op, dest, src1, src2) per instruction as int arrays, -1 where there is no register;
+    # the register a SD stores is its first source. A DecodedProgram already has them
+    # as columns
+    if isinstance(program, DecodedProgram):
+        ops = np.frombuffer(program.column(0), dtype=np.int8)
+        return (ops,) + tuple(np.frombuffer(program.column(k), dtype=np.int8).astype(np.int16) for k in (1, 2, 3))
+    n = len(program)
+    ops = np.empty(n, dtype=np.int8)
+    dest = np.full(n, -1, dtype=np.int16)
+    src1 = np.full(n, -1, dtype=np.int16)
+    src2 = np.full(n, -1, dtype=np.int16)
+    for i, instruction in enumerate(program):
+        ops[i], dest[i], src1[i], src2[i], address = decode_fields(*as_tuple(instruction))
+    return ops, dest, src1, src2
+
+
+class BatchResult:
+    def __init__(self, cycles, issue, write, utilization):
+        self.cycles = cycles # (B,)
+        self.issue = issue # (B, N) issue cycle of every instruction
+        self.write = write # (B, N) write back cycle, execution completes one cycle before
+        self.utilization = utilization # (B, 4) busy fraction of the add, mul, load and store stations
+
+    def __len__(self):
+        return len(self.cycles)
+
+    def summary(self, b):
+        # the same dict as Simulator.summary(), without the steps
+        cycles = int(self.cycles[b])
+        instructions = self.issue.shape[1]
+        return {
+            "cycles": cycles,
+            "instructions": instructions,
+            "ipc": instructions / cycles if cycles else 0.0,
+            # there are no shared units in this engine
+            "utilization": dict(zip(("add", "mul", "load", "store", "add_units", "mul_units"),
+                                    [float(u) for u in self.utilization[b]] + [0.0, 0.0])),
+            "timings": [(int(i), int(w) - 1, int(w)) for i, w in zip(self.issue[b], self.write[b])],
+        }
+
+
+class BatchEngine:
+    # programs is one program for every config, or one program per config, all of the
+    # same length
+    def __init__(self, programs, configs):
+        configs = list(configs)
+        if not configs:
+            raise ValueError("no configs")
+        for config in configs:
+            check(config)
+        if (isinstance(programs, (DecodedProgram, LoopProgram)) or not programs
+                or not isinstance(programs[0], (list, tuple, DecodedProgram, LoopProgram))
+                or isinstance(programs[0][0], str)):
+            programs = [programs]
+        decoded = [decode(program) for program in programs]
+        if len({len(d[0]) for d in decoded}) != 1:
+            raise ValueError("the programs of a batch must have the same length")
+        if len(decoded) != 1 and len(decoded) != len(configs):
+            raise ValueError("give one program, or one program per config")
+        B = len(configs)
+        self.B = B
+        self.N = len(decoded[0][0])
+        # (B, N) views, a single program is broadcast over the batch
+        self.ops, self.dest, self.src1, self.src2 = (np.broadcast_to(np.stack([d[k] for d in decoded]), (B, self.N))
+                                                     for k in range(4))
+
+        # stations of every type, padded to the largest count in the batch
+        counts = np.array([[c.num_add, c.num_mul, c.num_load, c.num_store] for c in configs])
+        widths = counts.max(0)
+        self.pool = np.repeat(np.arange(4), widths) # (S,) unit type of each station
+        first = np.concatenate(([0], np.cumsum(widths)[:-1]))
+        slot = np.arange(len(self.pool)) - first[self.pool] # position in its own pool
+        self.exists = slot[None, :] < counts[:, self.pool] # (B, S)
+        self.counts = counts
+        self.isStore = self.pool == 3
+        self.onehot = (self.pool[:, None] == np.arange(4)[None, :]).astype(np.int64) # (S, 4)
+
+        self.latency = np.array([latency_table(c) for c in configs], dtype=np.int64) # (B, 6), by opcode
+        self.writeback = np.array([c.cycle_writeback for c in configs], dtype=np.int64) # (B,)
+
+    def reset(self):
+        B, S = self.exists.shape
+        self.busy = np.zeros((B, S), dtype=bool)
+        self.time = np.full((B, S), WAITING, dtype=np.int64)
+        self.tag1 = np.full((B, S), -1, dtype=np.int64) # station whose result the operand waits for
+        self.tag2 = np.full((B, S), -1, dtype=np.int64)
+        self.inst = np.full((B, S), -1, dtype=np.int64)
+        self.lat = np.zeros((B, S), dtype=np.int64) # latency of the operation in the station
+        self.fu = np.full((B, 32), -1, dtype=np.int64) # station writing each register
+        self.pc = np.zeros(B, dtype=np.int64)
+        self.issueTime = np.full((B, self.N), -1, dtype=np.int64)
+        self.writeTime = np.full((B, self.N), -1, dtype=np.int64)
+        self.busyCycles = np.zeros((B, 4), dtype=np.int64)
+        self.cycles = np.full(B, -1, dtype=np.int64)
+        self.cycle = 0
+
+    def write_back(self):
+        busy = self.busy
+        finished = busy & (self.time == 0) & ~self.isStore
+        if not finished.any():
+            return
+        rows = np.arange(self.B)[:, None]
+        # registers still waiting for a finished station take its result
+        fu = self.fu
+        fu[(fu >= 0) & finished[rows, np.maximum(fu, 0)]] = -1
+        # so do the stations waiting for it
+        got1 = (self.tag1 >= 0) & finished[rows, np.maximum(self.tag1, 0)]
+        got2 = (self.tag2 >= 0) & finished[rows, np.maximum(self.tag2, 0)]
+        self.tag1[got1] = -1
+        self.tag2[got2] = -1
+        ready = (got1 | got2) & (self.tag1 < 0) & (self.tag2 < 0) & busy
+        if ready.any():
+            b, s = np.nonzero(ready)
+            self.time[b, s] = self.lat[b, s] + self.writeback[b]
+            self.writeTime[b, self.inst[b, s]] = self.cycle + self.lat[b, s] + self.writeback[b]
+        busy[finished] = False
+        self.time[finished] = WAITING
+
+    def execute(self):
+        busy = self.busy
+        self.busyCycles += busy.astype(np.int64) @ self.onehot
+        self.time -= busy & (self.time > 0)
+        # a store frees itself once its time is up
+        stored = busy & self.isStore & (self.time == 0)
+        busy[stored] = False
+        self.time[stored] = WAITING
+
+    def issue(self):
+        b = np.nonzero(self.pc < self.N)[0]
+        if len(b) == 0:
+            return
+        i = self.pc[b]
+        op = self.ops[b, i]
+        # the lowest free station of the right type, if there is one
+        free = self.exists[b] & ~self.busy[b] & (self.pool[None, :] == POOL_OF_OP[op][:, None])
+        can = free.any(1)
+        b, i, op = b[can], i[can], op[can]
+        s = free[can].argmax(1)
+        r1 = self.src1[b, i]
+        r2 = self.src2[b, i]
+        t1 = np.where(r1 >= 0, self.fu[b, np.maximum(r1, 0)], -1)
+        t2 = np.where(r2 >= 0, self.fu[b, np.maximum(r2, 0)], -1)
+        ready = (t1 < 0) & (t2 < 0)
+        lat = self.latency[b, op]
+        self.busy[b, s] = True
+        self.tag1[b, s] = t1
+        self.tag2[b, s] = t2
+        self.time[b, s] = np.where(ready, lat, WAITING)
+        self.inst[b, s] = i
+        self.lat[b, s] = lat
+        self.issueTime[b, i] = self.cycle
+        self.writeTime[b, i] = np.where(ready, self.cycle + lat + self.writeback[b], -1)
+        # the sources are read before the destination is taken over
+        d = self.dest[b, i]
+        has = d >= 0
+        self.fu[b[has], d[has]] = s[has]
+        self.pc[b] += 1
+
+    def run(self):
+        self.reset()
+        while True:
+            # a finished machine stays idle, so the whole batch keeps stepping until
+            # the last one is done
+            done = ~self.busy.any(1) & (self.pc >= self.N)
+            self.cycles[done & (self.cycles < 0)] = self.cycle
+            if done.all():
+                break
+            self.cycle += 1
+            self.write_back()
+            self.execute()
+            self.issue()
+        sizes = np.maximum(self.counts, 1) * np.maximum(self.cycles, 1)[:, None]
+        utilization = np.where(self.counts > 0, self.busyCycles / sizes, 0.0)
+        return BatchResult(self.cycles.copy(), self.issueTime, self.writeTime, utilization)
+
+
+def run_batch(programs, configs):
+    return BatchEngine(programs, configs).run()
+
+
+if __name__ == "__main__":
+    # python batch.py trace.txt: cycles for a range of multiply latencies
+    import sys
+    import time
+    program = load_program(sys.argv[1])
+    configs = [Config(cycle_mul=mul, cycle_div=div) for mul in range(1, 41) for div in range(1, 41)]
+    start = time.perf_counter()
+    result = run_batch(program, configs)
+    wall = time.perf_counter() - start
+    print("%d configurations in %.3fs, %.0f per second" % (len(configs), wall, len(configs) / wall))
+    print("cycles from %d to %d" % (result.cycles.min(), result.cycles.max()))
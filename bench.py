@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from metrics import Metrics
+from tomasulo import PHASES, Config, Hook, Simulator
+from tracing import TRACE_FULL, TRACE_NONE, TRACE_SAMPLED, TraceSink
+
+# benchmark suite: seeded synthetic workloads, simulated cycles per wall clock
+# second, and the time and peak memory spent in each phase of the engine
+#
+# python bench.py                       run the default sizes and print the table
+# python bench.py --check               also compare the cycle counts with
+#                                       bench_baseline.json and the reference traces
+#                                       output1.txt/output2.txt
+# python bench.py --check --throughput  and the throughput, scaled by the speed of
+#                                       this host over the one of the baseline
+# python bench.py --save                write the numbers as the new baseline
+# python bench.py --sampling 200000     compare sampled runs (sampling.py) with full ones
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "bench_baseline.json")
+# traces whose full output must stay byte for byte the same with the default machine,
+# which has no reorder buffer
+REFERENCES = (("input1.txt", "output1.txt"), ("input2.txt", "output2.txt"))
+
+WORKLOADS = ("raw_chain", "independent", "station_starved", "store_heavy")
+DEFAULT_SIZES = (100, 1000, 10000)
+# print_state renders one cycle in TRACE_EVERY by default: a full text trace of a
+# long RAW chain is quadratic in the chain length whatever the engine does
+TRACE_EVERY = 100
+# runs shorter than this are too noisy to compare their throughput
+MIN_WALL = 0.1
+CALIBRATION_ROUNDS = 5
+
+
+def fp(i):
+    return "F" + str(i)
+
+
+def address(rng):
+    # offset and base register of a LD/SD, in the format of input1.txt
+    offset = rng.randrange(0, 64, 8)
+    return ("0" if offset == 0 else str(offset) + "+"), "R" + str(rng.randrange(1, 4))
+
+
+def generate(kind, size, seed=0):
+    # a program of size instructions, as (op, dest, src1, src2)
+    rng = random.Random(str(seed) + kind + str(size))
+    program = []
+    if kind == "raw_chain":
+        # every instruction needs the result of the one before it
+        program.append(("LD", "F2", "0", "R1"))
+        while len(program) < size:
+            op = rng.choice(("ADDD", "SUBD", "MULTD", "DIVD", "ADDD", "MULTD"))
+            program.append((op, "F2", "F2", fp(rng.randrange(4, 12, 2))))
+    elif kind == "independent":
+        # results are never read again, sources are registers nobody writes
+        while len(program) < size:
+            op = rng.choice(("ADDD", "SUBD", "MULTD", "LD", "ADDD", "LD"))
+            dest = fp(len(program) % 10 * 2)
+            if op == "LD":
+                offset, base = address(rng)
+                program.append((op, dest, offset, base))
+            else:
+                program.append((op, dest, fp(rng.randrange(20, 32, 2)), fp(rng.randrange(20, 32, 2))))
+    elif kind == "station_starved":
+        # long MULTD/DIVD bursts that keep the two Mult stations full
+        while len(program) < size:
+            op = rng.choice(("MULTD", "DIVD", "MULTD", "DIVD", "ADDD"))
+            program.append((op, fp(len(program) % 8 * 2), fp(rng.randrange(0, 32, 2)), fp(rng.randrange(0, 32, 2))))
+    elif kind == "store_heavy":
+        # half of the program stores values that were just loaded or computed
+        while len(program) < size:
+            r = rng.random()
+            offset, base = address(rng)
+            if r < 0.5:
+                program.append(("SD", fp(rng.randrange(0, 12, 2)), offset, base))
+            elif r < 0.75:
+                program.append(("LD", fp(rng.randrange(0, 12, 2)), offset, base))
+            else:
+                program.append(("ADDD", fp(rng.randrange(0, 12, 2)), fp(rng.randrange(0, 12, 2)), fp(rng.randrange(0, 12, 2))))
+    else:
+        raise ValueError("unknown workload: " + kind)
+    return program[:size]
+
+
+def write_trace(path, program):
+    with open(path, "w") as file:
+        for instruction in program:
+            file.write(" ".join(instruction) + "\n")
+
+
+class PhaseMemory(Hook):
+    # the largest amount of memory a single call of each phase allocated
+    def __init__(self):
+        self.peaks = dict.fromkeys(PHASES, 0)
+        self.current = 0
+
+    def before(self, simulator, phase):
+        tracemalloc.reset_peak()
+        self.current = tracemalloc.get_traced_memory()[0]
+
+    def after(self, simulator, phase, result):
+        self.peaks[phase] = max(self.peaks[phase], tracemalloc.get_traced_memory()[1] - self.current)
+
+
+def make_sink(every):
+    # the trace is rendered into os.devnull, so that print_state costs what it costs
+    # in a real run; every 0 turns the trace off, 1 renders every cycle
+    if every == 0:
+        return TraceSink(None, TRACE_NONE)
+    if every == 1:
+        return TraceSink(os.devnull, TRACE_FULL)
+    return TraceSink(os.devnull, TRACE_SAMPLED, every)
+
+
+def run_one(program, engine="cycle", config=None, memory=True, every=TRACE_EVERY):
+    # one row of the table
+    row = {}
+    sink = make_sink(every)
+    metrics = Metrics(per_cycle=False)
+    simulator = Simulator(program, config, engine=engine, sink=sink, hooks=[metrics])
+    start = time.perf_counter()
+    result = simulator.run()
+    wall = time.perf_counter() - start
+    simulator.close()
+    row["cycles"] = result["cycles"]
+    row["steps"] = result["steps"]
+    row["wall"] = wall
+    row["cycles_per_sec"] = result["cycles"] / wall if wall > 0 else 0.0
+    for name in PHASES:
+        row[name + "_sec"] = metrics.seconds.get(name, 0.0)
+
+    if memory:
+        # a second run, tracemalloc slows everything down too much to time it
+        sink = make_sink(every)
+        memory = PhaseMemory()
+        simulator = Simulator(program, config, engine=engine, sink=sink, hooks=[memory])
+        tracemalloc.start()
+        simulator.run()
+        row["peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+        simulator.close()
+        for name in PHASES:
+            row[name + "_kb"] = memory.peaks[name] / 1024
+    return row
+
+
+def run_suite(workloads=WORKLOADS, sizes=DEFAULT_SIZES, engines=("cycle", "event"), seed=0, memory=True, out=None, every=TRACE_EVERY):
+    rows = []
+    for kind in workloads:
+        for size in sizes:
+            program = generate(kind, size, seed)
+            for engine in engines:
+                row = {"workload": kind, "size": size, "engine": engine}
+                row.update(run_one(program, engine, memory=memory, every=every))
+                rows.append(row)
+                if out is not None:
+                    out.write(format_row(row) + "\n")
+                    out.flush()
+    return rows
+
+
+def key(row):
+    return row["workload"] + "/" + str(row["size"]) + "/" + row["engine"]
+
+
+def format_row(row):
+    text = "%-16s %8d %-6s %9d cycles %10.0f cycles/s" % (row["workload"], row["size"], row["engine"], row["cycles"], row["cycles_per_sec"])
+    text += "  " + " ".join("%s %.3fs" % (name, row[name + "_sec"]) for name in PHASES)
+    if "peak_kb" in row:
+        text += "  peak %.0fKB " % row["peak_kb"] + " ".join("%s %.1fKB" % (name, row[name + "_kb"]) for name in PHASES)
+    return text
+
+
+def calibrate(rounds=CALIBRATION_ROUNDS):
+    # speed of this host at the kind of work the simulator does (attribute access,
+    # small dicts and lists), in loops per second, best of rounds; it does not
+    # depend on the simulator, so a slower simulator shows against it
+    class Slot:
+        def __init__(self):
+            self.time = 0
+            self.busy = False
+
+    best = 0.0
+    for _ in range(rounds):
+        slots = [Slot() for i in range(16)]
+        table = {}
+        start = time.perf_counter()
+        for i in range(100000):
+            slot = slots[i & 15]
+            slot.busy = not slot.busy
+            slot.time = (slot.time + i) % 97
+            table[slot.time] = table.get(slot.time, 0) + 1
+        best = max(best, 100000 / (time.perf_counter() - start))
+    return best
+
+
+def load_baseline(path=BASELINE_FILE):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_baseline(rows, path=BASELINE_FILE, calibration=None):
+    baseline = {"calibration": round(calibrate() if calibration is None else calibration)}
+    for row in rows:
+        baseline[key(row)] = {"cycles": row["cycles"], "cycles_per_sec": round(row["cycles_per_sec"])}
+    with open(path, "w") as file:
+        json.dump(baseline, file, indent=1, sort_keys=True)
+        file.write("\n")
+
+
+def check_baseline(rows, baseline, tolerance=0.5, throughput=False, calibration=None):
+    # the simulated cycle count must not change at all. With throughput, the cycles
+    # per second may drop by tolerance before it counts as a regression; the
+    # baseline was measured on one machine, so it is scaled by calibration, the
+    # calibrate() of this host, over the one saved with it
+    problems = []
+    scale = None
+    if throughput:
+        if "calibration" not in baseline:
+            problems.append("the baseline has no calibration, save it again to compare throughput")
+        else:
+            if calibration is None:
+                calibration = calibrate()
+            scale = calibration / baseline["calibration"]
+    for row in rows:
+        expected = baseline.get(key(row))
+        if expected is None:
+            continue
+        if row["cycles"] != expected["cycles"]:
+            problems.append(key(row) + ": " + str(row["cycles"]) + " cycles, baseline " + str(expected["cycles"]))
+        if scale is not None and row["wall"] >= MIN_WALL:
+            wanted = expected["cycles_per_sec"] * scale
+            if row["cycles_per_sec"] < wanted * (1 - tolerance):
+                problems.append(key(row) + ": %.0f cycles/s, baseline %d scaled to this host %.0f" % (
+                    row["cycles_per_sec"], expected["cycles_per_sec"], wanted))
+    return problems
+
+
+def check_reference(engines=("cycle", "event"), references=REFERENCES):
+    # the full text trace of every reference input, compared with its output file
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        for engine in engines:
+            for input_file, output_file in references:
+                path = os.path.join(directory, engine + "_" + output_file)
+                simulator = Simulator.fromFile(os.path.join(HERE, input_file), Config(), path, engine=engine)
+                simulator.run()
+                simulator.close()
+                with open(path, "r") as file:
+                    text = file.read()
+                with open(os.path.join(HERE, output_file), "r") as file:
+                    if text != file.read():
+                        problems.append(input_file + "/" + engine + ": trace differs from " + output_file)
+    return problems
+
+
+def check_sampling(workloads=WORKLOADS, size=200000, configs=None, rate=0.02, window=500, tolerance=0.05,
+                   seed=0, out=None):
+    # every workload in full and sampled, the estimate must be within tolerance of
+    # the real cycle count; whether the confidence interval holds it is reported
+    from sampling import Sampler
+    if configs is None:
+        configs = (("base", Config()), ("rob", Config(rob_size=8)), ("cache", Config(cache_size=1024)))
+    problems = []
+    covered = 0
+    runs = 0
+    for kind in workloads:
+        program = generate(kind, size, seed)
+        for name, config in configs:
+            start = time.perf_counter()
+            cycles = Simulator(program, config, engine="event", symbolic=False).run()["cycles"]
+            wall = time.perf_counter() - start
+            result = Sampler(config, rate, window, seed=seed).run(program)
+            low, high = result.cyclesInterval()
+            error = (result.cycles - cycles) / cycles
+            runs += 1
+            covered += low <= cycles <= high
+            if out is not None:
+                out.write("%-16s %-6s %9d cycles, sampled %11.0f [%.0f, %.0f] %+6.2f%%  %5.1fx faster\n" % (
+                    kind, name, cycles, result.cycles, low, high, error * 100, wall / max(result.wall, 1e-9)))
+            if abs(error) > tolerance:
+                problems.append("%s/%s sampled: %+.2f%% off %d cycles" % (kind, name, error * 100, cycles))
+    if out is not None and runs:
+        out.write("%d of %d confidence intervals hold the full run\n" % (covered, runs))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the tomasulo simulator")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="e.g. 100,1000,1000000")
+    parser.add_argument("--engines", default="cycle,event")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--trace-every", type=int, default=TRACE_EVERY, help="render one cycle in N, 0 for no trace")
+    parser.add_argument("--save", action="store_true", help="write the results to " + os.path.basename(BASELINE_FILE))
+    parser.add_argument("--check", action="store_true", help="fail if the cycle counts differ from the baseline")
+    parser.add_argument("--throughput", action="store_true", help="with --check, also fail on a throughput drop")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed throughput drop for --throughput")
+    parser.add_argument("--write-traces", metavar="DIR", help="also write the generated programs as trace files")
+    parser.add_argument("--sampling", type=int, default=0, metavar="SIZE",
+                        help="also validate sampled simulation on programs of SIZE instructions")
+    args = parser.parse_args(argv)
+
+    workloads = args.workloads.split(",")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.write_traces:
+        for kind in workloads:
+            for size in sizes:
+                write_trace(os.path.join(args.write_traces, kind + "_" + str(size) + ".txt"), generate(kind, size, args.seed))
+    rows = run_suite(workloads, sizes, args.engines.split(","), args.seed, not args.no_memory, sys.stdout, args.trace_every)
+    if args.save:
+        save_baseline(rows)
+    sampled = []
+    if args.sampling:
+        sampled = check_sampling(workloads, args.sampling, seed=args.seed, out=sys.stdout)
+    if args.check:
+        problems = check_reference(args.engines.split(","))
+        problems += check_baseline(rows, load_baseline(), args.tolerance, args.throughput)
+        problems += sampled
+        for problem in problems:
+            print("REGRESSION " + problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import mmap
+import struct
+import sys
+
+from tracing import render_state
+
+# compact binary trace: a cycle only stores the station lines and register fields
+# that changed since the cycle before, every keyframe_every-th cycle stores all of
+# them, and an index at the end of the file maps cycles to record offsets
+#
+# file layout (little endian):
+#   header   MAGIC, version u16, keyframe_every u32, stations u16, registers u16
+#   record   kind u8, cycle u64, count u32, then count x (row u16, length u32, utf-8 text)
+#   final    kind u8, length u32, utf-8 text of the final table
+#   index    records x (cycle u64, offset u64, kind u8)
+#   trailer  index offset u64, records u64, final offset u64 (0 if none), INDEX_MAGIC
+
+MAGIC = b"TOMTRACE"
+INDEX_MAGIC = b"TOMINDEX"
+VERSION = 1
+
+KEYFRAME = 1
+DELTA = 2
+FINAL = 3
+
+HEADER = struct.Struct("<8sHIHH")
+RECORD = struct.Struct("<BQI")
+ENTRY = struct.Struct("<HI")
+TEXT = struct.Struct("<BI")
+INDEX = struct.Struct("<QQB")
+TRAILER = struct.Struct("<QQQ8s")
+
+
+class BinaryTraceSink:
+    # the binary counterpart of tracing.TraceSink, it takes the same calls
+    def __init__(self, path, every=1, keyframe_every=256):
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        if keyframe_every < 1:
+            raise ValueError("keyframe_every must be at least 1")
+        self.path = path
+        self.every = every
+        self.keyframe_every = keyframe_every
+        self.file = None
+        self.offset = 0 # bytes written so far
+        self.rows = None # rows of the last record
+        self.index = [] # (cycle, offset, kind) of every record
+        self.final_offset = 0
+
+    def wantsCycle(self, cycle):
+        return cycle % self.every == 0
+
+    def wantsFinal(self):
+        return True
+
+    def emit(self, data):
+        self.file.write(data)
+        self.offset += len(data)
+
+    def writeState(self, cycle, stations, registers):
+        rows = stations + registers
+        if self.file is None:
+            self.file = open(self.path, "wb")
+            self.emit(HEADER.pack(MAGIC, VERSION, self.keyframe_every, len(stations), len(registers)))
+        if self.rows is None or len(self.index) % self.keyframe_every == 0:
+            kind = KEYFRAME
+            changed = range(len(rows))
+        else:
+            kind = DELTA
+            previous = self.rows
+            changed = [i for i in range(len(rows)) if rows[i] != previous[i]]
+        self.index.append((cycle, self.offset, kind))
+        parts = [RECORD.pack(kind, cycle, len(changed))]
+        for i in changed:
+            text = rows[i].encode("utf-8")
+            parts.append(ENTRY.pack(i, len(text)))
+            parts.append(text)
+        self.emit(b"".join(parts))
+        self.rows = rows
+
+    def writeFinal(self, text):
+        if self.file is None:
+            return
+        data = text.encode("utf-8")
+        self.final_offset = self.offset
+        self.emit(TEXT.pack(FINAL, len(data)) + data)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        # the index is written once, when the trace is complete
+        if self.file is None:
+            return
+        index_offset = self.offset
+        for entry in self.index:
+            self.emit(INDEX.pack(*entry))
+        self.emit(TRAILER.pack(index_offset, len(self.index), self.final_offset, INDEX_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BinaryTraceReader:
+    # random access to a binary trace through mmap: the state of a cycle is rebuilt
+    # from the keyframe before it, so at most keyframe_every records are read
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.keyframe_every, self.num_stations, self.num_registers = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a binary trace")
+        if version != VERSION:
+            raise ValueError("unsupported binary trace version " + str(version))
+        self.index_offset, self.records, self.final_offset, magic = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        if magic != INDEX_MAGIC:
+            raise ValueError(path + " has no index, the trace was not closed")
+
+    def __len__(self):
+        return self.records
+
+    def entry(self, i):
+        return INDEX.unpack_from(self.data, self.index_offset + i * INDEX.size)
+
+    def cycles(self):
+        for i in range(self.records):
+            yield self.entry(i)[0]
+
+    def find(self, cycle):
+        # binary search over the index, which stays in the mapped file
+        low, high = 0, self.records
+        while low < high:
+            mid = (low + high) // 2
+            if self.entry(mid)[0] < cycle:
+                low = mid + 1
+            else:
+                high = mid
+        if low == self.records or self.entry(low)[0] != cycle:
+            raise KeyError("cycle " + str(cycle) + " is not in the trace")
+        return low
+
+    def rows(self, cycle):
+        # the station lines and register fields of a cycle, as Simulator.stateRows()
+        last = self.find(cycle)
+        first = last
+        while self.entry(first)[2] != KEYFRAME:
+            first -= 1
+        rows = [""] * (self.num_stations + self.num_registers)
+        data = self.data
+        for i in range(first, last + 1):
+            offset = self.entry(i)[1]
+            kind, record_cycle, count = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            for j in range(count):
+                row, length = ENTRY.unpack_from(data, offset)
+                offset += ENTRY.size
+                rows[row] = data[offset:offset + length].decode("utf-8")
+                offset += length
+        return rows[:self.num_stations], rows[self.num_stations:]
+
+    def state(self, cycle):
+        # the same text print_state() writes for this cycle
+        stations, registers = self.rows(cycle)
+        return render_state(cycle, stations, registers)
+
+    def final(self):
+        if self.final_offset == 0:
+            return None
+        kind, length = TEXT.unpack_from(self.data, self.final_offset)
+        start = self.final_offset + TEXT.size
+        return self.data[start:start + length].decode("utf-8")
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    # python bintrace.py trace.bin [cycle ...]
+    with BinaryTraceReader(sys.argv[1]) as reader:
+        if len(sys.argv) > 2:
+            for cycle in sys.argv[2:]:
+                print(reader.state(int(cycle)))
+        else:
+            print(str(len(reader)) + " cycles, keyframe every " + str(reader.keyframe_every))
+            final = reader.final()
+            if final is not None:
+                print(final)
@@ -0,0 +1,232 @@
+import argparse
+import sys
+from array import array
+
+from decode import DecodedProgram, Op, decode_fields
+from tomasulo import Config, Simulator, as_tuple, load_program
+
+# static dependency graph of a program and analytic bounds on its cycle count, a
+# cheap estimate before paying for a simulation
+#
+#   graph = DependencyGraph(load_program("input2.txt"))
+#   low, high = graph.bounds(Config())
+#
+# the graph is built in one pass and every bound in another, both linear in the
+# length of the program
+#
+# lower bound, the larger of
+#   dataflow  every instruction writes no earlier than its issue (one per issue_width
+#             per cycle, in order) or its last RAW producer, plus its smallest latency
+#   resource  the stations, functional units, reorder buffer entries and buses of
+#             each kind cannot hold more operation cycles than they have
+# upper bound
+#   serial    every instruction issues only after all of the older ones are done,
+#             with the largest latency it can have
+
+OPS = tuple(op.name for op in Op)
+POOLS = ("add", "add", "mul", "mul", "load", "store") # station type of each op
+
+
+class DependencyGraph:
+    # RAW edges are kept per source operand, WAR and WAW per register write; memory
+    # RAW edges go from a SD to the next LD of the same address
+    def __init__(self, program):
+        self.ops = array("b") # opcode, see decode.Op
+        self.raw1 = array("l") # producer of the first source, -1 if it comes from the register file
+        self.raw2 = array("l")
+        self.waw = array("l") # previous writer of the destination, -1 if none
+        self.war = array("l") # (reader, writer) pairs, flattened
+        self.memory = array("l") # older store to the address of a load, -1 if none
+        writer = [-1] * 32 # last writer of each register
+        readers = [[] for i in range(32)] # readers of each register since its last write
+        stores = {} # address -> last store to it
+        if isinstance(program, DecodedProgram):
+            decoded = map(program.decoded, range(len(program)))
+        else:
+            decoded = (decode_fields(*as_tuple(instruction)) for instruction in program)
+        for i, (code, register, s1, s2, address) in enumerate(decoded):
+            self.ops.append(code)
+            if code == Op.SD:
+                # the register a store writes to memory is its only source
+                self.raw1.append(writer[s1])
+                self.raw2.append(-1)
+                readers[s1].append(i)
+                self.waw.append(-1)
+                self.memory.append(-1)
+                stores[address] = i
+                continue
+            if code == Op.LD:
+                self.raw1.append(-1)
+                self.raw2.append(-1)
+                self.memory.append(stores.get(address, -1))
+                sources = ()
+            else:
+                self.raw1.append(writer[s1])
+                self.raw2.append(writer[s2])
+                self.memory.append(-1)
+                sources = (s1, s2) if s1 != s2 else (s1,)
+            # the sources are read before the destination is written
+            for source in sources:
+                readers[source].append(i)
+            for reader in readers[register]:
+                if reader != i:
+                    self.war.append(reader)
+                    self.war.append(i)
+            readers[register] = []
+            self.waw.append(writer[register])
+            writer[register] = i
+
+    def __len__(self):
+        return len(self.ops)
+
+    def counts(self):
+        # number of instructions of each op
+        res = [0] * len(OPS)
+        for code in self.ops:
+            res[code] += 1
+        return res
+
+    def edges(self):
+        # (kind, from, to) of every edge, kind is "raw", "war", "waw" or "memory"
+        for i in range(len(self.ops)):
+            for producer in (self.raw1[i], self.raw2[i]):
+                if producer != -1:
+                    yield ("raw", producer, i)
+            if self.waw[i] != -1:
+                yield ("waw", self.waw[i], i)
+            if self.memory[i] != -1:
+                yield ("memory", self.memory[i], i)
+        for k in range(0, len(self.war), 2):
+            yield ("war", self.war[k], self.war[k + 1])
+
+    def latencies(self, config):
+        # (smallest, largest) execute latency of each op under config
+        low = [config.getExecuteTime(op) for op in OPS]
+        high = list(low)
+        memory = []
+        if config.cache_size:
+            memory = [config.cycle_hit, config.cycle_miss]
+        for code in (4, 5):
+            choices = memory + ([] if config.cache_size else [low[code]])
+            if code == 4 and config.forward:
+                choices.append(config.cycle_forward)
+            low[code] = min(choices)
+            high[code] = max(choices)
+        if config.num_add_units or config.num_mul_units:
+            # a unit that is still busy with an older operation delays the next one
+            for code in range(4):
+                if (code < 2 and config.num_add_units) or (code >= 2 and config.num_mul_units):
+                    high[code] = max(high[code], config.getInterval(OPS[code]))
+        return low, high
+
+    def dataflow(self, config):
+        # the dataflow lower bound, with every latency at its smallest
+        low = self.latencies(config)[0]
+        wb = config.cycle_writeback
+        commit = 1 if config.rob_size else 0
+        width = config.issue_width
+        # WAR and WAW do not delay anything, the tags rename them away; a load only
+        # waits for a store when memory is ordered, for its data when it is forwarded
+        forward = config.forward
+        memory = config.disambiguate and not forward
+        write = array("l", [0]) * len(self.ops)
+        end = 0
+        ops = self.ops
+        raw1 = self.raw1
+        raw2 = self.raw2
+        for i in range(len(ops)):
+            ready = i // width + 1 # earliest issue
+            p = raw1[i]
+            if p != -1 and write[p] > ready:
+                ready = write[p]
+            p = raw2[i]
+            if p != -1 and write[p] > ready:
+                ready = write[p]
+            code = ops[i]
+            store = self.memory[i]
+            if store != -1:
+                if forward:
+                    p = raw1[store]
+                    if p != -1 and write[p] > ready:
+                        ready = write[p]
+                elif memory and write[store] - wb > ready:
+                    ready = write[store] - wb
+            write[i] = ready + low[code] + wb
+            # a store is done one write back before its write time
+            done = (write[i] - wb if code == 5 else write[i]) + commit
+            if done > end:
+                end = done
+        return end
+
+    def resource(self, config):
+        # the resource lower bound: a station is held from the issue to the write
+        # back (to the end of the countdown for a store), an entry of the reorder
+        # buffer until the commit after that
+        low = self.latencies(config)[0]
+        counts = self.counts()
+        wb = config.cycle_writeback
+        held = {"add": 0, "mul": 0, "load": 0, "store": 0}
+        for code in range(len(OPS)):
+            held[POOLS[code]] += counts[code] * (low[code] + (0 if code == 5 else wb))
+        stations = {"add": config.num_add, "mul": config.num_mul, "load": config.num_load, "store": config.num_store}
+        bound = 0
+        for pool in held:
+            if held[pool]:
+                bound = max(bound, 1 + ceil(held[pool], stations[pool]))
+        for units, codes in ((config.num_add_units, (0, 1)), (config.num_mul_units, (2, 3))):
+            if units:
+                busy = sum(counts[code] * config.getInterval(OPS[code]) for code in codes)
+                if busy:
+                    bound = max(bound, 1 + ceil(busy, units))
+        n = len(self.ops)
+        results = n - counts[5]
+        if config.num_cdb and results:
+            bound = max(bound, ceil(results, config.num_cdb))
+        if config.rob_size and n:
+            entries = sum(counts[code] * (low[code] + (0 if code == 5 else wb) + 1) for code in range(len(OPS)))
+            bound = max(bound, 1 + ceil(entries, config.rob_size), ceil(n, config.commit_width))
+        return bound
+
+    def upper(self, config):
+        # the serial upper bound: with the older instructions all done, nothing can
+        # wait for a station, an operand, a unit, a bus or a commit
+        high = self.latencies(config)[1]
+        wb = config.cycle_writeback + (1 if config.rob_size else 0)
+        counts = self.counts()
+        if not len(self.ops):
+            return 0
+        return 1 + sum(counts[code] * (high[code] + wb) for code in range(len(OPS)))
+
+    def lower(self, config):
+        return max(self.dataflow(config), self.resource(config))
+
+    def bounds(self, config):
+        return self.lower(config), self.upper(config)
+
+
+def ceil(a, b):
+    return -(-a // b)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="dependency graph and cycle bounds of a trace")
+    parser.add_argument("input")
+    parser.add_argument("--simulate", action="store_true", help="also run the simulation to compare")
+    args = parser.parse_args(argv)
+
+    program = load_program(args.input)
+    graph = DependencyGraph(program)
+    config = Config()
+    kinds = {"raw": 0, "war": 0, "waw": 0, "memory": 0}
+    for kind, source, target in graph.edges():
+        kinds[kind] += 1
+    out = sys.stdout
+    out.write("%d instructions, edges: %s\n" % (len(graph), ", ".join("%s %d" % item for item in kinds.items())))
+    out.write("dataflow bound %d, resource bound %d, upper bound %d\n" % (
+        graph.dataflow(config), graph.resource(config), graph.upper(config)))
+    if args.simulate:
+        out.write("simulated %d cycles\n" % Simulator(program, config, engine="event").run()["cycles"])
+
+
+if __name__ == "__main__":
+    main()
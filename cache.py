@@ -0,0 +1,110 @@
+import heapq
+from array import array
+
+# set-associative data cache in front of the load and store buffers: the latency of
+# a LD/SD is cycle_hit or cycle_miss instead of cycle_load/cycle_store
+#
+# tags, LRU stamps and fill times live in flat arrays of sets x ways entries, so a
+# lookup touches one set and a million accesses allocate nothing
+
+# integer registers are never written by a trace, so every base register is taken to
+# point at its own region of memory, R<n> at n * BASE_STRIDE
+BASE_STRIDE = 1 << 20
+
+
+def address_of(address):
+    # byte address of a (base register, offset) pair from decode.parse_address
+    base, offset = address
+    return int(base[1:]) * BASE_STRIDE + offset
+
+
+class Cache:
+    # write-allocate, LRU replacement. A miss fills its line cycle_miss cycles after
+    # it starts; an access to a line whose fill is still on its way waits for it and
+    # counts as a hit. With mshrs > 0 at most that many misses are outstanding, a
+    # further miss starts when the oldest of them completes
+    def __init__(self, size, ways, line, hit, miss, mshrs=0):
+        if ways < 1 or line < 1 or size < ways * line or size % (ways * line) != 0:
+            raise ValueError("cache size must be a multiple of ways * line size")
+        self.sets = size // (ways * line)
+        self.ways = ways
+        self.line = line
+        self.hit = hit
+        self.miss = miss
+        self.mshrs = mshrs
+        self.tags = array("q", [-1]) * (self.sets * ways)
+        self.stamps = array("Q", [0]) * (self.sets * ways) # last access, the smallest is evicted
+        self.ready = array("q", [0]) * (self.sets * ways) # cycle the fill of the line completes
+        self.clock = 0
+        self.outstanding = [] # heap of the cycles the outstanding misses complete
+        self.accesses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def access(self, address, cycle):
+        # latency of an access to address that starts in cycle
+        line = address // self.line
+        tag = line // self.sets
+        first = (line % self.sets) * self.ways
+        tags = self.tags
+        stamps = self.stamps
+        self.clock += 1
+        self.accesses += 1
+        victim = first
+        for i in range(first, first + self.ways):
+            if tags[i] == tag:
+                stamps[i] = self.clock
+                self.hits += 1
+                return max(self.hit, self.ready[i] - cycle)
+            if stamps[i] < stamps[victim]:
+                victim = i
+        self.misses += 1
+        start = cycle
+        if self.mshrs:
+            outstanding = self.outstanding
+            while outstanding and outstanding[0] <= cycle:
+                heapq.heappop(outstanding)
+            if len(outstanding) >= self.mshrs:
+                start = heapq.heappop(outstanding)
+            heapq.heappush(outstanding, start + self.miss)
+        tags[victim] = tag
+        stamps[victim] = self.clock
+        self.ready[victim] = start + self.miss
+        return start - cycle + self.miss
+
+    def warm(self, address):
+        # functional access, as sampling.py fast-forwards: the line is brought in
+        # and becomes the most recent of its set, with no timing and no statistics
+        line = address // self.line
+        tag = line // self.sets
+        first = (line % self.sets) * self.ways
+        tags = self.tags
+        stamps = self.stamps
+        self.clock += 1
+        victim = first
+        for i in range(first, first + self.ways):
+            if tags[i] == tag:
+                stamps[i] = self.clock
+                return
+            if stamps[i] < stamps[victim]:
+                victim = i
+        tags[victim] = tag
+        stamps[victim] = self.clock
+        self.ready[victim] = 0
+
+    def settle(self):
+        # every fill completes and the statistics start over, for a simulation whose
+        # cycles count from 0 again; the tags and the LRU order are kept
+        self.ready = array("q", [0]) * len(self.ready)
+        self.outstanding = []
+        self.accesses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def hitRate(self):
+        if self.accesses == 0:
+            return 0.0
+        return self.hits / self.accesses
+
+    def stats(self):
+        return {"accesses": self.accesses, "hits": self.hits, "misses": self.misses, "hit_rate": self.hitRate()}
@@ -0,0 +1,442 @@
+import mmap
+import re
+from array import array
+from bisect import bisect_right
+from enum import IntEnum
+
+# decode stage: a trace line is checked and taken apart once, up front, into an
+# opcode, register indices and the (base register, offset) of a memory operand, so
+# that issuing an instruction does no string parsing
+#
+#   program = load("input1.txt") # DecodedProgram, a sequence of (op, dest, src1, src2)
+#   code, rd, rs1, rs2, address = program.decoded(0) # Op.LD, 6, -1, -1, ("R2", 34)
+#
+# rd is the register an instruction writes, rs1 and rs2 the ones it reads, -1 where
+# there is none; the register a SD writes to memory is its rs1. address is None
+# for the arithmetic ops
+#
+# a loop is written as a block that is run count times, blocks can be nested:
+#
+#   REPEAT 1000000 REG=2 OFFSET=8
+#   LD F2 0 R2
+#   MULTD F6 F2 F4
+#   SD F6 0 R3
+#   END
+#
+# iteration j adds j * REG to the index of every F register (modulo 32) and j * OFFSET
+# to every memory offset of the block, both are optional and 0 by default. Only the
+# body of a block is kept, a Loop gives out its iterations while it is iterated, so
+# the iteration count costs neither memory nor parse time
+
+
+class Op(IntEnum):
+    ADDD = 0
+    SUBD = 1
+    MULTD = 2
+    DIVD = 3
+    LD = 4
+    SD = 5
+
+
+OPCODES = {op.name: op for op in Op}
+# the config field holding the latency of each op, by opcode
+LATENCY_FIELDS = ("cycle_add", "cycle_sub", "cycle_mul", "cycle_div", "cycle_load", "cycle_store")
+NUM_REGISTERS = 32
+
+# the memory operand, its tokens joined: "34+R2", "34R2" for "34 R2", "0R1", "34(R2)"
+MEMORY_OPERAND = re.compile(r"([+-]?\d+)(\+?)\(?(R\d+)\)?$")
+REPEAT_OPTION = re.compile(r"(REG|OFFSET)=([+-]?\d+)")
+# a line of a trace that opens or closes a loop, found before the bulk decoder runs
+DIRECTIVE = re.compile(rb"^[ \t]*(?:REPEAT|END)(?:[ \t\r]|$)", re.IGNORECASE | re.MULTILINE)
+MEMO_SIZE = 1 << 16 # distinct instructions remembered by decode_fields
+
+
+class DecodeError(ValueError):
+    # a malformed trace line; line is its number in the file, counted from 1
+    def __init__(self, message, line=None, text=None):
+        if text is not None:
+            message += ": " + repr(text)
+        if line is not None:
+            message = "line " + str(line) + ": " + message
+        super().__init__(message)
+        self.line = line
+        self.text = text
+
+
+def latency_table(config):
+    # execute latency of each op under config, by opcode
+    return [getattr(config, name) for name in LATENCY_FIELDS]
+
+
+def register(text):
+    # index of a floating point register, "F6" -> 6
+    if len(text) < 2 or text[0] != "F" or not text[1:].isdigit():
+        raise DecodeError("expected a register F0..F" + str(NUM_REGISTERS - 1) + ", got " + repr(text))
+    index = int(text[1:])
+    if index >= NUM_REGISTERS:
+        raise DecodeError("no register " + text + ", the last one is F" + str(NUM_REGISTERS - 1))
+    return index
+
+
+def parse_address(offset, base):
+    # the memory operand of LD/SD as (base register, offset): "34+", "R2" -> ("R2", 34)
+    # and "0", "R1" -> ("R1", 0); integer registers are never written by a trace,
+    # so equal pairs are the same address
+    match = MEMORY_OPERAND.match(offset + base)
+    if match is None:
+        raise DecodeError("bad memory operand: " + offset + " " + base)
+    return (match.group(3), int(match.group(1)))
+
+
+_memo = {}
+
+
+def decode_fields(op, dest, src1, src2):
+    # (code, rd, rs1, rs2, address) of an instruction given as its four fields;
+    # the result of a distinct instruction is remembered, traces repeat them a lot
+    key = (op, dest, src1, src2)
+    fields = _memo.get(key)
+    if fields is not None:
+        return fields
+    code = OPCODES.get(op)
+    if code is None:
+        raise DecodeError("unknown operation " + repr(op) + ", expected one of " + ", ".join(OPCODES))
+    if code == Op.LD:
+        fields = (code, register(dest), -1, -1, parse_address(src1, src2))
+    elif code == Op.SD:
+        fields = (code, -1, register(dest), -1, parse_address(src1, src2))
+    else:
+        fields = (code, register(dest), register(src1), register(src2), None)
+    if len(_memo) >= MEMO_SIZE:
+        _memo.clear()
+    _memo[key] = fields
+    return fields
+
+
+def parse_line(text, line=None):
+    # the (op, dest, src1, src2) of one trace line, None for a blank one. The memory
+    # operand of LD/SD may be spaced in any way, "34+ R2", "34+R2" or "34 + R2", and
+    # comes back as ("34+", "R2"); commas between the operands and lower case are allowed
+    tokens = text.upper().replace(",", " ").split()
+    if not tokens:
+        return None
+    op = tokens[0]
+    try:
+        if op == "LD" or op == "SD":
+            if len(tokens) < 3:
+                raise DecodeError(op + " needs a register and a memory operand like 34+ R2")
+            match = MEMORY_OPERAND.match("".join(tokens[2:]))
+            if match is None:
+                raise DecodeError("bad memory operand " + repr(" ".join(tokens[2:])) + ", expected one like 34+ R2")
+            offset, plus, base = match.groups()
+            fields = (op, tokens[1], offset + plus, base)
+        elif len(tokens) != 4:
+            if op not in OPCODES:
+                raise DecodeError("unknown operation " + repr(tokens[0]) + ", expected one of " + ", ".join(OPCODES))
+            raise DecodeError(op + " needs a destination and two source registers, got "
+                              + str(len(tokens) - 1) + " operands")
+        else:
+            fields = (op, tokens[1], tokens[2], tokens[3])
+        decode_fields(*fields)
+    except DecodeError as error:
+        raise DecodeError(str(error), line, text.strip())
+    return fields
+
+
+def parse_directive(text, line=None):
+    # (count, register stride, offset stride) of a REPEAT line, () for END, None for
+    # any other line
+    tokens = text.upper().replace(",", " ").split()
+    if not tokens or tokens[0] not in ("REPEAT", "END"):
+        return None
+    if tokens[0] == "END":
+        if len(tokens) > 1:
+            raise DecodeError("END takes no operands", line, text.strip())
+        return ()
+    if len(tokens) < 2 or not tokens[1].isdigit():
+        raise DecodeError("REPEAT needs an iteration count", line, text.strip())
+    strides = {"REG": 0, "OFFSET": 0}
+    options = "".join(tokens[2:])
+    position = 0
+    while position < len(options):
+        match = REPEAT_OPTION.match(options, position)
+        if match is None:
+            raise DecodeError("bad REPEAT option, expected REG=k or OFFSET=k", line, text.strip())
+        strides[match.group(1)] = int(match.group(2))
+        position = match.end()
+    return (int(tokens[1]), strides["REG"], strides["OFFSET"])
+
+
+def shift(fields, registers, offset):
+    # an instruction of a loop body in a later iteration: registers added to the F
+    # register indices, offset to the memory offset
+    op, dest, src1, src2 = fields
+    if registers:
+        dest = "F" + str((register(dest) + registers) % NUM_REGISTERS)
+        if op != "LD" and op != "SD":
+            src1 = "F" + str((register(src1) + registers) % NUM_REGISTERS)
+            src2 = "F" + str((register(src2) + registers) % NUM_REGISTERS)
+    if offset and (op == "LD" or op == "SD"):
+        plus = src1.endswith("+")
+        value = int(src1[:-1] if plus else src1) + offset
+        # "0 R2" becomes "8+ R2", like the offsets written in the traces
+        src1 = str(value) + ("+" if plus or value else "")
+    return (op, dest, src1, src2)
+
+
+class Loop:
+    # a REPEAT block: body holds (op, dest, src1, src2) and nested Loop, it is run
+    # count times with the strides of parse_directive()
+    def __init__(self, count, body=None, registers=0, offset=0):
+        self.count = count
+        self.body = body if body is not None else []
+        self.registers = registers
+        self.offset = offset
+        self.period = None # instructions of one iteration, counted once the body is complete
+
+    def iteration(self):
+        if self.period is None:
+            self.period = sum(len(item) if isinstance(item, Loop) else 1 for item in self.body)
+        return self.period
+
+    def __len__(self):
+        # instructions of all the iterations
+        return self.count * self.iteration()
+
+    def instruction(self, i, registers=0, offset=0):
+        # instruction i of the expansion, found without expanding the ones before it
+        j, k = divmod(i, self.iteration())
+        registers += j * self.registers
+        offset += j * self.offset
+        for item in self.body:
+            if isinstance(item, Loop):
+                size = len(item)
+                if k < size:
+                    return item.instruction(k, registers, offset)
+                k -= size
+            elif k == 0:
+                return shift(item, registers, offset) if registers or offset else item
+            else:
+                k -= 1
+
+    def __iter__(self):
+        return self.expand()
+
+    def expand(self, registers=0, offset=0):
+        # the instructions of every iteration, with the strides of the enclosing
+        # loops added; a body without nested loops and without strides is given out
+        # as it is
+        body = self.body
+        flat = not any(isinstance(item, Loop) for item in body)
+        for j in range(self.count):
+            r = registers + j * self.registers
+            o = offset + j * self.offset
+            if flat and not r and not o:
+                yield from body
+                continue
+            for item in body:
+                if isinstance(item, Loop):
+                    yield from item.expand(r, o)
+                elif r or o:
+                    yield shift(item, r, o)
+                else:
+                    yield item
+
+
+def trace_items(lines):
+    # the instructions and the top level Loop of (number, text) trace lines, in
+    # order. A loop is given out at its END, so what is held at any time is the body
+    # of the block being read. A distinct instruction line is parsed once
+    seen = {} # line -> instruction, or False for a blank line
+    stack = [] # (Loop, number of its REPEAT line) of the open blocks, innermost last
+    for number, text in lines:
+        fields = seen.get(text)
+        if fields is None:
+            directive = parse_directive(text, number)
+            if directive is not None:
+                if directive:
+                    count, registers, offset = directive
+                    stack.append((Loop(count, [], registers, offset), number))
+                    continue
+                if not stack:
+                    raise DecodeError("END without a REPEAT", number, text.strip())
+                fields = stack.pop()[0]
+                if stack:
+                    stack[-1][0].body.append(fields)
+                else:
+                    yield fields
+                continue
+            fields = parse_line(text, number) or False
+            if len(seen) >= MEMO_SIZE:
+                seen.clear()
+            seen[text] = fields
+        if not fields:
+            continue
+        if stack:
+            stack[-1][0].body.append(fields)
+        else:
+            yield fields
+    if stack:
+        raise DecodeError("REPEAT without an END", stack[-1][1])
+
+
+def expand_lines(lines):
+    # the (op, dest, src1, src2) of (number, text) trace lines, loops expanded as
+    # the instructions are asked for
+    for item in trace_items(lines):
+        if isinstance(item, Loop):
+            yield from item
+        else:
+            yield item
+
+
+class LoopProgram:
+    # a decoded trace that has loops in it: the instructions outside of any loop and
+    # the Loop blocks, in order. It reads like a list of (op, dest, src1, src2) and
+    # expands the loops again on every iteration, so it is as small as the file
+    def __init__(self, items):
+        self.items = items
+        self.starts = [] # index of the first instruction of each item
+        size = 0
+        for item in items:
+            self.starts.append(size)
+            size += len(item) if isinstance(item, Loop) else 1
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(self.size))]
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("program index out of range")
+        k = bisect_right(self.starts, i) - 1
+        item = self.items[k]
+        if isinstance(item, Loop):
+            return item.instruction(i - self.starts[k])
+        return item
+
+    def __iter__(self):
+        for item in self.items:
+            if isinstance(item, Loop):
+                yield from item
+            else:
+                yield item
+
+
+class DecodedProgram:
+    # a decoded trace: every distinct instruction is kept once, in unique, and the
+    # program is an array of indices into it. It reads like a list of
+    # (op, dest, src1, src2), so it can be given to Simulator as it is
+    def __init__(self, unique, index):
+        self.unique = unique # distinct (op, dest, src1, src2)
+        self.index = index # array of positions in unique, one per instruction
+        self.fields = [decode_fields(*instruction) for instruction in unique]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.unique[k] for k in self.index[i]]
+        return self.unique[self.index[i]]
+
+    def __iter__(self):
+        return map(self.unique.__getitem__, self.index)
+
+    def decoded(self, i):
+        # (code, rd, rs1, rs2, address) of instruction i
+        return self.fields[self.index[i]]
+
+    def column(self, k):
+        # field k of decode_fields() for every instruction, as an array; 0 is the
+        # opcode, 1 to 3 the registers
+        values = array("b", [fields[k] for fields in self.fields])
+        return array("b", map(values.__getitem__, self.index))
+
+
+class Decoder:
+    # builds a DecodedProgram from the bytes of a trace, fed in pieces that end at a
+    # line break. Each distinct line is parsed once, so the work per line is a dict
+    # lookup that map() does in C
+    def __init__(self):
+        self.ids = {} # line -> position in unique, -1 for a blank line
+        self.unique = []
+        self.positions = {} # (op, dest, src1, src2) -> position in unique, lines can differ in spacing only
+        self.index = array("l")
+        self.lines = 0 # lines fed so far, for the line numbers of errors
+
+    def feed(self, data):
+        lines = data.splitlines()
+        ids = self.ids
+        blank = False
+        for text in set(lines):
+            if text in ids:
+                blank = blank or ids[text] < 0
+                continue
+            try:
+                fields = parse_line(text.decode("ascii"))
+            except UnicodeDecodeError:
+                raise DecodeError("not an ASCII line", self.lines + lines.index(text) + 1,
+                                  text.decode("ascii", "replace"))
+            except DecodeError as error:
+                # the message has to point at the first line that holds it
+                raise DecodeError(str(error), self.lines + lines.index(text) + 1)
+            if fields is None:
+                ids[text] = -1
+                blank = True
+                continue
+            if fields not in self.positions:
+                self.positions[fields] = len(self.unique)
+                self.unique.append(fields)
+            ids[text] = self.positions[fields]
+        index = array("l", map(ids.__getitem__, lines))
+        if blank:
+            index = array("l", [k for k in index if k >= 0])
+        self.index.extend(index)
+        self.lines += len(lines)
+
+    def program(self):
+        return DecodedProgram(self.unique, self.index)
+
+
+def decode_bytes(data):
+    # a DecodedProgram from the whole bytes of a trace file
+    decoder = Decoder()
+    decoder.feed(data)
+    return decoder.program()
+
+
+CHUNK = 1 << 24 # bytes of a mapped trace decoded at a time
+
+
+def load(path):
+    # decode a whole trace file. It is mapped and split a chunk at a time, so that
+    # a multi-million line file never has all of its lines as bytes objects at once;
+    # a trace with loops is a LoopProgram instead
+    decoder = Decoder()
+    with open(path, "rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            return decoder.program()
+        with data:
+            if DIRECTIVE.search(data) is not None:
+                file.seek(0)
+                lines = enumerate((line.decode("ascii", "replace") for line in file), 1)
+                return LoopProgram(list(trace_items(lines)))
+            start = 0
+            size = len(data)
+            while start < size:
+                end = min(start + CHUNK, size)
+                if end < size:
+                    # a chunk ends after the last line break in it, or is a single long line
+                    cut = data.rfind(b"\n", start, end)
+                    end = cut + 1 if cut >= start else data.find(b"\n", end) + 1 or size
+                decoder.feed(data[start:end])
+                start = end
+    return decoder.program()
@@ -0,0 +1,108 @@
+# symbolic register values as a hash-consed expression dag
+# a result only points at its two operands, so building it costs O(1) however long
+# the dependency chain is, equal subtrees are shared, and the text is built only
+# when a trace line asks for it
+
+import weakref
+
+
+class Expr:
+    __slots__ = ("op", "left", "right", "text", "slash", "__weakref__")
+
+    def __init__(self, op, left, right, text):
+        self.op = op # "+", "-", "*", "/" or None for a leaf
+        self.left = left
+        self.right = right
+        self.text = text # rendered text, None until it is needed
+        # whether the text contains "/", which is what decides the parentheses
+        if op is None:
+            self.slash = text.find("/") != -1
+        else:
+            self.slash = op == "/" or left.slash or right.slash
+
+    def isLeaf(self):
+        return self.op is None
+
+    def render(self):
+        if self.text is not None:
+            return self.text
+        # the pieces are collected with an explicit stack and joined once, a long
+        # chain would overflow the recursion limit and repeated + would be quadratic
+        parts = []
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if item.__class__ is str:
+                parts.append(item)
+            elif item.text is not None:
+                parts.append(item.text)
+            else:
+                # "*" and "/" put an operand holding a "/" in parentheses, "+" and "-" never do
+                paren = item.op == "*" or item.op == "/"
+                if paren and item.right.slash:
+                    stack.extend((")", item.right, "("))
+                else:
+                    stack.append(item.right)
+                stack.append(" " + item.op + " ")
+                if paren and item.left.slash:
+                    stack.extend((")", item.left, "("))
+                else:
+                    stack.append(item.left)
+        self.text = "".join(parts)
+        # only the text of the node that was asked for is kept; its operands will not
+        # be rendered through it again, so theirs is dropped, otherwise every value
+        # of a dependency chain would keep a copy of the whole chain
+        if self.left.op is not None:
+            self.left.text = None
+        if self.right.op is not None:
+            self.right.text = None
+        return self.text
+
+    def __str__(self):
+        return self.render()
+
+    def __repr__(self):
+        return "Expr(" + repr(self.render()) + ")"
+
+
+class ExprTable:
+    # interning table, one per simulation; equal expressions are the same object,
+    # so identity can be used as the key of the parent nodes. The table holds its
+    # expressions weakly: one that no register, station or reorder buffer entry
+    # (or parent node) refers to any more is dropped, so a streamed run keeps only
+    # the values of the instructions in flight
+    def __init__(self):
+        self.leaves = weakref.WeakValueDictionary()
+        self.nodes = weakref.WeakValueDictionary()
+
+    # a weak dictionary cannot be pickled, a snapshot keeps the live expressions
+    # in the order they were added, which is topological
+    def __getstate__(self):
+        return list(self.leaves.values()), list(self.nodes.values())
+
+    def __setstate__(self, state):
+        leaves, nodes = state
+        self.leaves = weakref.WeakValueDictionary((expr.text, expr) for expr in leaves)
+        self.nodes = weakref.WeakValueDictionary(((expr.op, expr.left, expr.right), expr) for expr in nodes)
+
+    def leaf(self, text):
+        node = self.leaves.get(text)
+        if node is None:
+            node = Expr(None, None, None, text)
+            self.leaves[text] = node
+        return node
+
+    def node(self, op, left, right):
+        if isinstance(left, str):
+            left = self.leaf(left)
+        if isinstance(right, str):
+            right = self.leaf(right)
+        key = (op, left, right)
+        node = self.nodes.get(key)
+        if node is None:
+            node = Expr(op, left, right, None)
+            self.nodes[key] = node
+        return node
+
+    def __len__(self):
+        return len(self.leaves) + len(self.nodes)
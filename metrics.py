@@ -0,0 +1,132 @@
+import csv
+import json
+import time
+
+from tomasulo import Hook
+
+# structured metrics of a run, collected through the simulator hooks:
+# host wall time per phase, and per cycle counters of the simulated machine
+#
+#   metrics = Metrics()
+#   simulator.addHook(metrics)
+#   simulator.run()
+#   metrics.write("metrics.json")  # or .csv for the per-cycle rows
+
+UNITS = ("add", "mul", "load", "store")
+
+# columns of a per-cycle row
+#   issued            instructions issued this cycle
+#   stall_no_station  the issue stopped before issue_width because the next instruction
+#                     found its stations all busy
+#   stall_rob_full    the issue stopped before issue_width because the reorder buffer
+#                     had no free entry
+#   wait_fn1/2        busy stations whose first/second operand waits for a tag
+#   cdb_results       results broadcast by write_back, at most num_cdb of them
+#   committed         instructions that left the reorder buffer, 0 without one
+#   busy_<unit>       occupied stations of the unit at the end of the cycle
+COLUMNS = ("cycle", "issued", "stall_no_station", "stall_rob_full", "wait_fn1", "wait_fn2", "cdb_results", "committed") + tuple("busy_" + unit for unit in UNITS)
+
+
+class Metrics(Hook):
+    def __init__(self, per_cycle=True):
+        self.per_cycle = per_cycle # keep a row for every cycle, not only the totals
+        self.seconds = {}
+        self.calls = {}
+        self.rows = []
+        self.totals = dict.fromkeys(COLUMNS[1:], 0)
+        self.totals["cycles"] = 0
+        self.totals["max_cdb_results"] = 0
+        self.started = 0.0
+        self.issued = 0
+        self.stalled = (0, 0) # stall_no_station, stall_rob_full
+        self.cdb_results = 0
+        self.committed = 0
+
+    def before(self, simulator, phase):
+        self.started = time.perf_counter()
+
+    def after(self, simulator, phase, result):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + time.perf_counter() - self.started
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        if phase == "issue":
+            self.issued = result
+            self.stalled = self.stall(simulator) if result < simulator.config.issue_width else (0, 0)
+        elif phase == "write_back":
+            self.cdb_results = result
+        elif phase == "commit":
+            self.committed = result
+
+    def stall(self, simulator):
+        # why the next instruction could not issue: the reorder buffer is checked
+        # first by issueNext(), then its stations
+        if simulator.fetch.get(simulator.pc) is None:
+            return (0, 0)
+        if simulator.rob is not None and simulator.rob.isFull():
+            return (0, 1)
+        return (1, 0)
+
+    def machineState(self, simulator):
+        # operand waits and occupancy, only the busy stations are visited
+        wait_fn1 = 0
+        wait_fn2 = 0
+        busy = []
+        for pool in simulator.pools:
+            busy.append(len(pool.busy))
+            for i in pool.busy:
+                if pool.stations[i].fn1 != "":
+                    wait_fn1 += 1
+                if pool.stations[i].fn2 != "":
+                    wait_fn2 += 1
+        return wait_fn1, wait_fn2, busy
+
+    def record(self, cycle, issued, stalled, cdb_results, committed, state, repeat=1):
+        wait_fn1, wait_fn2, busy = state
+        row = {"cycle": cycle, "issued": issued, "stall_no_station": stalled[0], "stall_rob_full": stalled[1],
+               "wait_fn1": wait_fn1, "wait_fn2": wait_fn2, "cdb_results": cdb_results, "committed": committed}
+        for unit, count in zip(UNITS, busy):
+            row["busy_" + unit] = count
+        for name in COLUMNS[1:]:
+            self.totals[name] += row[name] * repeat
+        self.totals["cycles"] += repeat
+        self.totals["max_cdb_results"] = max(self.totals["max_cdb_results"], cdb_results)
+        if self.per_cycle:
+            self.rows.append(row)
+            for i in range(1, repeat):
+                row = dict(row)
+                row["cycle"] = cycle + i
+                self.rows.append(row)
+
+    def endCycle(self, simulator):
+        self.record(simulator.cycle, self.issued, self.stalled, self.cdb_results, self.committed, self.machineState(simulator))
+
+    def skipped(self, simulator, cycles):
+        # nothing issues or finishes in the skipped cycles, by definition of nextEvent()
+        self.record(simulator.cycle + 1, 0, self.stall(simulator), 0, 0, self.machineState(simulator), cycles)
+
+    def toDict(self):
+        phases = {}
+        for phase in self.seconds:
+            phases[phase] = {"seconds": self.seconds[phase], "calls": self.calls[phase]}
+        return {"phases": phases, "totals": dict(self.totals), "cycles": self.rows}
+
+    def writeJSON(self, path):
+        with open(path, "w") as file:
+            json.dump(self.toDict(), file, indent=1)
+
+    def writeCSV(self, path):
+        # the per-cycle rows, or a single row of totals without them
+        with open(path, "w", newline="") as file:
+            if self.per_cycle:
+                writer = csv.DictWriter(file, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(self.rows)
+            else:
+                writer = csv.DictWriter(file, fieldnames=list(self.totals))
+                writer.writeheader()
+                writer.writerow(self.totals)
+
+    def write(self, path):
+        if path.endswith(".csv"):
+            self.writeCSV(path)
+        else:
+            self.writeJSON(path)
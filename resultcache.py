@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from tomasulo import CONFIG_FIELDS, Config, Simulator, as_tuple, load_program
+
+# content addressed cache of run summaries (the timing table and the metrics of
+# Simulator.summary()) on disk, so that a trace that was already simulated under the
+# same config comes back without running the cycle loop again
+#
+#   cache = ResultCache(".tomcache", max_bytes=256 << 20)
+#   summary = cache.run(load_program("input1.txt"), Config(cycle_mul=5))
+#
+# the key hashes the normalized instructions, every config field, the engine and the
+# source of the simulator itself, so that an edit of the simulator never serves a
+# stale result. An entry is one file, written to a temporary name and renamed into
+# place, so the worker processes of a sweep can share a directory without locks:
+# readers see a whole entry or none, and two writers of a key write the same bytes.
+# A hit touches the mtime of its file, and the oldest files go first when the
+# directory grows past max_bytes, down to LOW_WATER of it so that the next few puts
+# do not evict again
+
+DEFAULT_DIR = ".tomcache"
+DEFAULT_MAX_BYTES = 256 << 20
+LOW_WATER = 0.9
+SOURCES = ("tomasulo.py", "decode.py", "cache.py", "expr.py") # the code a summary depends on
+
+_version = None
+
+
+def simulator_version():
+    # digest of the simulator sources, computed once per process
+    global _version
+    if _version is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in SOURCES:
+            with open(os.path.join(here, name), "rb") as file:
+                digest.update(file.read())
+        _version = digest.hexdigest()[:16]
+    return _version
+
+
+def trace_digest(program):
+    # digest of the normalized instructions: upper case op, no surrounding blanks
+    digest = hashlib.sha256()
+    for instruction in program:
+        op, dest, src1, src2 = as_tuple(instruction)
+        digest.update(("%s %s %s %s\n" % (op.strip().upper(), dest.strip(), src1.strip(), src2.strip())).encode())
+    return digest.hexdigest()
+
+
+def config_key(config, engine="cycle"):
+    return ",".join(name + "=" + repr(getattr(config, name)) for name in CONFIG_FIELDS) + ",engine=" + engine
+
+
+def result_key(program, config, engine="cycle", digest=None):
+    # digest, when given, is trace_digest(program) computed earlier
+    if digest is None:
+        digest = trace_digest(program)
+    text = simulator_version() + "\n" + digest + "\n" + config_key(config, engine)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    # plain attributes only, so a ResultCache can be sent to the workers of a
+    # process pool; each worker then counts its own hits and misses
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES, keep_trace=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep_trace = keep_trace # also store the instructions with each entry
+        self.hits = 0
+        self.misses = 0
+        self.used = None # bytes in the directory as of the last scan plus the puts since
+
+    def path(self, key):
+        # entries are spread over 256 sub directories
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def get(self, key):
+        # the summary stored under key, or None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                summary = pickle.load(file)["summary"]
+        except Exception:
+            # missing, or damaged: unpickling bad bytes can raise nearly anything, and
+            # such an entry is a miss that run() writes again
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass # evicted by another process in the meantime
+        self.hits += 1
+        return summary
+
+    def put(self, key, summary, program=None):
+        entry = {"summary": summary}
+        if self.keep_trace and program is not None:
+            entry["trace"] = [as_tuple(i) for i in program]
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(temp)
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+        # the directory is only scanned again when this process may have filled it
+        if self.used is not None:
+            self.used += size
+        if self.max_bytes and (self.used is None or self.used > self.max_bytes):
+            self.evict()
+
+    def trace(self, key):
+        # the instructions stored with key, or None
+        try:
+            with open(self.path(key), "rb") as file:
+                return pickle.load(file).get("trace")
+        except Exception:
+            return None
+
+    def run(self, program, config=None, engine="cycle", digest=None):
+        # the summary of Simulator(program, config, engine=engine).run(), from the cache if it can
+        if config is None:
+            config = Config()
+        key = result_key(program, config, engine, digest)
+        summary = self.get(key)
+        if summary is None:
+            summary = Simulator(program, config, engine=engine).run()
+            self.put(key, summary, program)
+        return summary
+
+    def entries(self):
+        # (mtime, size, path) of every entry
+        res = []
+        if not os.path.isdir(self.directory):
+            return res
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                res.append((stat.st_mtime, stat.st_size, entry.path))
+        return res
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self):
+        # remove the least recently used entries once the directory is over max_bytes
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        self.used = total
+        removed = 0
+        if not self.max_bytes or total <= self.max_bytes:
+            return 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass # another process removed it first
+            total -= size
+        self.used = total
+        return removed
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.used = 0
+
+    def stats(self):
+        entries = self.entries()
+        return {"entries": len(entries), "bytes": sum(size for mtime, size, path in entries),
+                "hits": self.hits, "misses": self.misses}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="inspect or fill the result cache")
+    parser.add_argument("traces", nargs="*", help="run these traces under the default config through the cache")
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--engine", choices=("cycle", "event"), default="event")
+    parser.add_argument("--clear", action="store_true", help="remove every entry")
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.dir, args.max_bytes)
+    if args.clear:
+        cache.clear()
+    for trace in args.traces:
+        summary = cache.run(load_program(trace), engine=args.engine)
+        sys.stdout.write("%s: %d cycles\n" % (trace, summary["cycles"]))
+    stats = cache.stats()
+    sys.stdout.write("%d entries, %d bytes, %d hits, %d misses\n" % (
+        stats["entries"], stats["bytes"], stats["hits"], stats["misses"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import math
+import random
+import sys
+import time
+from itertools import islice
+from statistics import NormalDist, mean, stdev
+
+from cache import Cache, address_of
+from decode import decode_fields
+from tomasulo import Config, Simulator, as_tuple, read_program
+
+# sampled simulation in the style of SMARTS, for traces too long to simulate in
+# full: the cycles of the whole trace are extrapolated from short windows that
+# get the detailed simulation
+#
+#   result = Sampler(Config(), rate=0.01, window=1000).run(read_program("huge.txt"))
+#   result.cycles, result.cyclesInterval(), result.ipc
+#
+# the trace is cut into periods of window / rate instructions. One window of each
+# period, at the same random offset in all of them, is simulated in detail after
+# warmup instructions whose own timing is not counted, and gives a sample of the
+# cycles per instruction; the instructions in between are fast-forwarded. The
+# estimate is the mean CPI times the length of the trace, with a Student t confidence
+# interval from the spread of the samples (SMARTS asks for 30 windows or more)
+#
+# fast-forward is functional. The only state of this machine that outlives the
+# detailed warm-up is the cache, so its tags and LRU order are updated by every
+# skipped LD/SD; the register dependencies (which station a register waits for)
+# reach back no further than the stations in flight, and the warm-up rebuilds them.
+# Without a cache a skipped instruction is not even decoded
+
+MIN_WINDOWS = 4 # below this the trace is simulated in full
+
+
+def t_quantile(p, df):
+    # quantile of the Student t distribution, by the Cornish-Fisher expansion
+    # around the normal one; within 1% from 3 degrees of freedom on
+    z = NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+class SampleResult:
+    def __init__(self, instructions, cpis, window, confidence, detailed, exact_cycles=None, wall=0.0):
+        self.instructions = instructions # length of the whole trace
+        self.cpis = cpis # cycles per instruction of each measured window
+        self.window = window
+        self.confidence = confidence
+        self.detailed = detailed # instructions simulated in detail, warm-up included
+        self.exact = exact_cycles is not None # the trace was too short to sample
+        self.wall = wall
+        if self.exact:
+            self.cpi = exact_cycles / instructions if instructions else 0.0
+            self.stdev = 0.0
+        else:
+            self.cpi = mean(cpis)
+            self.stdev = stdev(cpis)
+        self.cycles = exact_cycles if self.exact else self.cpi * instructions
+        self.ipc = 1 / self.cpi if self.cpi else 0.0
+
+    def halfWidth(self):
+        # of the confidence interval of the mean CPI; the finite population
+        # correction makes it 0 when every instruction was measured
+        if self.exact:
+            return 0.0
+        n = len(self.cpis)
+        measured = n * self.window
+        correction = math.sqrt(max(0.0, 1 - measured / self.instructions))
+        t = t_quantile(0.5 + self.confidence / 2, n - 1)
+        return t * self.stdev / math.sqrt(n) * correction
+
+    def cyclesInterval(self):
+        half = self.halfWidth() * self.instructions
+        return self.cycles - half, self.cycles + half
+
+    def ipcInterval(self):
+        half = self.halfWidth()
+        low = self.cpi + half
+        high = self.cpi - half
+        return (1 / low if low > 0 else 0.0), (1 / high if high > 0 else math.inf)
+
+    def relativeError(self):
+        # half width of the cycle interval over the estimate
+        return self.halfWidth() / self.cpi if self.cpi else 0.0
+
+    def summary(self):
+        low, high = self.cyclesInterval()
+        ipc_low, ipc_high = self.ipcInterval()
+        return {
+            "cycles": self.cycles,
+            "cycles_low": low,
+            "cycles_high": high,
+            "ipc": self.ipc,
+            "ipc_low": ipc_low,
+            "ipc_high": ipc_high,
+            "cpi": self.cpi,
+            "cpi_stdev": self.stdev,
+            "confidence": self.confidence,
+            "instructions": self.instructions,
+            "windows": len(self.cpis),
+            "detailed": self.detailed,
+            "exact": self.exact,
+            "wall": self.wall,
+        }
+
+
+class Sampler:
+    # rate is the fraction of the trace that is measured, window the instructions
+    # of one measurement and warmup those simulated in detail before it
+    def __init__(self, config=None, rate=0.01, window=1000, warmup=None, confidence=0.95, seed=0, engine="event"):
+        if not 0 < rate <= 1:
+            raise ValueError("the sample rate must be in (0, 1]")
+        if window < 1:
+            raise ValueError("a window needs at least one instruction")
+        if not 0 < confidence < 1:
+            raise ValueError("the confidence must be in (0, 1)")
+        self.config = config if config is not None else Config()
+        self.rate = rate
+        self.window = window
+        self.warmup = window if warmup is None else warmup
+        self.confidence = confidence
+        self.engine = engine
+        self.period = max(window, int(round(window / rate)))
+        # where the window starts in its period, the same in every period
+        self.offset = random.Random(seed).randrange(self.period - window + 1)
+
+    def fastForward(self, source, count, kept=None):
+        # skip up to count instructions of source, return how many there were; they
+        # are added to kept when it is given
+        cache = self.cache
+        skipped = 0
+        if cache is None and kept is None:
+            for skipped, instruction in enumerate(islice(source, count), 1):
+                pass
+            return skipped
+        for instruction in islice(source, count):
+            skipped += 1
+            if kept is not None:
+                kept.append(instruction)
+            if cache is not None:
+                address = decode_fields(*as_tuple(instruction))[4]
+                if address is not None:
+                    cache.warm(address_of(address))
+        return skipped
+
+    def measure(self, warm, measured):
+        # cycles the measured instructions add after the warm-up: instructions are
+        # taken to be done in program order, at the latest write (or commit) so far
+        simulator = Simulator(warm + measured, self.config, engine=self.engine, symbolic=False)
+        if self.cache is not None:
+            self.cache.settle()
+            simulator.cache = self.cache
+        timings = simulator.run()["timings"]
+        # the commit is the fourth column with a reorder buffer, else the write
+        column = 3 if self.config.rob_size else 2
+        done = 0
+        start = 0
+        for i, row in enumerate(timings):
+            done = max(done, row[column])
+            if i == len(warm) - 1:
+                start = done
+        return done - start
+
+    def run(self, program):
+        # program is any iterable of instructions, it is read once
+        start = time.perf_counter()
+        config = self.config
+        self.cache = None
+        if config.cache_size:
+            self.cache = Cache(config.cache_size, config.cache_ways, config.cache_line,
+                               config.cycle_hit, config.cycle_miss, config.cache_mshrs)
+        source = iter(program)
+        position = 0 # instructions read from source
+        cpis = []
+        detailed = 0
+        # the instructions read so far, while the trace may still turn out too short
+        # to sample; None from then on
+        kept = []
+        period = 0
+        while True:
+            first = period * self.period + self.offset # of the measured window
+            # the warm-up does not reach into the previous window
+            warm_start = max(position, first - self.warmup)
+            position += self.fastForward(source, warm_start - position, kept)
+            if position < warm_start:
+                break
+            warm = list(islice(source, first - warm_start))
+            measured = list(islice(source, self.window))
+            position += len(warm) + len(measured)
+            if kept is not None:
+                kept += warm + measured
+            if len(measured) < self.window:
+                break
+            cpis.append(self.measure(warm, measured) / self.window)
+            detailed += len(warm) + len(measured)
+            period += 1
+            if len(cpis) >= MIN_WINDOWS:
+                kept = None
+        if len(cpis) < MIN_WINDOWS:
+            # every instruction was kept, simulate them all
+            cycles = Simulator(kept, config, engine=self.engine, symbolic=False).run()["cycles"]
+            return SampleResult(len(kept), [], self.window, self.confidence, len(kept), cycles,
+                                time.perf_counter() - start)
+        return SampleResult(position, cpis, self.window, self.confidence, detailed,
+                            wall=time.perf_counter() - start)
+
+
+def sample(program, config=None, **options):
+    return Sampler(config, **options).run(program)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="estimate the cycles of a long trace from sampled windows")
+    parser.add_argument("input")
+    parser.add_argument("--rate", type=float, default=0.01, help="fraction of the instructions that are measured")
+    parser.add_argument("--window", type=int, default=1000, help="instructions of a measured window")
+    parser.add_argument("--warmup", type=int, default=None, help="detailed instructions before a window, default --window")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-size", type=int, default=0)
+    parser.add_argument("--full", action="store_true", help="also simulate the whole trace to compare")
+    args = parser.parse_args(argv)
+
+    config = Config(cache_size=args.cache_size)
+    sampler = Sampler(config, args.rate, args.window, args.warmup, args.confidence, args.seed)
+    result = sampler.run(read_program(args.input))
+    low, high = result.cyclesInterval()
+    ipc_low, ipc_high = result.ipcInterval()
+    out = sys.stdout
+    out.write("%d instructions, %d windows, %d simulated in detail, %.2fs\n" % (
+        result.instructions, len(result.cpis), result.detailed, result.wall))
+    out.write("cycles %.0f, %.0f%% interval [%.0f, %.0f]\n" % (result.cycles, args.confidence * 100, low, high))
+    out.write("ipc %.4f, interval [%.4f, %.4f]\n" % (result.ipc, ipc_low, ipc_high))
+    if args.full:
+        start = time.perf_counter()
+        cycles = Simulator(read_program(args.input), config, engine="event", stream=True, symbolic=False).run()["cycles"]
+        out.write("full run %d cycles, %.2fs, error %+.2f%%\n" % (
+            cycles, time.perf_counter() - start, (result.cycles - cycles) / cycles * 100))
+
+
+if __name__ == "__main__":
+    main()
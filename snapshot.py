@@ -0,0 +1,102 @@
+import io
+import pickle
+import struct
+import zlib
+from array import array
+
+from expr import Expr
+
+# snapshot of the whole state of a Simulator: registers, stations, reorder buffer,
+# cache, pc, cycle, memory_index and the instructions with their times, so that a
+# run can be resumed or forked without simulating its prefix again
+#
+# file layout:
+#   header   MAGIC, version u16, cycle u64, pc u64 (little endian)
+#   body     zlib compressed pickle stream of two objects:
+#            the expression dag as (leaf texts, node ops, node operand indices),
+#            then the simulator, whose Expr references are indices into that dag
+#
+# the dag is stored flat because a long dependency chain is as deep as the program,
+# pickling it as nested objects would overflow the recursion limit
+
+MAGIC = b"TOMSNAP\0"
+VERSION = 2 # 2: instructions carry their decoded fields
+
+HEADER = struct.Struct("<8sHQQ")
+
+
+class SnapshotPickler(pickle.Pickler):
+    def __init__(self, file, index):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.index = index # id of an Expr -> its position in the flat dag
+
+    def persistent_id(self, obj):
+        if obj.__class__ is Expr:
+            return self.index[id(obj)]
+        return None
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file):
+        super().__init__(file)
+        self.exprs = []
+
+    def persistent_load(self, pid):
+        return self.exprs[pid]
+
+
+def dumps(simulator):
+    # the table adds a node after its operands, so its order is topological
+    table = simulator.exprs
+    leaves = list(table.leaves.values())
+    nodes = list(table.nodes.values())
+    index = {}
+    for expr in leaves:
+        index[id(expr)] = len(index)
+    for expr in nodes:
+        index[id(expr)] = len(index)
+    operands = array("q")
+    for expr in nodes:
+        operands.append(index[id(expr.left)])
+        operands.append(index[id(expr.right)])
+    buffer = io.BytesIO()
+    pickler = SnapshotPickler(buffer, index)
+    pickler.dump(([expr.text for expr in leaves], "".join(expr.op for expr in nodes), operands.tobytes()))
+    pickler.dump(simulator)
+    return HEADER.pack(MAGIC, VERSION, simulator.cycle, simulator.pc) + zlib.compress(buffer.getvalue())
+
+
+def loads(data):
+    # the simulator comes back without sink, hooks or stream source, see Simulator.restore()
+    magic, version, cycle, pc = info(data)
+    unpickler = SnapshotUnpickler(io.BytesIO(zlib.decompress(data[HEADER.size:])))
+    texts, ops, packed = unpickler.load()
+    operands = array("q")
+    operands.frombytes(packed)
+    exprs = [Expr(None, None, None, text) for text in texts]
+    for i in range(len(ops)):
+        exprs.append(Expr(ops[i], exprs[operands[2 * i]], exprs[operands[2 * i + 1]], None))
+    unpickler.exprs = exprs
+    return unpickler.load()
+
+
+def info(data):
+    # (magic, version, cycle, pc) of a snapshot, without reading the body
+    if len(data) < HEADER.size:
+        raise ValueError("not a simulator snapshot")
+    magic, version, cycle, pc = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a simulator snapshot")
+    if version != VERSION:
+        raise ValueError("unsupported snapshot version " + str(version))
+    return magic, version, cycle, pc
+
+
+def save(simulator, path):
+    with open(path, "wb") as file:
+        file.write(dumps(simulator))
+
+
+def load(path):
+    with open(path, "rb") as file:
+        return loads(file.read())
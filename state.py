@@ -0,0 +1,195 @@
+from collections import namedtuple
+
+# the machine at the end of one cycle, as Simulator.simulate() gives it out
+#
+#   for state in simulator.simulate(where=lambda cycle: cycle == 40):
+#       state.registers[6].fu, state.stationRows, state.timings[3]
+#
+# a CycleState holds its cycle and pc when it is made. While the generator waits it
+# reads the simulator, and only the fields that are asked for are built, then kept;
+# when the generator goes on, a state that is still referenced copies the station,
+# reorder buffer and register fields first (the values are Expr references, their
+# text is not rendered), so it never changes afterwards. The text trace is made from
+# these states too, see Simulator.print_state()
+
+Station = namedtuple("Station", "name busy op fn1 fn2 src1 src2 dest")
+RobEntry = namedtuple("RobEntry", "name busy dest store done value") # store: address of a SD, else None
+RegisterState = namedtuple("RegisterState", "name fu value")
+
+
+def capture(simulator):
+    # the raw fields of a state; the station values are still Expr
+    stations = []
+    for buffers in (simulator.loadBuffers, simulator.storeBuffers, simulator.reservationADDs, simulator.reservationMULs):
+        for station in buffers:
+            stations.append(Station(station.name, station.busy, station.op, station.fn1, station.fn2,
+                                    station.src1, station.src2, getattr(station, "dest", "")))
+    rob = ()
+    if simulator.rob is not None:
+        rob = tuple(RobEntry(entry.name, entry.busy, entry.dest,
+                             entry.store.dest if entry.store is not None else None, entry.done, entry.value)
+                    for entry in simulator.rob.entries)
+    registers = tuple((register.fu, register.value) for register in simulator.registers)
+    # instructions only ever get times at or after the cycle they happen in, so the
+    # list can be shared: the times up to the cycle of the state are final
+    instructions = () if simulator.stream else simulator.instructions
+    return tuple(stations), rob, registers, instructions, simulator.rob is not None
+
+
+def station_row(station):
+    # the line of a station in the trace, from a Station or the live Reservation
+    if not station.busy:
+        return station.name + ": No;"
+    if station.op == "LD":
+        return station.name + ": Yes, " + str(station.src1) + ";"
+    if station.op == "SD":
+        return station.name + ": Yes, " + station.dest + ", " + (station.fn1 or str(station.src1)) + ";"
+    return (station.name + ": Yes, " + station.op + ", " + (station.fn1 or str(station.src1)) + ", "
+            + (station.fn2 or str(station.src2)) + ";")
+
+
+def rob_row(entry, store):
+    # destination, then the result once it has been written back; store is the
+    # address of a SD, else None
+    if not entry.busy:
+        return entry.name + ": No;"
+    if store is not None:
+        return entry.name + ": Yes, " + store + ";"
+    line = entry.name + ": Yes, F" + str(entry.dest)
+    if entry.done:
+        line += ", " + str(entry.value)
+    return line + ";"
+
+
+PREFIXES = ["F" + str(i) + ": " for i in range(32)] # of the register fields
+INITIAL = ["R(F" + str(i) + ")" for i in range(32)] # value shown blank
+
+
+def register_fields(pairs):
+    # the "F0: ...; " fields of (fu, value) pairs; this runs for every traced cycle
+    rows = []
+    for i, (fu, value) in enumerate(pairs):
+        if fu:
+            rows.append(PREFIXES[i] + fu + "; ")
+        else:
+            value = str(value)
+            rows.append(PREFIXES[i] + (" " if value == INITIAL[i] else value) + "; ")
+    return tuple(rows)
+
+
+class CycleState:
+    __slots__ = ("_cycle", "_pc", "_simulator", "_raw", "_stationRows", "_registerRows", "_registers",
+                 "_timings", "__weakref__")
+
+    def __init__(self, simulator):
+        self._cycle = simulator.cycle
+        self._pc = simulator.pc
+        self._simulator = simulator # None once detached
+        self._raw = None
+        self._stationRows = None
+        self._registerRows = None
+        self._registers = None
+        self._timings = None
+
+    def detach(self):
+        # keep what the state shows before the simulator leaves its cycle
+        if self._simulator is not None:
+            self.raw()
+            self._simulator = None
+
+    def live(self):
+        # the simulator while it is still at this cycle and nothing was copied, else None
+        simulator = self._simulator
+        if simulator is None or self._raw is not None:
+            return None
+        if simulator.cycle != self._cycle:
+            raise RuntimeError("the simulator has left cycle " + str(self._cycle) + " of this state")
+        return simulator
+
+    def raw(self):
+        if self._raw is None:
+            self._raw = capture(self.live())
+        return self._raw
+
+    @property
+    def cycle(self):
+        return self._cycle
+
+    @property
+    def pc(self):
+        # index of the next instruction to issue
+        return self._pc
+
+    @property
+    def stations(self):
+        # load, store, add and mult stations, in the order of the trace, with the
+        # operand values as text
+        return tuple(s._replace(src1=str(s.src1), src2=str(s.src2)) if s.busy else s for s in self.raw()[0])
+
+    @property
+    def rob(self):
+        # entries of the reorder buffer, empty without one
+        return tuple(e._replace(value=str(e.value)) if e.done else e for e in self.raw()[1])
+
+    @property
+    def registers(self):
+        # RegisterState of F0..F31: the tag it waits for, or "", and its value as text
+        if self._registers is None:
+            self._registers = tuple(RegisterState("F" + str(i), fu, str(value))
+                                    for i, (fu, value) in enumerate(self.raw()[2]))
+        return self._registers
+
+    @property
+    def stationRows(self):
+        # the station lines of the trace, reorder buffer entries last
+        # the text trace asks for the rows of a live state, they are read off the
+        # stations without copying them first; station_row() takes either
+        if self._stationRows is None:
+            simulator = self.live()
+            if simulator is not None:
+                rows = [station_row(s) for buffers in (simulator.loadBuffers, simulator.storeBuffers,
+                                                        simulator.reservationADDs, simulator.reservationMULs)
+                        for s in buffers]
+                if simulator.rob is not None:
+                    rows += [rob_row(e, e.store.dest if e.store is not None else None) for e in simulator.rob.entries]
+            else:
+                stations, rob = self.raw()[:2]
+                rows = [station_row(s) for s in stations] + [rob_row(e, e.store) for e in rob]
+            self._stationRows = tuple(rows)
+        return self._stationRows
+
+    @property
+    def registerRows(self):
+        # the "F0: ...; " fields of the trace
+        if self._registerRows is None:
+            simulator = self.live()
+            if simulator is not None:
+                pairs = [(r.fu, r.value) for r in simulator.registers]
+            else:
+                pairs = self.raw()[2]
+            self._registerRows = register_fields(pairs)
+        return self._registerRows
+
+    @property
+    def timings(self):
+        # (issue, execute, write) of every instruction as of this cycle, -1 for what
+        # has not happened yet, and the commit with a reorder buffer; empty for a
+        # streamed program, like Simulator.summary(). The execute cycle is the write
+        # cycle - 1 as in the final table, so it shows with the write: before that a
+        # result that loses the common data bus still moves
+        if self._timings is None:
+            instructions, committing = self.raw()[3:]
+            cycle = self._cycle
+            rows = []
+            for i in instructions:
+                issue = i.issueTime if i.issueTime <= cycle else -1
+                write = i.writeTime if i.writeTime <= cycle else -1
+                row = (issue, write - 1 if write != -1 else -1, write)
+                if committing:
+                    row += (i.commitTime if i.commitTime <= cycle else -1,)
+                rows.append(row)
+            self._timings = tuple(rows)
+        return self._timings
+
+    def __repr__(self):
+        return "CycleState(cycle=" + str(self._cycle) + ", pc=" + str(self._pc) + ")"
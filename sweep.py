@@ -0,0 +1,257 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+
+from tomasulo import Config, load_program, run_many
+
+# design space sweep: run every trace under a grid or a random sample of machine
+# configurations on a process pool, and collect one row per run
+#
+# python sweep.py input1.txt input2.txt --param num_add=1:4 --param cycle_mul=5,10 --csv out.csv
+
+# parameters that can be swept
+PARAMETERS = ("num_add", "num_mul", "num_load", "num_store",
+              "cycle_add", "cycle_sub", "cycle_mul", "cycle_div", "cycle_load", "cycle_store", "cycle_writeback",
+              "issue_width", "num_cdb", "num_add_units", "num_mul_units",
+              "interval_add", "interval_mul", "interval_div", "rob_size", "commit_width",
+              "disambiguate", "forward", "cycle_forward",
+              "cache_size", "cache_ways", "cache_line", "cycle_hit", "cycle_miss", "cache_mshrs")
+
+COLUMNS = ("trace",) + PARAMETERS + ("cycles", "instructions", "ipc",
+                                     "util_add", "util_mul", "util_load", "util_store",
+                                     "util_add_units", "util_mul_units",
+                                     "hit_rate")
+
+
+def parse_values(text):
+    # "1,2,4" is a list of values, "1:4" the inclusive range 1, 2, 3, 4
+    values = []
+    for part in text.split(","):
+        if ":" in part:
+            low, high = part.split(":")
+            values.extend(range(int(low), int(high) + 1))
+        else:
+            values.append(int(part))
+    return values
+
+
+def grid(space):
+    # every combination of the values in space, a dict of parameter -> values
+    names = sorted(space)
+    for values in itertools.product(*[space[name] for name in names]):
+        yield dict(zip(names, values))
+
+
+def sample(space, count, seed=0):
+    # count random points of space, without repeating a point while it has fresh ones
+    rng = random.Random(seed)
+    names = sorted(space)
+    size = 1
+    for name in names:
+        size *= len(space[name])
+    seen = set()
+    points = []
+    while len(points) < count:
+        point = tuple(rng.choice(space[name]) for name in names)
+        if point in seen and len(seen) < size:
+            continue
+        seen.add(point)
+        points.append(dict(zip(names, point)))
+    return points
+
+
+def sweep(traces, points, base=None, workers=None, engine="event", prune=False, cache=None):
+    # run every trace under every point, returns one row per run in that order
+    # with prune, the runs whose lower bound (bounds.py) shows that they cannot beat
+    # the fewest cycles of their trace are left out of the rows
+    # cache is a resultcache.ResultCache shared by the workers, the batch engine does not use it
+    if base is None:
+        base = Config()
+    for point in points:
+        for name in point:
+            if name not in PARAMETERS:
+                raise ValueError("cannot sweep " + name)
+    jobs = []
+    for point in points:
+        config = base.copy(**point)
+        for trace in traces:
+            jobs.append((trace, config))
+    if prune:
+        jobs, results = run_pruned(traces, jobs, workers, engine, cache)
+    elif engine == "batch":
+        results = run_batches(traces, [config for trace, config in jobs[::len(traces)]])
+    else:
+        # the workers build their simulators without a sink, so nothing is traced
+        results = run_many(jobs, workers=workers, mode="process", engine=engine, cache=cache)
+    rows = []
+    for (trace, config), result in zip(jobs, results):
+        row = {"trace": trace}
+        for name in PARAMETERS:
+            row[name] = getattr(config, name)
+        row["cycles"] = result["cycles"]
+        row["instructions"] = result["instructions"]
+        row["ipc"] = result["ipc"]
+        for unit, value in result["utilization"].items():
+            row["util_" + unit] = value
+        # 0 when the run had no cache
+        row["hit_rate"] = result["cache"]["hit_rate"] if result["cache"] is not None else 0.0
+        rows.append(row)
+    return rows
+
+
+def run_batches(traces, configs):
+    # every config of a trace in one lockstep batch, results in the order of sweep()
+    # batch.py needs numpy, so it is only imported for this engine
+    from batch import run_batch
+    per_trace = []
+    for trace in traces:
+        result = run_batch(load_program(trace), configs)
+        summaries = []
+        for b in range(len(result)):
+            summary = result.summary(b)
+            summary["cache"] = None
+            summaries.append(summary)
+        per_trace.append(summaries)
+    results = []
+    for i in range(len(configs)):
+        for summaries in per_trace:
+            results.append(summaries[i])
+    return results
+
+
+def run_pruned(traces, jobs, workers=None, engine="event", cache=None):
+    # the jobs of each trace run in rounds, in the order of their lower bounds, and a
+    # job is dropped once its lower bound is not below the best cycles of its trace;
+    # before the first round the smallest upper bound stands in for the best
+    from bounds import DependencyGraph
+    graphs = {trace: DependencyGraph(load_program(trace)) for trace in traces}
+    lower = [graphs[trace].lower(config) for trace, config in jobs]
+    best = {} # trace -> (upper bound, job that has it)
+    for i, (trace, config) in enumerate(jobs):
+        upper = graphs[trace].upper(config)
+        if trace not in best or upper < best[trace][0]:
+            best[trace] = (upper, i)
+    order = sorted(range(len(jobs)), key=lambda i: lower[i])
+    done = {}
+    if engine == "batch":
+        # one batch per trace, pruned by the upper bounds only
+        for trace in traces:
+            upper, first = best[trace]
+            keep = [i for i in order if jobs[i][0] == trace and (lower[i] < upper or i == first)]
+            for i, result in zip(keep, run_batches([trace], [jobs[i][1] for i in keep])):
+                done[i] = result
+    else:
+        # until a trace has a result, the job with the smallest upper bound is kept even
+        # if its lower bound reaches that upper bound, so every trace gets its best row
+        first = {i for upper, i in best.values()}
+        best = {trace: upper for trace, (upper, i) in best.items()}
+        size = max(1, (workers or os.cpu_count() or 1) * 4)
+        while order:
+            batch = [i for i in order if lower[i] <= best[jobs[i][0]]][:size]
+            if not batch:
+                break
+            results = run_many([jobs[i] for i in batch], workers=workers, mode="process", engine=engine,
+                               cache=cache)
+            for i, result in zip(batch, results):
+                done[i] = result
+                trace = jobs[i][0]
+                best[trace] = min(best[trace], result["cycles"])
+            taken = set(batch)
+            ran = {jobs[i][0] for i in batch}
+            first = {i for i in first if jobs[i][0] not in ran}
+            order = [i for i in order if i not in taken and (lower[i] < best[jobs[i][0]] or i in first)]
+    kept = sorted(done)
+    return [jobs[i] for i in kept], [done[i] for i in kept]
+
+
+def write_csv(rows, path):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_json(rows, path):
+    with open(path, "w") as file:
+        json.dump(rows, file, indent=1)
+
+
+def format_table(rows):
+    lines = []
+    widths = [len(name) for name in COLUMNS]
+    cells = []
+    for row in rows:
+        line = []
+        for name in COLUMNS:
+            value = row[name]
+            line.append("%.3f" % value if isinstance(value, float) else str(value))
+        cells.append(line)
+        widths = [max(w, len(c)) for w, c in zip(widths, line)]
+    lines.append("  ".join(name.rjust(w) for name, w in zip(COLUMNS, widths)))
+    for line in cells:
+        lines.append("  ".join(c.rjust(w) for c, w in zip(line, widths)))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="sweep machine configurations over traces")
+    parser.add_argument("traces", nargs="+", help="trace files, like input1.txt")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUES",
+                        help="values of a parameter, as 1,2,4 or 1:4; may be repeated")
+    parser.add_argument("--sample", type=int, default=0, help="run this many random points instead of the grid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--engine", choices=("cycle", "event", "batch"), default="event",
+                        help="batch runs all points of a trace in lockstep with numpy, see batch.py")
+    parser.add_argument("--prune", action="store_true",
+                        help="skip the points whose cycle bounds show they cannot be the fastest of their trace")
+    parser.add_argument("--cache", metavar="DIR", help="look the runs up in, and add them to, a result cache")
+    parser.add_argument("--cache-bytes", type=int, default=256 << 20, help="size cap of the result cache")
+    parser.add_argument("--csv", help="write the table as csv")
+    parser.add_argument("--json", help="write the table as json")
+    args = parser.parse_args(argv)
+
+    space = {}
+    for param in args.param:
+        name, values = param.split("=", 1)
+        if name not in PARAMETERS:
+            parser.error("cannot sweep " + name + ", choose from " + ", ".join(PARAMETERS))
+        space[name] = parse_values(values)
+    if args.sample:
+        points = sample(space, args.sample, args.seed)
+    else:
+        points = list(grid(space))
+    if args.engine == "batch":
+        try:
+            from batch import check
+        except ImportError:
+            parser.error("--engine batch needs numpy")
+        base = Config()
+        for point in points:
+            try:
+                check(base.copy(**point))
+            except ValueError as error:
+                parser.error(str(error) + ", use --engine event for this sweep")
+
+    cache = None
+    if args.cache:
+        from resultcache import ResultCache
+        cache = ResultCache(args.cache, args.cache_bytes)
+    rows = sweep(args.traces, points, workers=args.workers, engine=args.engine, prune=args.prune, cache=cache)
+    if args.prune:
+        sys.stderr.write("pruned %d of %d runs\n" % (len(points) * len(args.traces) - len(rows),
+                                                     len(points) * len(args.traces)))
+    if args.csv:
+        write_csv(rows, args.csv)
+    if args.json:
+        write_json(rows, args.json)
+    if not args.csv and not args.json:
+        sys.stdout.write(format_table(rows))
+
+
+if __name__ == "__main__":
+    main()
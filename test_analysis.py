@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from analysis import analyze
+from bench import WORKLOADS, generate
+from test_tomasulo import random_config
+
+PARTS = ("structural", "raw", "unit", "execution", "cdb")
+
+
+def assert_parts_sum(rows):
+    for row in rows:
+        assert sum(row[part] for part in PARTS) == row["total"] == row["write"] - row["first"], row
+        assert all(row[part] >= 0 for part in PARTS), row
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_memory_ordering_parts_sum_to_total(seed):
+    # a load held back by an older store waits until the store frees its station
+    rng = random.Random(seed)
+    program = generate(rng.choice(("store_heavy", "station_starved")), rng.randint(10, 60), seed)
+    config = random_config(rng).copy(disambiguate=1, forward=rng.randint(0, 1))
+    rows, path = analyze(program, config, rng.choice(("cycle", "event")))
+    assert_parts_sum(rows)
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+@pytest.mark.parametrize("name", ["input1.txt", "input2.txt"])
+def test_reference_parts_sum_to_total(name, engine):
+    from tomasulo import load_program
+    rows, path = analyze(load_program(name), None, engine)
+    assert_parts_sum(rows)
+    # the machine of the reference has nothing shared and a bus for every result
+    assert all(row["unit"] == 0 and row["cdb"] == 0 for row in rows)
+
+
+def test_input2_breakdown():
+    from tomasulo import load_program
+    rows, path = analyze(load_program("input2.txt"))
+    # DIVD F0 F4 F2 waits for both loads, then runs 20 cycles and writes back
+    assert (rows[2]["raw"], rows[2]["execution"]) == (2, 21)
+    # the second MULTD F6 waits for a multiply station until the DIVD frees one
+    assert rows[6]["structural"] > 0
+    assert [hop["reason"] for hop in path][-2:] == ["raw", "raw"]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_parts_sum_and_critical_path(seed):
+    rng = random.Random(1000 + seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 60), seed)
+    config = random_config(rng)
+    rows, path = analyze(program, config, rng.choice(("cycle", "event")))
+    assert_parts_sum(rows)
+    # the path runs forward through the program and ends at the instruction that wrote last
+    last = max(range(len(rows)), key=lambda i: (rows[i]["write"], -i))
+    assert path[-1]["index"] == last
+    assert path[0]["reason"] == "start"
+    indices = [hop["index"] for hop in path]
+    assert indices == sorted(set(indices))
+    for hop, following in zip(path, path[1:]):
+        # an instruction held up by an operand writes after its producer
+        if following["reason"] == "raw":
+            assert hop["write"] < following["write"]
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from batch import check, run_batch
+from bench import WORKLOADS, generate
+from tomasulo import Config, Simulator, load_program
+
+
+def random_configs(rng, count):
+    # the machines the batch engine models: any station counts and latencies
+    return [Config(num_add=rng.randint(1, 4), num_mul=rng.randint(1, 4), num_load=rng.randint(1, 4),
+                   num_store=rng.randint(1, 4), cycle_add=rng.randint(1, 5), cycle_sub=rng.randint(1, 5),
+                   cycle_mul=rng.randint(1, 15), cycle_div=rng.randint(1, 30), cycle_load=rng.randint(1, 4),
+                   cycle_store=rng.randint(1, 4), cycle_writeback=rng.randint(1, 2))
+            for i in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batch_matches_simulator(seed):
+    rng = random.Random(seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 80), seed)
+    configs = random_configs(rng, 8)
+    result = run_batch(program, configs)
+    for b, config in enumerate(configs):
+        expected = Simulator(program, config, engine="event").run()
+        assert result.summary(b)["timings"] == expected["timings"]
+        assert result.cycles[b] == expected["cycles"]
+
+
+def test_batch_of_programs():
+    # one program per config, all of the same length
+    programs = [generate(kind, 50, 3) for kind in WORKLOADS]
+    config = Config()
+    result = run_batch(programs, [config] * len(programs))
+    for b, program in enumerate(programs):
+        assert result.summary(b)["timings"] == Simulator(program, config).run()["timings"]
+
+
+def test_reference_programs():
+    for name in ("input1.txt", "input2.txt"):
+        program = load_program(name)
+        result = run_batch(program, [Config()])
+        assert result.summary(0)["timings"] == Simulator(program).run()["timings"]
+
+
+def test_unsupported_config():
+    with pytest.raises(ValueError):
+        check(Config(rob_size=4))
+    with pytest.raises(ValueError):
+        run_batch(load_program("input1.txt"), [Config(), Config(num_cdb=1)])
@@ -0,0 +1,93 @@
+import random
+import struct
+
+import pytest
+
+import bintrace
+from bintrace import BinaryTraceReader, BinaryTraceSink
+from tomasulo import Config, Simulator
+from test_tracing import reference
+
+
+def binary_trace(tmp_path, name, every=1, keyframe_every=4):
+    path = str(tmp_path / "trace.bin")
+    sink = BinaryTraceSink(path, every, keyframe_every)
+    Simulator.fromFile("input" + name + ".txt", Config(), sink=sink).run()
+    sink.close()
+    return path
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+@pytest.mark.parametrize("keyframe_every", [1, 4, 256])
+def test_round_trip(tmp_path, name, keyframe_every):
+    # every cycle, keyframe or delta, renders as the reference trace does
+    states, final = reference(name)
+    with BinaryTraceReader(binary_trace(tmp_path, name, keyframe_every=keyframe_every)) as reader:
+        assert len(reader) == len(states)
+        assert list(reader.cycles()) == list(range(len(states)))
+        assert reader.final() == final
+        order = list(range(len(states)))
+        random.Random(keyframe_every).shuffle(order)
+        for cycle in order:
+            assert reader.state(cycle) == states[cycle] + "\n"
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_keyframes_and_deltas(tmp_path, name):
+    states, final = reference(name)
+    with BinaryTraceReader(binary_trace(tmp_path, name, keyframe_every=4)) as reader:
+        kinds = [reader.entry(i)[2] for i in range(len(reader))]
+        assert kinds == [bintrace.KEYFRAME if i % 4 == 0 else bintrace.DELTA for i in range(len(reader))]
+        # a delta only holds the rows that changed, so it is smaller than a keyframe
+        offsets = [reader.entry(i)[1] for i in range(len(reader))] + [reader.final_offset]
+        sizes = [end - start for start, end in zip(offsets, offsets[1:])]
+        assert max(sizes[i] for i in range(len(sizes)) if kinds[i] == bintrace.DELTA) < min(sizes[::4])
+        with pytest.raises(KeyError):
+            reader.state(len(states))
+
+
+def test_sampled_trace(tmp_path):
+    states, final = reference("2")
+    with BinaryTraceReader(binary_trace(tmp_path, "2", every=5, keyframe_every=3)) as reader:
+        assert list(reader.cycles()) == list(range(0, len(states), 5))
+        for cycle in reader.cycles():
+            assert reader.state(cycle) == states[cycle] + "\n"
+        # the cycles in between were never written
+        with pytest.raises(KeyError):
+            reader.find(1)
+
+
+def test_trailer_and_index(tmp_path):
+    path = binary_trace(tmp_path, "1", keyframe_every=4)
+    with open(path, "rb") as file:
+        data = file.read()
+    index_offset, records, final_offset, magic = bintrace.TRAILER.unpack_from(data, len(data) - bintrace.TRAILER.size)
+    assert magic == bintrace.INDEX_MAGIC
+    assert index_offset + records * bintrace.INDEX.size + bintrace.TRAILER.size == len(data)
+    assert data[final_offset] == bintrace.FINAL
+    magic, version, keyframe_every, stations, registers = bintrace.HEADER.unpack_from(data, 0)
+    assert (magic, version, keyframe_every, registers) == (bintrace.MAGIC, bintrace.VERSION, 4, 32)
+    # every index entry points at a record of its cycle
+    for i in range(records):
+        cycle, offset, kind = bintrace.INDEX.unpack_from(data, index_offset + i * bintrace.INDEX.size)
+        assert bintrace.RECORD.unpack_from(data, offset)[:2] == (kind, cycle)
+
+
+def test_bad_traces(tmp_path):
+    path = binary_trace(tmp_path, "1")
+    with open(path, "rb") as file:
+        data = file.read()
+    unclosed = tmp_path / "unclosed.bin"
+    unclosed.write_bytes(data[:-bintrace.TRAILER.size])
+    with pytest.raises(ValueError):
+        BinaryTraceReader(str(unclosed))
+    other = tmp_path / "other.bin"
+    other.write_bytes(b"NOTTRACE" + data[8:])
+    with pytest.raises(ValueError):
+        BinaryTraceReader(str(other))
+    newer = tmp_path / "newer.bin"
+    newer.write_bytes(data[:8] + struct.pack("<H", bintrace.VERSION + 1) + data[10:])
+    with pytest.raises(ValueError):
+        BinaryTraceReader(str(newer))
+    with pytest.raises(ValueError):
+        BinaryTraceSink(str(tmp_path / "x.bin"), keyframe_every=0)
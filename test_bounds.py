@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from bench import WORKLOADS, generate
+from bounds import DependencyGraph
+from sweep import grid, sweep
+from test_tomasulo import random_config
+from tomasulo import Config, Simulator, load_program
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_bounds_hold(seed):
+    rng = random.Random(seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 80), seed)
+    config = random_config(rng)
+    lower, upper = DependencyGraph(program).bounds(config)
+    cycles = Simulator(program, config, engine="event").run()["cycles"]
+    assert lower <= cycles <= upper
+
+
+@pytest.mark.parametrize("name", ["input1.txt", "input2.txt"])
+def test_reference_bounds(name):
+    program = load_program(name)
+    lower, upper = DependencyGraph(program).bounds(Config())
+    assert lower <= Simulator(program).run()["cycles"] <= upper
+    # a decoded program and its tuples give the same graph
+    assert DependencyGraph(list(program)).bounds(Config()) == (lower, upper)
+
+
+def best(rows):
+    cycles = {}
+    for row in rows:
+        cycles[row["trace"]] = min(cycles.get(row["trace"], row["cycles"]), row["cycles"])
+    return cycles
+
+
+@pytest.mark.parametrize("engine", ["event", "batch"])
+def test_prune_keeps_the_best_point(tmp_path, engine):
+    if engine == "batch":
+        pytest.importorskip("numpy")
+    traces = []
+    for i, kind in enumerate(WORKLOADS):
+        path = tmp_path / (kind + ".txt")
+        path.write_text("".join(" ".join(instruction) + "\n" for instruction in generate(kind, 40, i)))
+        traces.append(str(path))
+    points = list(grid({"num_mul": [1, 2, 3], "cycle_mul": [2, 10], "cycle_div": [5, 40], "num_load": [1, 3]}))
+    full = sweep(traces, points, workers=2, engine=engine)
+    pruned = sweep(traces, points, workers=2, engine=engine, prune=True)
+    assert best(pruned) == best(full)
+    assert len(pruned) < len(full)
+    # every row that is kept is the row of the full sweep
+    for row in pruned:
+        assert row in full
@@ -0,0 +1,67 @@
+import pytest
+
+from cache import BASE_STRIDE, Cache, address_of
+
+
+def test_address_of():
+    assert address_of(("R0", 34)) == 34
+    assert address_of(("R3", 8)) == 3 * BASE_STRIDE + 8
+
+
+def test_hits_and_misses():
+    # 2 sets of 2 ways of 16 bytes
+    cache = Cache(64, 2, 16, hit=1, miss=10)
+    assert cache.access(0, 0) == 10
+    # the same line, once its fill completed
+    assert cache.access(8, 20) == 1
+    # a line whose fill is on its way waits for the rest of it
+    assert cache.access(16, 30) == 10
+    assert cache.access(20, 33) == 7
+    assert cache.stats() == {"accesses": 4, "hits": 2, "misses": 2, "hit_rate": 0.5}
+    assert Cache(64, 2, 16, 1, 10).hitRate() == 0.0
+
+
+def test_lru_victim():
+    cache = Cache(64, 2, 16, hit=1, miss=10)
+    # lines 0, 2 and 4 all map to set 0
+    cache.access(0, 0)
+    cache.access(32, 0)
+    cache.access(0, 100) # line 0 is now the most recent, line 2 the victim
+    cache.access(64, 100)
+    assert cache.access(0, 200) == 1
+    assert cache.access(32, 200) == 10
+    # set 1 was never touched
+    assert cache.access(16, 300) == 10
+    assert (cache.hits, cache.misses) == (2, 5)
+
+
+def test_mshr_limit():
+    # with two miss registers a third miss starts when the first completes
+    cache = Cache(256, 4, 16, hit=1, miss=10, mshrs=2)
+    assert [cache.access(address, 0) for address in (0, 16, 32)] == [10, 10, 20]
+    # the fourth waits for the second, the one started in cycle 0
+    assert cache.access(48, 0) == 20
+    # once they complete the misses are overlapped again
+    assert [cache.access(address, 40) for address in (64, 80)] == [10, 10]
+    unlimited = Cache(256, 4, 16, hit=1, miss=10)
+    assert [unlimited.access(address, 0) for address in (0, 16, 32, 48)] == [10] * 4
+
+
+def test_warm_and_settle():
+    cache = Cache(64, 2, 16, hit=1, miss=10)
+    cache.warm(0)
+    cache.warm(32)
+    cache.warm(64) # evicts line 0
+    assert cache.accesses == 0
+    assert cache.access(32, 0) == 1
+    assert cache.access(0, 0) == 10
+    cache.settle()
+    # the fill of line 0 is complete and the statistics start over
+    assert cache.access(0, 0) == 1
+    assert cache.stats()["accesses"] == 1
+
+
+def test_bad_geometry():
+    for size, ways, line in ((48, 2, 16), (16, 2, 16), (64, 0, 16)):
+        with pytest.raises(ValueError):
+            Cache(size, ways, line, 1, 10)
@@ -0,0 +1,114 @@
+import pytest
+
+import decode
+from decode import DecodedProgram, DecodeError, LoopProgram, Op
+from tomasulo import load_program, read_program
+
+
+def test_parse_line():
+    assert decode.parse_line("LD F6 34+ R2") == ("LD", "F6", "34+", "R2")
+    assert decode.parse_line("ld f6, 34 + R2\n") == ("LD", "F6", "34+", "R2")
+    assert decode.parse_line("SD F6 0 R3") == ("SD", "F6", "0", "R3")
+    assert decode.parse_line("   \n") is None
+    assert decode.decode_fields("SD", "F6", "0", "R3") == (Op.SD, -1, 6, -1, ("R3", 0))
+    for text in ("FOO F1 F2 F3", "ADDD F1 F2", "ADDD F1 F2 F32", "LD F1 R2"):
+        with pytest.raises(DecodeError):
+            decode.parse_line(text, 7)
+
+
+def test_decoded_program(tmp_path):
+    program = load_program("input2.txt")
+    assert isinstance(program, DecodedProgram)
+    assert list(program) == list(read_program("input2.txt"))
+    assert list(program.column(0)) == [Op.LD, Op.LD, Op.DIVD, Op.MULTD, Op.ADDD, Op.SD, Op.MULTD, Op.SD]
+    assert program.decoded(5) == (Op.SD, -1, 6, -1, ("R3", 0))
+    path = tmp_path / "bad.txt"
+    path.write_text("LD F2 0 R2\n\nADDD F0 F4\n")
+    with pytest.raises(DecodeError) as error:
+        load_program(str(path))
+    assert error.value.line == 3
+
+
+def test_loop_program(tmp_path):
+    path = tmp_path / "loop.txt"
+    path.write_text("LD F1 0 R1\nREPEAT 3 OFFSET=8\nREPEAT 2 REG=2\nLD F2 0 R2\nADDD F0 F2 F4\nEND\n"
+                    "SD F6 34+ R3\nEND\nMULTD F2 F4 F6\n")
+    program = load_program(str(path))
+    assert isinstance(program, LoopProgram)
+    expanded = list(read_program(str(path)))
+    assert list(program) == expanded
+    assert len(program) == len(expanded) == 17
+    assert [program[i] for i in range(-len(program), len(program))] == expanded + expanded
+    assert program[3:12:2] == expanded[3:12:2]
+    assert expanded[3:6] == [("LD", "F4", "0", "R2"), ("ADDD", "F2", "F4", "F6"), ("SD", "F6", "34+", "R3")]
+    assert expanded[6] == ("LD", "F2", "8+", "R2")
+    with pytest.raises(IndexError):
+        program[17]
+
+
+def write(tmp_path, text):
+    path = tmp_path / "loop.txt"
+    path.write_text(text)
+    return str(path)
+
+
+def test_nested_strides(tmp_path):
+    path = write(tmp_path, "REPEAT 2 OFFSET=8\nLD F2 0 R2\nREPEAT 2 REG=3 OFFSET=16\nADDD F0 F2 F30\nSD F0 4+ R1\nEND\nEND\n"
+                           "repeat 3, offset=-8\nLD F31 16+ R3\nend\n")
+    expected = [
+        ("LD", "F2", "0", "R2"),
+        ("ADDD", "F0", "F2", "F30"), ("SD", "F0", "4+", "R1"),
+        ("ADDD", "F3", "F5", "F1"), ("SD", "F3", "20+", "R1"),
+        ("LD", "F2", "8+", "R2"),
+        ("ADDD", "F0", "F2", "F30"), ("SD", "F0", "12+", "R1"),
+        ("ADDD", "F3", "F5", "F1"), ("SD", "F3", "28+", "R1"),
+        ("LD", "F31", "16+", "R3"), ("LD", "F31", "8+", "R3"), ("LD", "F31", "0+", "R3"),
+    ]
+    program = load_program(path)
+    assert list(program) == list(read_program(path)) == expected
+    assert [program[i] for i in range(len(program))] == expected
+
+
+@pytest.mark.parametrize("text, line, message", [
+    ("LD F2 0 R2\nEND\n", 2, "END without a REPEAT"),
+    ("REPEAT 2\nLD F2 0 R2\nEND\nEND\n", 4, "END without a REPEAT"),
+    ("LD F2 0 R2\nREPEAT 2\nLD F2 0 R2\n", 2, "REPEAT without an END"),
+    ("REPEAT 2\nREPEAT 3\nLD F2 0 R2\nEND\n", 1, "REPEAT without an END"),
+    ("REPEAT 2\nREPEAT 3\nLD F2 0 R2\n", 2, "REPEAT without an END"),
+    ("REPEAT\nLD F2 0 R2\nEND\n", 1, "REPEAT needs an iteration count"),
+    ("REPEAT 2 STEP=1\nLD F2 0 R2\nEND\n", 1, "bad REPEAT option"),
+    ("REPEAT 2\nLD F2 0 R2\nEND 2\n", 3, "END takes no operands"),
+])
+def test_loop_errors(tmp_path, text, line, message):
+    path = write(tmp_path, text)
+    for read in (load_program, lambda path: list(read_program(path))):
+        with pytest.raises(DecodeError) as error:
+            read(path)
+        assert error.value.line == line
+        assert message in str(error.value)
+
+
+def test_repeat_zero(tmp_path):
+    path = write(tmp_path, "LD F2 0 R2\nREPEAT 0 REG=1\nADDD F0 F2 F4\nREPEAT 5\nSD F0 0 R1\nEND\nEND\n"
+                           "REPEAT 2\nREPEAT 0\nMULTD F6 F2 F4\nEND\nSUBD F8 F6 F2\nEND\n")
+    program = load_program(path)
+    expected = [("LD", "F2", "0", "R2"), ("SUBD", "F8", "F6", "F2"), ("SUBD", "F8", "F6", "F2")]
+    assert list(program) == list(read_program(path)) == expected
+    assert len(program) == 3 and program[1] == program[2] == expected[1]
+    assert list(load_program(write(tmp_path, "REPEAT 0\nLD F2 0 R2\nEND\n"))) == []
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+def test_streamed_loop_trace(tmp_path, engine):
+    # the final table of --stream, written row by row as the instructions retire, is
+    # that of the whole program
+    from tomasulo import main
+    path = write(tmp_path, "LD F2 0 R2\nREPEAT 30 REG=2 OFFSET=8\nLD F4 0 R3\nREPEAT 2 REG=1\nMULTD F6 F2 F4\n"
+                           "END\nADDD F8 F6 F4\nSD F8 0 R1\nEND\nDIVD F0 F8 F2\n")
+    whole = tmp_path / "whole.txt"
+    streamed = tmp_path / "streamed.txt"
+    main([path, str(whole), "--trace", "final", "--quiet", "--engine", engine, "--rob-size", "8"])
+    main([path, str(tmp_path / "none.txt"), "--trace", "none", "--quiet", "--engine", engine, "--rob-size", "8",
+          "--stream", "--results", str(streamed)])
+    assert streamed.read_text() == whole.read_text()
+    assert len(whole.read_text().splitlines()) == 2 + 30 * 5
@@ -0,0 +1,68 @@
+import pickle
+import sys
+
+from expr import ExprTable
+
+
+def test_equal_expressions_are_shared():
+    exprs = ExprTable()
+    a = exprs.node("+", "M(A1)", "F2")
+    b = exprs.node("+", exprs.leaf("M(A1)"), "F2")
+    assert a is b
+    assert a.left is exprs.leaf("M(A1)")
+    # a parent built from equal operands is the same node, down to the leaves
+    product = exprs.node("*", a, exprs.node("-", "F4", "F6"))
+    assert exprs.node("*", b, exprs.node("-", "F4", "F6")) is product
+    assert exprs.node("*", exprs.node("-", "F4", "F6"), a) is not product
+    assert exprs.node("-", "M(A1)", "F2") is not a
+    # four leaves and the three nodes still referenced, the others are gone
+    assert len(exprs) == 4 + 3
+
+
+def test_render():
+    exprs = ExprTable()
+    quotient = exprs.node("/", "F0", "F6")
+    assert str(exprs.node("+", quotient, "F2")) == "F0 / F6 + F2"
+    assert str(exprs.node("*", quotient, "F2")) == "(F0 / F6) * F2"
+    assert str(exprs.node("/", "F8", exprs.node("-", quotient, "F2"))) == "F8 / (F0 / F6 - F2)"
+    assert str(exprs.node("*", "F8", exprs.node("-", "F4", "F2"))) == "F8 * F4 - F2"
+
+
+def test_deep_chain_renders_without_recursion():
+    exprs = ExprTable()
+    value = exprs.leaf("F0")
+    length = sys.getrecursionlimit() * 20
+    for i in range(length):
+        value = exprs.node("*" if i % 2 else "+", value, "M(A1)")
+    text = value.render()
+    assert text.startswith("F0 + M(A1) * M(A1) + ")
+    assert text.count("M(A1)") == length
+    # the operand only keeps its text until its parent is rendered
+    assert value.left.text is None
+
+
+def test_shared_subtrees_render_once_per_use():
+    exprs = ExprTable()
+    value = exprs.leaf("F2")
+    for i in range(12):
+        value = exprs.node("+", value, value)
+    # thirteen nodes stand for a text of 4096 leaves
+    assert len(exprs) == 13
+    assert str(value).split(" + ") == ["F2"] * 4096
+
+
+def test_unreferenced_expressions_are_dropped():
+    exprs = ExprTable()
+    kept = exprs.node("+", "F2", exprs.node("-", "F4", "F6"))
+    for i in range(1000):
+        exprs.node("*", kept, "M(A" + str(i) + ")")
+    assert len(exprs) == 5
+    assert exprs.node("-", "F4", "F6") is kept.right
+
+
+def test_pickle_keeps_sharing():
+    exprs = ExprTable()
+    value = exprs.node("*", exprs.node("/", "F0", "F6"), "F2")
+    exprs, value = pickle.loads(pickle.dumps((exprs, value)))
+    assert exprs.node("*", exprs.node("/", "F0", "F6"), "F2") is value
+    assert str(value) == "(F0 / F6) * F2"
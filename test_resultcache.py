@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from resultcache import LOW_WATER, ResultCache, result_key, trace_digest
+from tomasulo import Config, Simulator, load_program
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path), keep_trace=True)
+    program = load_program("input2.txt")
+    config = Config(cycle_mul=5)
+    first = cache.run(program, config, "event")
+    assert first == Simulator(program, config, engine="event").run()
+    assert cache.run(program, config, "event") == first
+    assert cache.stats() == {"entries": 1, "bytes": cache.size(), "hits": 1, "misses": 1}
+    key = result_key(program, config, "event")
+    assert cache.get(key) == first
+    assert cache.trace(key) == list(program)
+    assert cache.get(result_key(program, config, "cycle")) is None
+    assert cache.trace(result_key(program, config, "cycle")) is None
+    cache.clear()
+    assert cache.get(key) is None and cache.stats()["entries"] == 0
+
+
+def test_key_sensitivity():
+    program = list(load_program("input1.txt"))
+    key = result_key(program, Config())
+    assert result_key(program, Config(), "cycle", trace_digest(program)) == key
+    # the key is that of the normalized instructions
+    assert result_key([(op.lower(), " " + dest, src1, src2) for op, dest, src1, src2 in program], Config()) == key
+    assert result_key(program, Config(), "event") != key
+    for change in ({"cycle_mul": 5}, {"num_add": 2}, {"rob_size": 4}, {"cache_size": 256}, {"forward": 1}):
+        assert result_key(program, Config(**change)) != key
+    assert result_key(program[:-1], Config()) != key
+    assert result_key(program[1:] + program[:1], Config()) != key
+
+
+def fill(cache, count):
+    # count entries of one size, the i-th last used at time 1000 + i
+    keys = []
+    for i in range(count):
+        key = "%064x" % i
+        cache.put(key, {"cycles": i, "pad": b"x" * 1000})
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+        keys.append(key)
+    return keys
+
+
+def test_eviction_down_to_low_water(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=0)
+    keys = fill(cache, 20)
+    size = os.path.getsize(cache.path(keys[0]))
+    # a hit makes the oldest entry the most recent one
+    cache.get(keys[0])
+    cache.max_bytes = size * 10
+    removed = cache.evict()
+    assert cache.size() <= cache.max_bytes * LOW_WATER
+    assert removed == 20 - int(10 * LOW_WATER)
+    left = [key for key in keys if cache.get(key) is not None]
+    assert left == [keys[0]] + keys[20 - len(left) + 1:]
+    # below max_bytes nothing goes
+    assert cache.evict() == 0
+
+
+def test_put_evicts(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=0)
+    size = os.path.getsize(cache.path(fill(cache, 1)[0]))
+    cache = ResultCache(str(tmp_path), max_bytes=size * 5)
+    for key in fill(cache, 30):
+        assert cache.size() <= cache.max_bytes
+    assert cache.stats()["entries"] >= int(5 * LOW_WATER)
+
+
+@pytest.mark.parametrize("damage", ["truncate", "flip", "empty", "other"])
+def test_corrupt_entry_is_recomputed(tmp_path, damage):
+    cache = ResultCache(str(tmp_path))
+    program = load_program("input1.txt")
+    expected = cache.run(program)
+    path = cache.path(result_key(program, Config()))
+    with open(path, "rb") as file:
+        data = bytearray(file.read())
+    if damage == "truncate":
+        data = data[:len(data) // 2]
+    elif damage == "flip":
+        for i in range(20, len(data), 7):
+            data[i] ^= 0x5a
+    elif damage == "empty":
+        data = b""
+    else:
+        data = b"\x80\x04]\x94."  # a pickled empty list, not an entry
+    with open(path, "wb") as file:
+        file.write(data)
+    assert cache.run(program) == expected
+    assert (cache.hits, cache.misses) == (0, 2)
+    # the entry was written again
+    assert cache.run(program) == expected
+    assert cache.hits == 1
@@ -0,0 +1,68 @@
+import pytest
+
+from bench import WORKLOADS, generate
+from sampling import MIN_WINDOWS, Sampler, t_quantile
+from tomasulo import Config, Simulator
+
+
+def exact_cycles(program, config):
+    return Simulator(program, config, engine="event", symbolic=False).run()["cycles"]
+
+
+def windows_fit(sampler, count):
+    # the length of a trace whose last instruction ends the count-th window
+    return (count - 1) * sampler.period + sampler.offset + sampler.window
+
+
+@pytest.mark.parametrize("config", [Config(), Config(cache_size=1024)])
+def test_short_trace_runs_in_full(config):
+    sampler = Sampler(config, rate=0.1, window=100, seed=3)
+    program = generate("station_starved", windows_fit(sampler, MIN_WINDOWS) - 1)
+    # the trace is read once, so the instructions it had to be kept
+    result = sampler.run(iter(program))
+    assert result.exact
+    assert result.cycles == exact_cycles(program, config)
+    assert result.instructions == result.detailed == len(program)
+    assert result.cyclesInterval() == (result.cycles, result.cycles)
+    assert result.summary()["windows"] == 0
+
+
+def test_enough_windows_are_sampled():
+    sampler = Sampler(Config(), rate=0.1, window=100, seed=3)
+    program = generate("station_starved", windows_fit(sampler, MIN_WINDOWS))
+    result = sampler.run(program)
+    assert not result.exact
+    assert len(result.cpis) == MIN_WINDOWS
+    assert result.instructions == len(program)
+    assert result.detailed == MIN_WINDOWS * (sampler.window + sampler.warmup)
+
+
+@pytest.mark.parametrize("config", [Config(), Config(cache_size=1024)])
+@pytest.mark.parametrize("kind", WORKLOADS)
+def test_sampled_estimate(kind, config):
+    program = generate(kind, 8000)
+    cycles = exact_cycles(program, config)
+    result = Sampler(config, rate=0.1, window=160).run(program)
+    assert len(result.cpis) == 5
+    assert abs(result.cycles - cycles) <= 0.05 * cycles
+    low, high = result.cyclesInterval()
+    assert low <= cycles <= high
+    # the sample is a fifth of the trace
+    assert result.detailed == 5 * 2 * 160
+
+
+def test_same_seed_same_estimate():
+    program = generate("independent", 5000)
+    first = Sampler(rate=0.1, window=100, seed=7).run(program)
+    assert Sampler(rate=0.1, window=100, seed=7).run(iter(program)).cpis == first.cpis
+
+
+def test_t_quantile():
+    for df, expected in ((3, 3.182), (5, 2.571), (10, 2.228), (30, 2.042)):
+        assert t_quantile(0.975, df) == pytest.approx(expected, rel=0.01)
+
+
+def test_bad_options():
+    for options in ({"rate": 0}, {"rate": 1.5}, {"window": 0}, {"confidence": 1}):
+        with pytest.raises(ValueError):
+            Sampler(**options)
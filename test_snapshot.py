@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+import snapshot
+from bench import WORKLOADS, generate
+from test_tomasulo import random_config
+from tomasulo import Config, Simulator, load_program
+from tracing import TRACE_FULL, TraceSink
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+@pytest.mark.parametrize("seed", range(20))
+def test_restore_finishes_like_an_uninterrupted_run(seed, engine):
+    rng = random.Random(seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 60), seed)
+    config = random_config(rng)
+    whole = Simulator(program, config, engine=engine).run()
+    simulator = Simulator(program, config, engine=engine)
+    simulator.advance(rng.randint(0, whole["cycles"]))
+    restored = Simulator.restore(simulator.snapshot())
+    assert restored.run()["timings"] == whole["timings"]
+    # the original goes on as if it had never been saved
+    assert simulator.run()["timings"] == whole["timings"]
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_resumed_trace_continues_the_saved_one(tmp_path, name):
+    # the trace of the prefix followed by the trace of the resumed run is the
+    # trace of the whole run
+    program = load_program("input" + name + ".txt")
+    path = tmp_path / "state.snap"
+    output = tmp_path / "output.txt"
+    simulator = Simulator(program, Config(), sink=TraceSink(str(output), TRACE_FULL))
+    simulator.advance(20)
+    simulator.save(str(path))
+    simulator.close()
+    restored = Simulator.restore(str(path), sink=TraceSink(str(output), TRACE_FULL))
+    restored.run()
+    restored.close()
+    with open("output" + name + ".txt") as file:
+        assert output.read_text() == file.read()
+
+
+def test_restore_streamed_program():
+    program = generate("station_starved", 300)
+    config = Config(rob_size=8, cache_size=256)
+    whole = Simulator(program, config, engine="event").run()
+    retired = []
+    simulator = Simulator(iter(program), config, engine="event", stream=True,
+                          on_retire=lambda index, instruction: retired.append((index, instruction.writeTime)))
+    simulator.advance(whole["cycles"] // 2)
+    restored = Simulator.restore(simulator.snapshot(), iter(program),
+                                 on_retire=lambda index, instruction: retired.append((index, instruction.writeTime)))
+    assert restored.run()["cycles"] == whole["cycles"]
+    assert retired == [(i, row[2]) for i, row in enumerate(whole["timings"])]
+
+
+def test_fork():
+    program = load_program("input2.txt")
+    simulator = Simulator(program, Config())
+    simulator.advance(10)
+    same = simulator.fork()
+    slower = simulator.fork(cycle_mul=30)
+    whole = Simulator(program, Config()).run()
+    assert same.run()["timings"] == whole["timings"]
+    assert slower.run()["cycles"] > whole["cycles"]
+    # the forks share nothing with the simulator they were taken from
+    assert simulator.config.cycle_mul == Config().cycle_mul
+    assert simulator.run()["timings"] == whole["timings"]
+    with pytest.raises(ValueError):
+        simulator.fork(num_add=5)
+
+
+def test_bad_snapshot():
+    with pytest.raises(ValueError):
+        snapshot.loads(b"not a snapshot at all, but long enough for a header")
+    data = bytearray(Simulator(load_program("input1.txt")).snapshot())
+    data[8] += 1 # the version
+    with pytest.raises(ValueError):
+        snapshot.loads(bytes(data))
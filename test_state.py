@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from bench import WORKLOADS, generate
+from test_tomasulo import random_config
+from test_tracing import reference
+from tomasulo import Config, Simulator, load_program
+from tracing import render_state
+
+
+def fields(state):
+    return state.cycle, state.pc, state.stationRows, state.registerRows, state.registers, state.stations, state.rob, state.timings
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_filters_select_the_same_cycles_on_both_engines(seed):
+    rng = random.Random(seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 60), seed)
+    config = random_config(rng)
+    cycles = Simulator(program, config).run()["cycles"]
+    every = rng.choice((1, 2, 3, 7))
+    modulus = rng.randint(1, 5)
+    where = rng.choice((None, lambda cycle: cycle % modulus == 0 or cycle == cycles - 1))
+    stop = rng.choice((None, rng.randint(0, cycles)))
+    end = cycles if stop is None else min(stop, cycles)
+    expected = [cycle for cycle in range(end + 1) if cycle % every == 0 and (where is None or where(cycle))]
+    states = {}
+    for engine in ("cycle", "event"):
+        states[engine] = [fields(state) for state in
+                          Simulator(program, config, engine=engine).simulate(every, where, stop)]
+        assert [state[0] for state in states[engine]] == expected
+    assert states["event"] == states["cycle"]
+
+
+def test_every_zero_makes_no_state():
+    simulator = Simulator(load_program("input1.txt"))
+    assert list(simulator.simulate(every=0)) == []
+    assert simulator.isDone()
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+def test_detached_states_keep_their_values(engine):
+    program = generate("station_starved", 40)
+    config = Config(rob_size=4, cache_size=256)
+    # read while the simulator is still at the cycle of the state
+    live = [fields(state) for state in Simulator(program, config, engine=engine).simulate()]
+    # read once the simulator has finished
+    kept = list(Simulator(program, config, engine=engine).simulate())
+    assert all(state._simulator is None for state in kept)
+    assert [fields(state) for state in kept] == live
+    # the values of a kept state are not rendered again later
+    assert len({fields(state)[3] for state in kept}) > 1
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_states_render_the_reference_trace(name, engine):
+    states, final = reference(name)
+    simulator = Simulator.fromFile("input" + name + ".txt", Config(), engine=engine)
+    rendered = [render_state(state.cycle, state.stationRows, state.registerRows) for state in simulator.simulate()]
+    assert rendered == [state + "\n" for state in states]
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+@pytest.mark.parametrize("rob_size", [0, 8])
+def test_timings_hide_future_times(engine, rob_size):
+    program = load_program("input2.txt")
+    simulator = Simulator(program, Config(rob_size=rob_size), engine=engine)
+    states = list(simulator.simulate())
+    final = simulator.summary()["timings"]
+    for state in states:
+        for row, times in zip(state.timings, final):
+            assert len(row) == len(times) == (4 if rob_size else 3)
+            # a time shows once its cycle has come, the execute cycle with the write
+            assert row[0] == (times[0] if times[0] <= state.cycle else -1)
+            assert row[2] == (times[2] if times[2] <= state.cycle else -1)
+            assert row[1] == (times[1] if row[2] != -1 else -1)
+            if rob_size:
+                assert row[3] == (times[3] if times[3] <= state.cycle else -1)
+
+
+def test_streamed_states_have_no_timings():
+    simulator = Simulator(iter(load_program("input2.txt")), Config(), stream=True)
+    states = list(simulator.simulate(every=10))
+    assert [state.cycle for state in states] == [0, 10, 20, 30]
+    assert all(state.timings == () for state in states)
@@ -0,0 +1,171 @@
+import random
+
+import pytest
+
+from bench import WORKLOADS, generate
+from tomasulo import Config, Simulator, load_program
+
+# python -m pytest -q
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_reference_output(tmp_path, name, engine):
+    # without a reorder buffer the trace and the final table are those of the
+    # original algorithm, byte for byte
+    output = tmp_path / "output.txt"
+    simulator = Simulator.fromFile("input" + name + ".txt", Config(), output_file=str(output), engine=engine)
+    simulator.run()
+    simulator.close()
+    with open("output" + name + ".txt") as file:
+        assert output.read_text() == file.read()
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+def test_rob_commit_column(engine):
+    result = Simulator.fromFile("input2.txt", Config(rob_size=8), engine=engine).run()
+    assert result["timings"] == [
+        (1, 3, 4, 5), (2, 4, 5, 6), (3, 25, 26, 27), (4, 36, 37, 38),
+        (5, 7, 8, 39), (6, 39, 40, 40), (26, 36, 37, 41), (27, 39, 40, 42),
+    ]
+    assert result["cycles"] == 42
+
+
+def test_rob_commits_in_order():
+    # every instruction commits after its write back (a store, which has no write
+    # back, no earlier than the end of its countdown), in program order and at most
+    # commit_width per cycle
+    program = load_program("input2.txt")
+    for size, width in ((2, 1), (4, 1), (8, 2)):
+        result = Simulator(program, Config(rob_size=size, commit_width=width)).run()
+        commits = [row[3] for row in result["timings"]]
+        assert commits == sorted(commits)
+        assert all(commits.count(cycle) <= width for cycle in commits)
+        for (issue, execute, write, commit), instruction in zip(result["timings"], program):
+            if instruction[0] == "SD":
+                assert commit >= write
+            else:
+                assert commit > write
+
+
+def random_config(rng):
+    # a machine with every feature the engines model, each drawn at random
+    return Config(num_add=rng.randint(1, 3), num_mul=rng.randint(1, 3), num_load=rng.randint(1, 3),
+                  num_store=rng.randint(1, 3), cycle_mul=rng.randint(1, 12), cycle_div=rng.randint(1, 25),
+                  issue_width=rng.randint(1, 2), num_cdb=rng.randint(0, 2),
+                  num_add_units=rng.randint(0, 2), num_mul_units=rng.randint(0, 2), interval_mul=rng.randint(0, 3),
+                  rob_size=rng.choice((0, 0, 4, 8)), commit_width=rng.randint(1, 2),
+                  disambiguate=rng.randint(0, 1), forward=rng.randint(0, 1), cache_size=rng.choice((0, 256)))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_event_engine_matches_cycle_engine(seed):
+    rng = random.Random(seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 80), seed)
+    config = random_config(rng)
+    cycle = Simulator(program, config, engine="cycle").run()
+    event = Simulator(program, config, engine="event").run()
+    assert event["timings"] == cycle["timings"]
+    assert event["cycles"] == cycle["cycles"]
+    assert event["steps"] <= cycle["steps"]
+
+
+def test_event_engine_skips_countdowns():
+    # a chain of long latency operations is mostly cycles in which stations only count down
+    program = generate("raw_chain", 200)
+    cycle = Simulator(program, engine="cycle").run()
+    event = Simulator(program, engine="event").run()
+    assert event["steps"] * 2 < cycle["steps"]
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+def test_metrics_tell_rob_stalls_from_station_stalls(engine):
+    from metrics import Metrics
+    program = generate("independent", 200)
+    totals = []
+    for config in (Config(), Config(rob_size=2)):
+        metrics = Metrics(per_cycle=False)
+        Simulator(program, config, engine=engine, hooks=[metrics]).run()
+        totals.append((metrics.totals["stall_no_station"], metrics.totals["stall_rob_full"]))
+    assert totals[0][0] > 0 and totals[0][1] == 0
+    assert totals[1] == (0, totals[1][1]) and totals[1][1] > 0
+
+
+def test_streamed_symbolic_values_stay_bounded():
+    # the expression table only holds the values that are still referenced, so a
+    # streamed run keeps as many as its window, however long the trace is
+    from tomasulo import Hook
+
+    class Largest(Hook):
+        def __init__(self):
+            self.size = 0
+
+        def endCycle(self, simulator):
+            self.size = max(self.size, len(simulator.exprs))
+
+    sizes = []
+    for length in (2000, 20000):
+        largest = Largest()
+        Simulator(iter(generate("independent", length)), Config(), engine="event", stream=True,
+                  hooks=[largest]).run()
+        sizes.append(largest.size)
+    assert sizes[1] <= sizes[0] + 8
+    assert sizes[1] < 200
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+def test_shared_unit_utilization(engine):
+    # one pipelined-off multiplier is busy for the 20 cycles of the DIVD and the 10
+    # of each MULTD of input2.txt
+    result = Simulator.fromFile("input2.txt", Config(num_mul_units=1, interval_mul=0), engine=engine).run()
+    assert result["utilization"]["mul_units"] == pytest.approx(40 / result["cycles"])
+    assert result["utilization"]["add_units"] == 0.0
+
+
+def test_forwarded_loads_do_not_number_memory_reads():
+    program = [("LD", "F6", "0", "R2"), ("SD", "F6", "0", "R1"), ("LD", "F2", "0", "R1"), ("LD", "F4", "8+", "R2")]
+    simulator = Simulator(program, Config(disambiguate=1, forward=1))
+    result = simulator.run()
+    assert result["forwarded"] == 1
+    assert [str(simulator.registers[i].value) for i in (6, 2, 4)] == ["M(A1)", "M(A1)", "M(A2)"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_streamed_rows_match_the_final_table(seed):
+    # on_retire gets the rows of the final table in program order, with the same
+    # times as a run that keeps the whole program
+    rng = random.Random(seed)
+    program = generate(rng.choice(WORKLOADS), rng.randint(1, 80), seed)
+    config = random_config(rng)
+    engine = rng.choice(("cycle", "event"))
+    whole = Simulator(program, config, engine=engine)
+    whole.run()
+    rows = []
+    Simulator(iter(program), config, engine=engine, stream=True,
+              on_retire=lambda index, instruction: rows.append(instruction.toTableLine(index))).run()
+    assert "".join(rows) == whole.result_table()
+
+
+@pytest.mark.parametrize("engine", ["cycle", "event"])
+@pytest.mark.parametrize("kind", WORKLOADS)
+def test_streamed_window_stays_bounded(engine, kind):
+    # the window holds the instructions from the oldest one not yet retired up to pc;
+    # the reorder buffer bounds it, and without one the stations nearly do
+    from tomasulo import Hook
+
+    class Widest(Hook):
+        def __init__(self):
+            self.size = 0
+
+        def endCycle(self, simulator):
+            self.size = max(self.size, len(simulator.fetch.window))
+
+    for config in (Config(), Config(rob_size=8)):
+        widest = Widest()
+        simulator = Simulator(iter(generate(kind, 3000)), config, engine=engine, stream=True, hooks=[widest])
+        simulator.run()
+        assert simulator.fetch.window == {} and simulator.fetch.count == 3000
+        if config.rob_size:
+            assert widest.size <= config.rob_size + config.issue_width
+        else:
+            assert widest.size < 32
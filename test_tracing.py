@@ -0,0 +1,82 @@
+import pytest
+
+from tomasulo import Config, Simulator, load_program
+from tracing import TRACE_FINAL, TRACE_FULL, TRACE_NONE, TRACE_SAMPLED, ResultSink, TraceSink
+
+
+def reference(name):
+    # the states of output<name>.txt by cycle, and its final table
+    with open("output" + name + ".txt") as file:
+        blocks = file.read().split("\n\n")
+    return blocks[:-1], blocks[-1]
+
+
+def trace(tmp_path, name, sink):
+    Simulator.fromFile("input" + name + ".txt", Config(), sink=sink).run()
+    sink.close()
+    path = tmp_path / "output.txt"
+    return path.read_text() if path.exists() else None
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+@pytest.mark.parametrize("every", [1, 3, 7])
+def test_sampled_trace_keeps_every_nth_cycle(tmp_path, name, every):
+    states, final = reference(name)
+    text = trace(tmp_path, name, TraceSink(str(tmp_path / "output.txt"), TRACE_SAMPLED, every))
+    assert text == "".join(state + "\n\n" for state in states[::every]) + final
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_trace_levels(tmp_path, name):
+    states, final = reference(name)
+    assert trace(tmp_path, name, TraceSink(str(tmp_path / "output.txt"), TRACE_FINAL)) == final
+    (tmp_path / "output.txt").unlink()
+    assert trace(tmp_path, name, TraceSink(str(tmp_path / "output.txt"), TRACE_NONE)) is None
+    # a full trace is the reference whatever the size of the buffer
+    for flush_size in (1, 100, 1 << 20):
+        (tmp_path / "output.txt").unlink(missing_ok=True)
+        text = trace(tmp_path, name, TraceSink(str(tmp_path / "output.txt"), TRACE_FULL, flush_size=flush_size))
+        assert text == "".join(state + "\n\n" for state in states) + final
+
+
+def test_buffering(tmp_path):
+    path = tmp_path / "output.txt"
+    sink = TraceSink(str(path), flush_size=10)
+    sink.writeFile("12345")
+    # nothing is opened until the buffer is full
+    assert not path.exists() and sink.buffered == 5
+    sink.writeFile("67890")
+    assert path.read_text() == "1234567890" and sink.buffered == 0
+    sink.writeFile("abc")
+    assert path.read_text() == "1234567890"
+    sink.close()
+    assert path.read_text() == "1234567890abc"
+    # a second sink appends to the same file
+    with TraceSink(str(path)) as sink:
+        sink.writeFile("def")
+    assert path.read_text() == "1234567890abcdef"
+
+
+def test_echo_and_no_path(capsys):
+    with TraceSink(None, TRACE_SAMPLED, every=2, echo=True) as sink:
+        assert [cycle for cycle in range(6) if sink.wantsCycle(cycle)] == [0, 2, 4]
+        sink.writeState(2, ["Add1: No;"], ["F0:  ; "])
+        sink.writeFinal("Instruction 0 : ADDD F0 F2 F4 || 1, 3, 4\n")
+        assert sink.buffer == []
+    assert capsys.readouterr().out == "Cycle_2\nAdd1: No;\nF0:  ; \n\nInstruction 0 : ADDD F0 F2 F4 || 1, 3, 4\n\n"
+
+
+def test_bad_options():
+    with pytest.raises(ValueError):
+        TraceSink("output.txt", "everything")
+    with pytest.raises(ValueError):
+        TraceSink("output.txt", TRACE_SAMPLED, every=0)
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_result_sink_writes_the_final_table(tmp_path, name):
+    states, final = reference(name)
+    path = tmp_path / "results.txt"
+    with ResultSink(str(path), flush_size=1) as sink:
+        Simulator(iter(load_program("input" + name + ".txt")), Config(), stream=True, on_retire=sink).run()
+    assert path.read_text() == final
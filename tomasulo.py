@@ -6,7 +6,22 @@
 @Contact :   zhangmx67@mail2.sysu.edu.cn
 '''
 
+import argparse
+import heapq
+import itertools
+import os
+import sys
 import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from bintrace import BinaryTraceSink
+from cache import Cache, address_of
+from decode import LATENCY_FIELDS, OPCODES, DecodeError, Op, decode_fields, expand_lines
+from expr import ExprTable
+from state import CycleState
+from tracing import TRACE_FULL, TRACE_LEVELS, TRACE_NONE, ResultSink, TraceSink
 
 # use tomasulo algorithm to simulate the execution of a program
 
@@ -30,9 +45,63 @@ num_mul = 2
 num_load = 3
 num_store = 3
 
-def getExecuteTime(op):
-    if op == "ADDD" or op == "SUBD":
+issue_width = 1 # instructions issued per cycle, in order
+num_cdb = 0 # results broadcast per cycle, 0 for as many as finish
+
+# functional units shared by the Add and Mult stations, 0 gives every station its
+# own unit as the original algorithm does
+num_add_units = 0
+num_mul_units = 0
+# cycles before a unit accepts the next operation, 1 is fully pipelined and 0 means
+# not pipelined at all (the unit waits for the operation to finish)
+interval_add = 1
+interval_mul = 1
+interval_div = 0
+
+# entries of the reorder buffer, 0 writes results straight into the registers as the
+# original algorithm does; with a reorder buffer the results are committed in order
+rob_size = 0
+commit_width = 1 # instructions committed per cycle
+
+# memory ordering of LD and SD, by the base register and offset of their operands:
+# with disambiguate a load waits until the older stores to its address have written
+# memory, with forward it takes the data of the youngest of them instead, cycle_forward
+# cycles after the data is there; both 0 treat every load as independent
+disambiguate = 0
+forward = 0
+cycle_forward = 1
+
+# data cache in front of the load and store buffers, see cache.py; cache_size 0 keeps
+# the fixed cycle_load/cycle_store latencies
+cache_size = 0 # bytes
+cache_ways = 2
+cache_line = 32 # bytes
+cycle_hit = 2
+cycle_miss = 20
+cache_mshrs = 0 # outstanding misses, 0 for no limit
+
+# every parameter above that belongs to the simulated machine
+CONFIG_FIELDS = ("cycle_load", "cycle_store", "cycle_issue", "cycle_writeback",
+                 "cycle_add", "cycle_sub", "cycle_mul", "cycle_div",
+                 "num_add", "num_mul", "num_load", "num_store", "issue_width", "num_cdb",
+                 "num_add_units", "num_mul_units", "interval_add", "interval_mul", "interval_div",
+                 "rob_size", "commit_width", "disambiguate", "forward", "cycle_forward",
+                 "cache_size", "cache_ways", "cache_line", "cycle_hit", "cycle_miss", "cache_mshrs")
+
+# the parameters a fork of a running simulation may change, the others shape the
+# stations and buffers that are already in use
+FORK_FIELDS = ("cycle_load", "cycle_store", "cycle_issue", "cycle_writeback",
+               "cycle_add", "cycle_sub", "cycle_mul", "cycle_div", "issue_width", "num_cdb",
+               "interval_add", "interval_mul", "interval_div", "commit_width", "cycle_forward",
+               "cycle_hit", "cycle_miss")
+
+def getExecuteTime(op, config=None):
+    if config is not None:
+        return config.getExecuteTime(op)
+    if op == "ADDD":
         return cycle_add
+    elif op == "SUBD":
+        return cycle_sub
     elif op == "MULTD":
         return cycle_mul
     elif op == "DIVD":
@@ -44,15 +113,70 @@ def getExecuteTime(op):
     else:
         return 0
 
+
+class Config:
+    # latencies and unit counts of one simulated machine
+    # parameters that are not given take the module level value at creation time,
+    # so editing the top of this file still changes the default machine
+    def __init__(self, **params):
+        for name in CONFIG_FIELDS:
+            setattr(self, name, params.pop(name, globals()[name]))
+        if params:
+            raise TypeError("unknown config parameter: " + ", ".join(sorted(params)))
+
+    def getExecuteTime(self, op):
+        code = OPCODES.get(op)
+        if code is None:
+            return 0
+        return getattr(self, LATENCY_FIELDS[code])
+
+    def latency(self, code):
+        # getExecuteTime() of a decoded opcode
+        return getattr(self, LATENCY_FIELDS[code])
+
+    def getInterval(self, op):
+        if op == "ADDD" or op == "SUBD":
+            interval = self.interval_add
+        elif op == "MULTD":
+            interval = self.interval_mul
+        elif op == "DIVD":
+            interval = self.interval_div
+        else:
+            interval = 1
+        if interval == 0:
+            return self.getExecuteTime(op)
+        return interval
+
+    def ordersMemory(self):
+        return bool(self.disambiguate or self.forward)
+
+    def copy(self, **changes):
+        params = self.toDict()
+        params.update(changes)
+        return Config(**params)
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in CONFIG_FIELDS}
+
+    def __repr__(self):
+        return "Config(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in CONFIG_FIELDS) + ")"
+
 class Instruction:
+    __slots__ = ("op", "dest", "src1", "src2", "code", "rd", "rs1", "rs2", "address",
+                 "issueTime", "writeTime", "commitTime")
+
     def __init__(self, op, dest, src1, src2):
         self.op = op # operation
         self.dest = dest # destination register
         self.src1 = src1 # source register 1
         self.src2 = src2 # source register 2
+        # decoded once here, see decode.py: opcode, register indices and the
+        # (base register, offset) of a LD/SD
+        self.code, self.rd, self.rs1, self.rs2, self.address = decode_fields(op, dest, src1, src2)
         self.issueTime = -1 # cycle number when the instruction is issued
         # the execute complished time is writeback time - 1
         self.writeTime = -1 # cycle number when the instruction is written back
+        self.commitTime = -1 # cycle number when the reorder buffer commits it, -1 without one
     
     def issue(self, cycle):
         self.issueTime = cycle
@@ -62,9 +186,20 @@ class Instruction:
     def setWriteTime(self, cycle):
         self.writeTime = cycle
 
+    def setCommitTime(self, cycle):
+        self.commitTime = cycle
+
     def toString(self):
         return self.op + " " + self.dest + " " + self.src1 + " " + self.src2
 
+    # one row of the final table, index is the position of the instruction in the program
+    # a run with a reorder buffer adds the commit cycle as a fourth column
+    def toTableLine(self, index):
+        line = "Instruction " + str(index) + " : " + self.toString() + " || " + str(self.issueTime) + ", " + str(self.writeTime - 1) + ", " + str(self.writeTime)
+        if self.commitTime != -1:
+            line += ", " + str(self.commitTime)
+        return line + "\n"
+
 class Register:
     def __init__(self, name):
         self.name = name # name of the register
@@ -87,8 +222,9 @@ class Register:
         return self.busy
 
 class Reservation:
-    def __init__(self, name):
+    def __init__(self, name, config=None):
         self.name = name
+        self.config = config if config is not None else Config()
         self.op = "" 
         self.time = 9999 # remaining time to complete the operation
         self.busy = False
@@ -97,6 +233,8 @@ class Reservation:
         self.src1 = "" # value of the source register 1
         self.src2 = "" # value of the source register 2
         self.instruction = -1 # index of the instruction, so that we can set the time for it
+        self.index = -1 # position in its StationPool
+        self.rob = None # ReorderEntry of the instruction, None without a reorder buffer
 
     def isAvaible(self):
         return self.busy == False
@@ -123,6 +261,10 @@ class Reservation:
             self.fn2 = ""
  
 
+    # cycles from the arrival of the last operand to the result
+    def latency(self):
+        return self.config.getExecuteTime(self.op)
+
     def free(self):
         self.op = ""
         self.time = 9999
@@ -132,9 +274,11 @@ class Reservation:
         self.fn1 = ""
         self.fn2 = ""
         self.instruction = -1
+        self.rob = None
 
     def execute(self):
-        if self.busy == True:
+        # a finished result that lost the common data bus stays at 0 until it wins it
+        if self.busy == True and self.time > 0:
             self.time -= 1
             # if(self.time == 0):
             #     self.free()
@@ -161,14 +305,14 @@ class Reservation:
 
 
 class ReservationADD(Reservation):
-    def __init__(self, name):
-        super().__init__(name)
+    def __init__(self, name, config=None):
+        super().__init__(name, config)
         self.type = "ADD"
 
     def occupy(self, op, fn1, fn2, src1, src2, instruction):
         super().occupy(op, fn1, fn2, src1, src2, instruction)
         if(fn1 == "" and fn2 == ""):
-            self.time = cycle_add
+            self.time = self.config.getExecuteTime(op)
 
     def write(self, fn, value):
         super().write(fn, value)
@@ -191,21 +335,23 @@ class ReservationADD(Reservation):
     def write(self, fn, value):
         super().write(fn, value)
 
-    def getResult(self):
+    # results are interned in exprs and rendered only when a trace needs the text
+    def getResult(self, exprs):
         if(self.op == "ADDD"):
-            return self.src1 + " + " + self.src2
+            return exprs.node("+", self.src1, self.src2)
         else:
-            return self.src1 + " - " + self.src2
+            return exprs.node("-", self.src1, self.src2)
 
 class ReservationMUL(Reservation):
-    def __init__(self, name):
-        super().__init__(name)
+    def __init__(self, name, config=None):
+        super().__init__(name, config)
         self.type = "MUL"
 
     def occupy(self, op, fn1, fn2, src1, src2, instruction):
         super().occupy(op, fn1, fn2, src1, src2, instruction)
         if(fn1 == "" and fn2 == ""):
-            self.time = cycle_mul
+            # DIVD must not start with the MULTD latency
+            self.time = self.config.getExecuteTime(op)
 
     def write(self, fn, value):
         super().write(fn, value)
@@ -233,19 +379,12 @@ class ReservationMUL(Reservation):
     def write(self, fn, value):
         super().write(fn, value)
 
-    def getResult(self):
-        if(self.src1.find("/") != -1):
-            src1 = "(" + self.src1 + ")"
-        else:
-            src1 = self.src1
-        if(self.src2.find("/") != -1):
-            src2 = "(" + self.src2 + ")"
-        else:
-            src2 = self.src2
+    # an operand holding a "/" is put in parentheses when the result is rendered
+    def getResult(self, exprs):
         if(self.op == "MULTD"):
-            return src1 + " * " + src2
+            return exprs.node("*", self.src1, self.src2)
         else:
-            return src1 + " / " + src2
+            return exprs.node("/", self.src1, self.src2)
 
 
 class LoadBuffer(Reservation):
@@ -255,16 +394,39 @@ class LoadBuffer(Reservation):
 # 每次load更新寄存器值，和reservation都是直接覆盖寄存器fn；
 # 不同在于load直接计时，不用等待源寄存器
 # load buffer to a register    
-    def __init__(self, name):
-        super().__init__(name)
+# with memory ordering a load can wait for an older store: fn1 is then the tag of the
+# data the store waits for (forwarding), or store is the store that has to write
+# memory first
+    def __init__(self, name, config=None):
+        super().__init__(name, config)
         self.type = "LOAD"
+        self.address = None # (base register, offset)
+        self.store = None # older store to the same address it waits for
+        self.forwarded = False # whether the result comes from a store, not memory
+        self.data = "" # the forwarded value
+        self.cycles = 0 # latency of the memory access, cycle_load without a cache
 
-    def occupy(self, src1, instruction):
+    def occupy(self, src1, instruction, cycles=None):
         super().occupy("LD", "", "", src1, "", instruction)
-        self.time = cycle_load
+        self.cycles = self.config.cycle_load if cycles is None else cycles
+        self.time = self.cycles
+
+    # take the data of an older store: its value, or the tag it waits for
+    def forward(self, fn, value):
+        self.forwarded = True
+        self.fn1 = fn
+        self.data = value
+        self.time = self.config.cycle_forward if fn == "" else 9999
 
-    def getResult(self, index):
-        return "M(A" + str(index + 1) + ")"
+    def latency(self):
+        if self.forwarded:
+            return self.config.cycle_forward
+        return self.cycles
+
+    def getResult(self, index, exprs):
+        if self.forwarded:
+            return self.data
+        return exprs.leaf("M(A" + str(index + 1) + ")")
 
 
     def execute(self):
@@ -275,6 +437,10 @@ class LoadBuffer(Reservation):
 
     def free(self):
         super().free()
+        self.address = None
+        self.store = None
+        self.forwarded = False
+        self.data = ""
 
     def isAvaible(self):
         return super().isAvaible()
@@ -282,8 +448,11 @@ class LoadBuffer(Reservation):
     def isBusy(self):
         return super().isBusy()
         
+    # src1 keeps the address, the forwarded value goes to data
     def write(self, fn, value):
-        super().write(fn, value)
+        if self.fn1 == fn:
+            self.data = value
+            self.fn1 = ""
 
 
 class StoreBuffer(Reservation):
@@ -294,21 +463,29 @@ class StoreBuffer(Reservation):
 # add dest to store the memory address
 # 每次store获取源寄存器值时，和reservation都是从寄存器fn中获取（或者直接读取）；
 # 不同在于store没有目标寄存器，直接写入内存（在寄存器fn不会出现store）
-    def __init__(self, name):
-        super().__init__(name)
+    def __init__(self, name, config=None):
+        super().__init__(name, config)
         self.type = "STORE"
         self.dest = ""
+        self.address = None # (base register, offset)
+        self.cycles = 0
 
-    def occupy(self, src, fn, dest, instruction):
+    def occupy(self, src, fn, dest, instruction, cycles=None):
         self.dest = dest
         super().occupy("SD", fn, "", src, "", instruction)
+        # latency of the memory access, cycle_store without a cache
+        self.cycles = self.config.cycle_store if cycles is None else cycles
         if fn == "":
-            self.time = cycle_store
+            self.time = self.cycles
+
+    def latency(self):
+        return self.cycles
 
     def execute(self):
         super().execute()
         # store did not check in writeback statge, so we check here to free
-        if(self.busy and self.time == 0):
+        # with a reorder buffer the store waits for its commit instead
+        if(self.busy and self.time == 0 and self.rob is None):
             self.free()
     
     def isEnd(self):
@@ -333,410 +510,1101 @@ class StoreBuffer(Reservation):
         super().write(fn, value)
 
 
+# the phases of a cycle, in the order step() runs them; commit does nothing
+# without a reorder buffer
+PHASES = ("commit", "write_back", "execute", "issue", "print_state")
+
+
+class Hook:
+    # base of the objects given to Simulator.addHook(); every method is optional
+    # to override. A simulator without hooks does not call anything
+    def before(self, simulator, phase):
+        pass
+
+    # result is what the phase returned: issue() how many instructions issued,
+    # write_back() how many results went on the common data bus, commit() how many
+    # instructions left the reorder buffer
+    def after(self, simulator, phase, result):
+        pass
+
+    def endCycle(self, simulator):
+        pass
+
+    # the event engine jumped over cycles in which only the countdowns changed
+    def skipped(self, simulator, cycles):
+        pass
+
+
+class StationPool:
+    # the stations of one unit type with a heap of free indices and a set of busy
+    # ones, so that allocation, execution and the drain check only touch occupied
+    # stations; the lowest free station is still taken first, as the old scan did
+    def __init__(self, stations):
+        self.stations = stations
+        for i in range(len(stations)):
+            stations[i].index = i
+        self.free = list(range(len(stations))) # already a heap
+        self.busy = set()
+        self.busyCycles = 0 # sum over the cycles of the busy stations, for utilization
+        self.units = None # UnitPool shared by the stations, see Simulator.reset()
+
+    def allocate(self):
+        if not self.free:
+            return None
+        i = heapq.heappop(self.free)
+        self.busy.add(i)
+        return self.stations[i]
+
+    def release(self, station):
+        self.busy.discard(station.index)
+        heapq.heappush(self.free, station.index)
+
+    def hasFree(self):
+        return len(self.free) > 0
+
+    def isIdle(self):
+        return len(self.busy) == 0
+
+    def busyStations(self):
+        # in station order, loads name their results M(A<n>) in that order
+        return [self.stations[i] for i in sorted(self.busy)]
+
+
+class UnitPool:
+    # functional units shared by the stations of one pool. A station whose operands
+    # are all there waits in a ready queue with time -1; every cycle the free units
+    # take the oldest ready stations, which count down from there. A unit accepts a
+    # new operation getInterval(op) cycles after the last one it started
+    def __init__(self, count, config):
+        self.count = count
+        self.config = config
+        self.units = [(0, i) for i in range(count)] # heap of (cycle it accepts again, unit)
+        self.ready = [] # heap of (instruction, station index, station)
+        self.arriving = [] # (cycle, station) not queued yet, a station starts the cycle after it became ready
+        self.started = [] # stations started by the last dispatch()
+        self.busyCycles = 0 # sum of the operations started times their interval, for utilization
+
+    def push(self, station, cycle):
+        station.time = -1
+        self.arriving.append((cycle, station))
+
+    def hasReady(self):
+        return len(self.ready) > 0 or len(self.arriving) > 0
+
+    def dispatch(self, cycle):
+        # called by execute(), before the countdown of the cycle
+        if self.arriving:
+            arriving = []
+            for ready, station in self.arriving:
+                if ready < cycle:
+                    heapq.heappush(self.ready, (station.instruction, station.index, station))
+                else:
+                    arriving.append((ready, station))
+            self.arriving = arriving
+        self.started = []
+        while self.ready and self.units[0][0] <= cycle:
+            station = heapq.heappop(self.ready)[2]
+            interval = self.config.getInterval(station.op)
+            heapq.heapreplace(self.units, (cycle + interval, self.units[0][1]))
+            self.busyCycles += interval
+            self.started.append(station)
+        return self.started
+
+
+class ReorderEntry:
+    def __init__(self, name):
+        self.name = name # tag of the result, ROB<n>
+        self.busy = False
+        self.instruction = -1 # index of the instruction
+        self.dest = -1 # register the result is committed to, -1 for a store
+        self.store = None # store buffer that is released at commit
+        self.value = None # the result, once it has been on the common data bus
+        self.done = False # whether the entry can commit
+
+
+class ReorderBuffer:
+    # a circular queue of entries in program order. The entries name the results in
+    # place of the stations: registers and waiting stations hold ROB<n> tags, and a
+    # station is free again as soon as its result is on the common data bus
+    def __init__(self, size):
+        self.entries = [ReorderEntry("ROB" + str(i + 1)) for i in range(size)]
+        self.named = {entry.name: entry for entry in self.entries}
+        self.head = 0 # oldest entry
+        self.count = 0
+
+    def isFull(self):
+        return self.count == len(self.entries)
+
+    def isEmpty(self):
+        return self.count == 0
+
+    def allocate(self, instruction, dest, store=None):
+        entry = self.entries[(self.head + self.count) % len(self.entries)]
+        entry.busy = True
+        entry.instruction = instruction
+        entry.dest = dest
+        entry.store = store
+        entry.value = None
+        entry.done = False
+        self.count += 1
+        return entry
+
+    def first(self):
+        if self.count == 0:
+            return None
+        return self.entries[self.head]
+
+    def pop(self):
+        entry = self.entries[self.head]
+        entry.busy = False
+        self.head = (self.head + 1) % len(self.entries)
+        self.count -= 1
+        return entry
+
+
+def as_tuple(instruction):
+    if isinstance(instruction, Instruction):
+        return (instruction.op, instruction.dest, instruction.src1, instruction.src2)
+    return tuple(instruction)
+
+
+class ProgramFetch:
+    # the whole program is in memory, every instruction is kept for the final table
+    def __init__(self, program):
+        self.instructions = [Instruction(op, dest, src1, src2) for op, dest, src1, src2 in program]
+        self.count = len(self.instructions)
+
+    def get(self, pc):
+        if(pc < len(self.instructions)):
+            return self.instructions[pc]
+        return None
 
-Instructions = []
-Registers = []
-ReservationADDs = []
-ReservationMULs = []
-LoadBuffers = []
-StoreBuffers = []
-cycle = 0 # cycle number of the simulation
-pc = 0 # program counter
-memory_index = 0 # load result index,only use in loadBuffer.getResult
-
-def init():
-    global Instructions, Registers, ReservationADDs, ReservationMULs, LoadBuffers, StoreBuffers, cycle, pc, memory_index
-
-    Instructions.clear()
-    Registers.clear()
-    ReservationADDs.clear()
-    ReservationMULs.clear()
-    LoadBuffers.clear()
-    StoreBuffers.clear()
-
-    cycle = 0
-    pc = 0
-    memory_index = 0
-
-    file = open(INPUT_FILE, "r")
-    data = file.readlines()
-    file.close()
-    for i in data:
-        op, dest, src1, src2 = i.split()
-        Instructions.append(Instruction(op, dest, src1, src2))
-
-    for i in range(32):
-        Registers.append(Register("F" + str(i)))
-    
-    for i in range(num_add):
-        ReservationADDs.append(ReservationADD("Add" + str(i + 1)))
-    
-    for i in range(num_mul):
-        ReservationMULs.append(ReservationMUL("Mult" + str(i + 1)))
-
-    for i in range(num_load):
-        LoadBuffers.append(LoadBuffer("Load" + str(i + 1)))
-    
-    for i in range(num_store):
-        StoreBuffers.append(StoreBuffer("Store" + str(i + 1)))
-
-
-def print_state():
-    # print the state of the simulation
-    state_str = "Cycle_" + str(cycle) + "\n"
+    def instruction(self, index):
+        return self.instructions[index]
+
+    def retire(self, index):
+        pass
+
+
+class StreamFetch:
+    # instructions are pulled from an iterator when pc reaches them; the window only
+    # holds the fetched instructions that have not been handed to on_retire yet
+    def __init__(self, source, on_retire=None):
+        self.source = iter(source)
+        self.on_retire = on_retire
+        self.window = {} # index -> Instruction
+        self.finished = set() # indices in the window that have retired
+        self.fetched = 0 # index of the next instruction to read from source
+        self.oldest = 0 # index of the oldest instruction in the window
+        self.count = 0 # instructions retired so far
+
+    def get(self, pc):
+        if pc in self.window:
+            return self.window[pc]
+        if pc != self.fetched:
+            return None
+        for i in self.source:
+            op, dest, src1, src2 = as_tuple(i)
+            instruction = Instruction(op, dest, src1, src2)
+            self.window[pc] = instruction
+            self.fetched += 1
+            return instruction
+        return None
 
-    for i in range(len(LoadBuffers)):
-        if(LoadBuffers[i].busy):
-            state_str += "Load" + str(i + 1) + ": Yes, " + LoadBuffers[i].src1 + ";" + "\n"
+    def instruction(self, index):
+        return self.window[index]
+
+    # a snapshot keeps the window, the source and on_retire are given back on restore
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["source"] = None
+        state["on_retire"] = None
+        return state
+
+    def resume(self, source, on_retire=None):
+        # continue reading source after the instructions fetched before the snapshot
+        self.source = itertools.islice(iter(source), self.fetched, None)
+        self.on_retire = on_retire
+
+    def retire(self, index):
+        # results are handed over in program order, so a finished instruction waits
+        # for the older ones
+        self.finished.add(index)
+        while self.oldest in self.finished:
+            self.finished.discard(self.oldest)
+            instruction = self.window.pop(self.oldest)
+            if self.on_retire is not None:
+                self.on_retire(self.oldest, instruction)
+            self.oldest += 1
+            self.count += 1
+
+
+def read_program(path):
+    # read a trace file lazily, one (op, dest, src1, src2) per line; a malformed line
+    # raises DecodeError with its number. A distinct line is parsed once, so that a
+    # long trace costs a dict lookup per line, and a REPEAT block is expanded as pc
+    # reaches its iterations, see decode.py
+    with open(path, "r") as file:
+        yield from expand_lines(enumerate(file, 1))
+
+
+def load_program(path):
+    # read a whole trace file with the bulk decoder of decode.py: a DecodedProgram,
+    # or a LoopProgram when it has REPEAT blocks. Both read like a list of
+    # (op, dest, src1, src2), and equal instructions share one tuple
+    import decode
+    return decode.load(path)
+
+
+class Simulator:
+    # one self-contained run of the algorithm: it owns its config, its program and
+    # all of the machine state, so any number of them can live in one process
+    # engine "cycle" steps every cycle, "event" jumps over cycles in which the
+    # stations only count down; both give the same result
+    # the trace goes to sink, output_file and echo are a shortcut for a full TraceSink
+    # with stream=True the program is only iterated as pc advances, and the retired
+    # instructions go in program order to on_retire(index, instruction) and are dropped;
+    # symbolic=False keeps no register values, so that memory stays bounded too
+    def __init__(self, program, config=None, output_file=None, echo=False, engine="cycle", sink=None,
+                 stream=False, on_retire=None, symbolic=True, hooks=None):
+        if engine not in ("cycle", "event"):
+            raise ValueError("unknown engine: " + engine)
+        self.config = config if config is not None else Config()
+        self.engine = engine
+        self.stream = stream
+        self.on_retire = on_retire
+        self.symbolic = symbolic
+        if stream:
+            self.program = program
         else:
-            state_str += "Load" + str(i + 1) + ": No" + ";" + "\n"
-        
-
-    for i in range(len(StoreBuffers)):
-        if(StoreBuffers[i].busy):
-            state_str += "Store" + str(i + 1) + ": Yes, " + StoreBuffers[i].dest
-            if(StoreBuffers[i].fn1):
-                state_str +=  ", " + StoreBuffers[i].fn1 + ";" + "\n"
+            # program is a list of (op, dest, src1, src2) or of Instruction
+            self.program = [as_tuple(i) for i in program]
+        if sink is None and (output_file or echo):
+            sink = TraceSink(output_file, TRACE_FULL, echo=echo)
+        self.sink = sink
+        self.hooks = list(hooks) if hooks else [] # see Hook, they survive reset()
+        self.reset()
+
+    @classmethod
+    def fromFile(cls, path, config=None, output_file=None, echo=False, engine="cycle", sink=None, **options):
+        if options.get("stream"):
+            program = read_program(path)
+        else:
+            program = load_program(path)
+        return cls(program, config, output_file, echo, engine, sink, **options)
+
+    def reset(self):
+        config = self.config
+        if self.stream:
+            self.fetch = StreamFetch(self.program, self.on_retire)
+            self.instructions = []
+        else:
+            self.fetch = ProgramFetch(self.program)
+            self.instructions = self.fetch.instructions
+        self.exprs = ExprTable() # symbolic values of this run
+        self.unknown = self.exprs.leaf("?") # the value of every result when symbolic is off
+        self.registers = [Register("F" + str(i)) for i in range(32)]
+        for register in self.registers:
+            register.value = self.exprs.leaf(register.value)
+        self.reservationADDs = [ReservationADD("Add" + str(i + 1), config) for i in range(config.num_add)]
+        self.reservationMULs = [ReservationMUL("Mult" + str(i + 1), config) for i in range(config.num_mul)]
+        self.loadBuffers = [LoadBuffer("Load" + str(i + 1), config) for i in range(config.num_load)]
+        self.storeBuffers = [StoreBuffer("Store" + str(i + 1), config) for i in range(config.num_store)]
+        self.addPool = StationPool(self.reservationADDs)
+        self.mulPool = StationPool(self.reservationMULs)
+        self.loadPool = StationPool(self.loadBuffers)
+        self.storePool = StationPool(self.storeBuffers)
+        self.pools = (self.addPool, self.mulPool, self.loadPool, self.storePool)
+        # the functional units of a pool, None when each station executes on its own
+        self.addPool.units = UnitPool(config.num_add_units, config) if config.num_add_units else None
+        self.mulPool.units = UnitPool(config.num_mul_units, config) if config.num_mul_units else None
+        self.rob = ReorderBuffer(config.rob_size) if config.rob_size else None
+        self.cache = None
+        if config.cache_size:
+            self.cache = Cache(config.cache_size, config.cache_ways, config.cache_line,
+                               config.cycle_hit, config.cycle_miss, config.cache_mshrs)
+        self.cycle = 0 # cycle number of the simulation
+        self.pc = 0 # program counter
+        self.memory_index = 0 # load result index,only use in loadBuffer.getResult
+        self.waiting = {} # tag -> stations waiting for its result
+        self.registerOf = {} # tag -> index of the register it will write
+        self.storesAt = {} # address -> stores in flight to it, oldest first, with memory ordering
+        self.blocked = {} # store name -> loads waiting for it to write memory
+        self.conflicts = 0 # loads that found an older store to their address
+        self.forwards = 0 # loads that took the data of a store
+        self.started = False # whether the state of cycle 0 has been printed
+        self.steps = 0 # cycles that were actually simulated, skipped ones excluded
+
+    # a snapshot holds the machine only: sinks, hooks and the source of a streamed
+    # program stay with the process that took it
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["sink"] = None
+        state["hooks"] = []
+        state["on_retire"] = None
+        if self.stream:
+            state["program"] = None
+        return state
+
+    def snapshot(self):
+        # the state as bytes, see snapshot.py
+        import snapshot
+        return snapshot.dumps(self)
+
+    def save(self, path):
+        import snapshot
+        snapshot.save(self, path)
+
+    @classmethod
+    def restore(cls, source, program=None, sink=None, hooks=None, on_retire=None):
+        # a simulator from a snapshot, source is its bytes or the path of its file;
+        # a streamed program needs its source again, it is read on from where it was
+        import snapshot
+        if isinstance(source, (bytes, bytearray)):
+            simulator = snapshot.loads(source)
+        else:
+            simulator = snapshot.load(source)
+        if simulator.stream:
+            if program is None:
+                raise ValueError("a streamed simulation needs its program to resume")
+            simulator.program = program
+            simulator.fetch.resume(program, on_retire)
+        simulator.sink = sink
+        simulator.hooks = list(hooks) if hooks else []
+        simulator.on_retire = on_retire
+        return simulator
+
+    def fork(self, program=None, sink=None, hooks=None, **changes):
+        # an independent copy of the current state that continues with other
+        # latencies (FORK_FIELDS); the operations in flight keep their remaining time
+        for name in changes:
+            if name not in FORK_FIELDS:
+                raise ValueError("a fork cannot change " + name)
+        clone = Simulator.restore(self.snapshot(), program, sink, hooks)
+        # the stations, the units and the clone share its config
+        for name, value in changes.items():
+            setattr(clone.config, name, value)
+        if clone.cache is not None:
+            clone.cache.hit = clone.config.cycle_hit
+            clone.cache.miss = clone.config.cycle_miss
+        return clone
+
+    def stateRows(self):
+        # the station lines and the register fields shown for the current cycle
+        state = CycleState(self)
+        return list(state.stationRows), list(state.registerRows)
+
+    def print_state(self):
+        # hand the state of the simulation to the trace sink, if it wants this cycle;
+        # the text trace is one more reader of the states simulate() gives out
+        if self.sink is not None and self.sink.wantsCycle(self.cycle):
+            state = CycleState(self)
+            self.sink.writeState(self.cycle, state.stationRows, state.registerRows)
+
+    def wait(self, fu1, fu2, station):
+        # index the station under the tags it waits for, so write_back finds it directly
+        if(fu1 != ""):
+            self.waiting.setdefault(fu1, []).append(station)
+        if(fu2 != "" and fu2 != fu1):
+            self.waiting.setdefault(fu2, []).append(station)
+
+    def issue(self):
+        # in order, up to issue_width instructions, until one of them has no station
+        issued = 0
+        while issued < self.config.issue_width and self.issueNext():
+            issued += 1
+        return issued
+
+    def source(self, index):
+        # (tag, value) of a source register: the tag of its producer while it is busy,
+        # unless the reorder buffer already holds the result
+        register = self.registers[index]
+        if(register.isBusy()):
+            if(self.rob is not None):
+                entry = self.rob.named[register.fu]
+                if(entry.done):
+                    return "", entry.value
+            return register.fu, ""
+        return "", register.value
+
+    def result(self, station, dest, store=None):
+        # the tag the result of a newly issued station goes by
+        if(self.rob is None):
+            return station.name
+        station.rob = self.rob.allocate(station.instruction, dest, store)
+        return station.rob.name
+
+    def issueNext(self):
+        instruction = self.fetch.get(self.pc)
+        registers = self.registers
+        pc = self.pc
+        cycle = self.cycle
+        config = self.config
+
+        if(instruction is not None):
+            if(self.rob is not None and self.rob.isFull()):
+                # wait for the oldest instruction to commit
+                return False
+            # judge the operation type and set the time
+            op = instruction.op
+            code = instruction.code
+            if(code <= Op.DIVD):
+                # find avaible reservation station
+                pool = self.addPool if code <= Op.SUBD else self.mulPool
+                station = pool.allocate()
+                if(station is None):
+                    # wait for next cycle
+                    return False
+
+                # the source registers that are not ready give a tag to wait for
+                fu1, src1 = self.source(instruction.rs1)
+                fu2, src2 = self.source(instruction.rs2)
+                # issue in instrucction
+                instruction.issue(cycle)
+                # with shared units the write time is only known once dispatch() starts it
+                if(fu1 == "" and fu2 == "" and pool.units is None):
+                    instruction.setWriteTime(cycle + config.latency(code) + config.cycle_writeback)
+                # issue in reservation station
+                station.occupy(op, fu1, fu2, src1, src2, pc)
+                self.wait(fu1, fu2, station)
+                if(fu1 == "" and fu2 == "" and pool.units is not None):
+                    # ready, but it still has to wait for a functional unit
+                    pool.units.push(station, cycle)
+                # issue in register
+                dest = instruction.rd
+                tag = self.result(station, dest)
+                registers[dest].occupy(tag)
+                self.registerOf[tag] = dest
+
+            elif(code == Op.LD):
+                # find avaible load buffer
+                station = self.loadPool.allocate()
+                if(station is None):
+                    # wait for next cycle
+                    return False
+
+                if(instruction.src1 == "0"):
+                    scr1 = instruction.src2
+                else:
+                    scr1 = instruction.src1 + instruction.src2
+                dest = instruction.rd
+                address, cycles = self.access(instruction)
+                # issue in instruction
+                instruction.issue(cycle)
+                instruction.setWriteTime(cycle + cycles + config.cycle_writeback)
+                # issue in load buffer
+                station.occupy(scr1, pc, cycles)
+                station.address = address
+                if(config.ordersMemory()):
+                    self.order(station, instruction)
+                # issue in register
+                tag = self.result(station, dest)
+                registers[dest].occupy(tag)
+                self.registerOf[tag] = dest
+
+            elif(code == Op.SD):
+                # stor也需要像保留站一样考虑源寄存器是否空闲才设定写回时间
+                # find avaible store buffer
+                station = self.storePool.allocate()
+                if(station is None):
+                    # wait for next cycle
+                    return False
+
+                if(instruction.src1 == "0"):
+                    dest = instruction.src2
+                else:
+                    dest = instruction.src1 + instruction.src2
+                fu1, src1 = self.source(instruction.rs1)
+                address, cycles = self.access(instruction)
+
+                # issue in instruction
+                instruction.issue(cycle)
+                if(fu1 == ""):
+                    instruction.setWriteTime(cycle + cycles + config.cycle_writeback)
+                # issue in store buffer
+                station.occupy(src1, fu1, dest, pc, cycles)
+                station.address = address
+                self.wait(fu1, "", station)
+                if(config.ordersMemory()):
+                    self.storesAt.setdefault(station.address, []).append(station)
+                # STORE does not need to occupy a register, but it holds a reorder
+                # buffer entry so that it writes memory at commit
+                self.result(station, -1, station)
+            self.pc += 1
+            return True
+        return False
+
+    def access(self, instruction):
+        # address and latency of a LD/SD; the cache is looked up when the instruction
+        # issues, in program order; the address was decoded with the instruction
+        config = self.config
+        if self.cache is None:
+            return instruction.address, config.latency(instruction.code)
+        return instruction.address, self.cache.access(address_of(instruction.address), self.cycle)
+
+    def order(self, load, instruction):
+        # check a new load against the stores in flight, which are all older as the
+        # instructions issue in order; only the youngest store to its address matters
+        stores = self.storesAt.get(load.address)
+        if not stores:
+            return
+        store = stores[-1]
+        config = self.config
+        self.conflicts += 1
+        if config.forward:
+            self.forwards += 1
+            load.forward(store.fn1, store.src1)
+            if store.fn1 == "":
+                instruction.setWriteTime(self.cycle + config.cycle_forward + config.cycle_writeback)
             else:
-                state_str +=  ", " + StoreBuffers[i].src1 + ";" + "\n"
+                # the data comes from the common data bus, with the store's own copy
+                instruction.setWriteTime(-1)
+                self.wait(store.fn1, "", load)
         else:
-            state_str += "Store" + str(i + 1) + ": No"+ ";"+ "\n"
-
-    for i in range(len(ReservationADDs)):
-        if(ReservationADDs[i].busy):
-            state_str += "Add" + str(i + 1) + ": Yes, " + ReservationADDs[i].op 
-            if(ReservationADDs[i].fn1):
-                state_str +=  ", " + ReservationADDs[i].fn1
+            load.store = store
+            load.time = 9999
+            instruction.setWriteTime(-1)
+            self.blocked.setdefault(store.name, []).append(load)
+
+    def storeDone(self, store, wait):
+        # a store has written memory: it leaves the address index, and the loads that
+        # waited for it start counting down their latency plus wait
+        stores = self.storesAt[store.address]
+        stores.remove(store)
+        if not stores:
+            del self.storesAt[store.address]
+        config = self.config
+        for load in self.blocked.pop(store.name, ()):
+            load.store = None
+            load.time = load.latency() + wait
+            self.fetch.instruction(load.instruction).setWriteTime(self.cycle + load.latency() + config.cycle_writeback)
+
+    def write_back(self):
+        # pick the finished update(time = 0 and is busy) in reservation and laod
+        # update the register
+        # update the reservation and store(if they use the updated data as source)
+        # add instruction with writeTime
+        cycle = self.cycle
+        config = self.config
+
+        # pick the update info
+        finished = []
+        for pool in (self.addPool, self.mulPool, self.loadPool):
+            for station in pool.busyStations():
+                if(station.isEnd()):
+                    finished.append((pool, station))
+        if(config.num_cdb and len(finished) > config.num_cdb):
+            # the oldest instructions get the buses, the others try again next cycle
+            # and their write back moves one cycle later
+            won = set(heapq.nsmallest(config.num_cdb, range(len(finished)), key=lambda i: finished[i][1].instruction))
+            lost = [finished[i] for i in range(len(finished)) if i not in won]
+            finished = [finished[i] for i in range(len(finished)) if i in won]
+            for pool, station in lost:
+                instruction = self.fetch.instruction(station.instruction)
+                instruction.setWriteTime(instruction.writeTime + 1)
+
+        update = []
+        for pool, station in finished:
+            if pool is self.loadPool:
+                if self.symbolic:
+                    update.append([station.name, station.getResult(self.memory_index, self.exprs)])
+                else:
+                    update.append([station.name, self.unknown])
+                # a forwarded load took the data of a store, it did not read memory
+                if not station.forwarded:
+                    self.memory_index += 1
+            elif self.symbolic:
+                update.append([station.name, station.getResult(self.exprs)])
             else:
-                state_str +=  ", " + ReservationADDs[i].src1
-            if(ReservationADDs[i].fn2):
-                state_str +=  ", " + ReservationADDs[i].fn2
+                update.append([station.name, self.unknown])
+            if station.rob is not None:
+                # the result waits in the reorder buffer for its commit
+                update[-1][0] = station.rob.name
+                station.rob.value = update[-1][1]
+                station.rob.done = True
             else:
-                state_str +=  ", " + ReservationADDs[i].src2
-            state_str += ";" + "\n"
-
-        else:
-            state_str += "Add" + str(i + 1) + ": No" + ";\n"
+                self.fetch.retire(station.instruction)
+            station.free()
+            pool.release(station)
+
+        # broadcast on the common data bus: only the register and the stations
+        # that were waiting for the tag when they issued are touched, with a
+        # reorder buffer the register is written at commit
+        for name, value in update:
+            dest = self.registerOf.pop(name, None)
+            if(dest is not None and self.rob is None and self.registers[dest].fu == name):
+                self.registers[dest].value = value
+                self.registers[dest].free()
+
+        for name, value in update:
+            for station in self.waiting.pop(name, ()):
+                if (station.isBusy() and (station.fn1 != "" or station.fn2 != "")):
+                    station.write(name, value)
+                    if(station.fn1 == "" and station.fn2 == ""):
+                        latency = station.latency()
+                        station.time = latency + config.cycle_writeback
+                        units = self.poolFor(station.op).units
+                        if(units is not None):
+                            # execute() sets the write time when a unit starts it
+                            units.push(station, cycle)
+                        else:
+                            # update the instruction
+                            self.fetch.instruction(station.instruction).setWriteTime(cycle + latency +  config.cycle_writeback)
+        return len(update)
 
-    for i in range(len(ReservationMULs)):
-        if(ReservationMULs[i].busy):
-            state_str += "Mult" + str(i + 1) + ": Yes, " + ReservationMULs[i].op 
-            if(ReservationMULs[i].fn1):
-                state_str +=  ", " + ReservationMULs[i].fn1
-            else:
-                state_str +=  ", " + ReservationMULs[i].src1
-            if(ReservationMULs[i].fn2):
-                state_str +=  ", " + ReservationMULs[i].fn2
+    def execute(self):
+        cycle = self.cycle
+        config = self.config
+        for pool in self.pools:
+            pool.busyCycles += len(pool.busy)
+            if pool.units is not None:
+                # the stations that get a unit this cycle start counting down now
+                for station in pool.units.dispatch(cycle):
+                    op = station.op
+                    station.time = config.getExecuteTime(op)
+                    self.fetch.instruction(station.instruction).setWriteTime(cycle + config.getExecuteTime(op) - 1 + config.cycle_writeback)
+            for station in pool.busyStations():
+                index = station.instruction
+                station.execute()
+                # a store frees itself once its time is up, or waits for its commit
+                if not station.isBusy():
+                    self.fetch.retire(index)
+                    pool.release(station)
+                    if config.ordersMemory():
+                        # the load pool has counted down already in this cycle
+                        self.storeDone(station, 0)
+                elif station.rob is not None and station.type == "STORE" and station.isEnd():
+                    station.rob.done = True
+
+    def commit(self):
+        # the finished instructions at the head of the reorder buffer leave it in
+        # program order, at most commit_width of them: a result goes to its register
+        # unless a younger instruction took the register over, a store writes memory
+        # and frees its buffer
+        rob = self.rob
+        if rob is None:
+            return 0
+        committed = 0
+        while committed < self.config.commit_width and not rob.isEmpty() and rob.first().done:
+            entry = rob.pop()
+            if entry.store is not None:
+                entry.store.free()
+                self.storePool.release(entry.store)
+                if self.config.ordersMemory():
+                    self.storeDone(entry.store, self.config.cycle_writeback)
             else:
-                state_str +=  ", " + ReservationMULs[i].src2
-            state_str += ";\n"
-        else:
-            state_str += "Mult" + str(i + 1) + ": No" + ";\n"
+                register = self.registers[entry.dest]
+                if register.fu == entry.name:
+                    register.value = entry.value
+                    register.free()
+            self.fetch.instruction(entry.instruction).setCommitTime(self.cycle)
+            self.fetch.retire(entry.instruction)
+            committed += 1
+        return committed
+
+    def isAllFree(self):
+        for pool in self.pools:
+            if not pool.isIdle():
+                return False
+        return self.rob is None or self.rob.isEmpty()
 
-    for i in range(len(Registers)):
-        state_str += "F" + str(i) + ": "
-        if(Registers[i].fu):
-            state_str += Registers[i].fu + "; "
+    def poolFor(self, op):
+        if(op == "ADDD" or op == "SUBD"):
+            return self.addPool
+        elif(op == "MULTD" or op == "DIVD"):
+            return self.mulPool
+        elif(op == "LD"):
+            return self.loadPool
+        else:
+            return self.storePool
+
+    def nextEvent(self):
+        # number of coming cycles in which nothing but the countdowns can change:
+        # no station reaches time 0 (write back, or a store freeing itself), no
+        # station waits for a functional unit, nothing can commit, and the next
+        # instruction cannot issue because its stations or the reorder buffer are full
+        rob = self.rob
+        instruction = self.fetch.get(self.pc)
+        if(instruction is not None and self.poolFor(instruction.op).hasFree() and (rob is None or not rob.isFull())):
+            return 0
+        if(rob is not None and not rob.isEmpty() and rob.first().done):
+            return 0
+        for pool in self.pools:
+            if(pool.units is not None and pool.units.hasReady()):
+                # stations waiting for a unit are not counting down
+                return 0
+        skip = -1
+        for pool in self.pools:
+            for i in pool.busy:
+                station = pool.stations[i]
+                if(station.rob is not None and station.rob.done):
+                    # a finished store waiting for its commit
+                    continue
+                if(skip == -1 or station.time < skip):
+                    skip = station.time
+        return max(0, skip - 1)
+
+    def skip(self, cycles):
+        # jump over cycles returned by nextEvent(), the trace still gets a state
+        # for each of them
+        for hook in self.hooks:
+            hook.skipped(self, cycles)
+        for pool in self.pools:
+            pool.busyCycles += len(pool.busy) * cycles
+            for i in pool.busy:
+                if pool.stations[i].time > 0:
+                    pool.stations[i].time -= cycles
+        if self.sink is not None:
+            for i in range(cycles):
+                self.cycle += 1
+                if self.hooks:
+                    self.runPhase("print_state")
+                else:
+                    self.print_state()
         else:
-            if(Registers[i].value == "R(" + Registers[i].name + ")"):
-                state_str += " " + "; "
+            self.cycle += cycles
+
+    def isDone(self):
+        return self.isAllFree() and self.fetch.get(self.pc) is None
+
+    def start(self):
+        # the state before the first cycle is part of the trace
+        if not self.started:
+            self.started = True
+            self.print_state()
+
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    def runPhase(self, name):
+        # one phase with the hooks around it
+        for hook in self.hooks:
+            hook.before(self, name)
+        res = getattr(self, name)()
+        for hook in self.hooks:
+            hook.after(self, name, res)
+        return res
+
+    def step(self):
+        # simulate one cycle, return False once the program has finished
+        self.start()
+        if self.isDone():
+            return False
+        self.cycle += 1
+        self.steps += 1
+        if self.hooks:
+            for name in PHASES:
+                self.runPhase(name)
+            for hook in self.hooks:
+                hook.endCycle(self)
+        else:
+            self.commit()
+            self.write_back()
+            self.execute()
+            self.issue()
+            self.print_state()
+        return True
+
+    def advance(self, cycle):
+        # simulate up to the end of cycle, return False if the program finished first
+        self.start()
+        while self.cycle < cycle and not self.isDone():
+            if self.engine == "event":
+                cycles = min(self.nextEvent(), cycle - self.cycle - 1)
+                if cycles > 0:
+                    self.skip(cycles)
+            self.step()
+        return not self.isDone()
+
+    def simulate(self, every=1, where=None, stop=None):
+        # generator of the CycleState (state.py) of the current cycle and of every
+        # cycle after it, up to the end of the program or of cycle stop. Only the
+        # cycles that are a multiple of every, and for which where(cycle) is true
+        # when it is given, make a state; the others are simulated, skipped over by
+        # the event engine, and cost nothing more. every=0 makes no state at all
+        # the trace sink and the hooks see every cycle as in run(), and the final
+        # table is written once the program has finished
+        def wanted(cycle):
+            return every and cycle % every == 0 and (where is None or where(cycle))
+
+        def emit():
+            state = CycleState(self)
+            live = weakref.ref(state)
+            yield state
+            del state
+            # a state the caller kept must not see the next cycles
+            state = live()
+            if state is not None:
+                state.detach()
+
+        self.start()
+        if wanted(self.cycle):
+            yield from emit()
+        while not self.isDone() and (stop is None or self.cycle < stop):
+            if self.engine == "event":
+                cycles = self.nextEvent()
+                if stop is not None:
+                    cycles = min(cycles, stop - self.cycle - 1)
+                while cycles > 0:
+                    # jump to the next wanted cycle in the skipped range, or over all of it
+                    jump = cycles
+                    if every:
+                        for k in range(1, cycles + 1):
+                            if wanted(self.cycle + k):
+                                jump = k
+                                break
+                    self.skip(jump)
+                    cycles -= jump
+                    if wanted(self.cycle):
+                        yield from emit()
+            self.step()
+            if wanted(self.cycle):
+                yield from emit()
+        if self.isDone():
+            self.print_result()
+
+    def run(self):
+        for state in self.simulate(every=0):
+            pass
+        return self.summary()
+
+    def result_table(self):
+        # a streamed program has handed its rows to on_retire already
+        res = []
+        for i in range(len(self.instructions)):
+            res.append(self.instructions[i].toTableLine(i))
+        return "".join(res)
+
+    def print_result(self):
+        if self.sink is not None:
+            if self.sink.wantsFinal() and not self.stream:
+                self.sink.writeFinal(self.result_table())
+            self.sink.flush()
+        if self.on_retire is not None and hasattr(self.on_retire, "flush"):
+            self.on_retire.flush()
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+        if self.on_retire is not None and hasattr(self.on_retire, "close"):
+            self.on_retire.close()
+
+    def utilization(self):
+        # busy fraction of the stations of each unit type over the run, and of the
+        # shared functional units (add_units, mul_units), 0 without them; a unit is
+        # busy for the interval after it starts an operation
+        res = {}
+        for name, pool in (("add", self.addPool), ("mul", self.mulPool), ("load", self.loadPool), ("store", self.storePool)):
+            if(self.cycle == 0 or len(pool.stations) == 0):
+                res[name] = 0.0
             else:
-                state_str += str(Registers[i].value) + "; "
+                res[name] = pool.busyCycles / (self.cycle * len(pool.stations))
+        for name, pool in (("add_units", self.addPool), ("mul_units", self.mulPool)):
+            if(self.cycle == 0 or pool.units is None):
+                res[name] = 0.0
+            else:
+                # the interval of the last operations may reach past the end of the run
+                res[name] = min(1.0, pool.units.busyCycles / (self.cycle * pool.units.count))
+        return res
+
+    def summary(self):
+        # plain data only, so that it can travel back from a worker process
+        return {
+            "cycles": self.cycle,
+            "instructions": self.fetch.count,
+            "ipc": self.fetch.count / self.cycle if self.cycle else 0.0,
+            "utilization": self.utilization(),
+            "steps": self.steps,
+            "conflicts": self.conflicts,
+            "forwarded": self.forwards,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            # empty for a streamed program, its rows went to on_retire; a run with a
+            # reorder buffer adds the commit cycle
+            "timings": [(i.issueTime, i.writeTime - 1, i.writeTime) + ((i.commitTime,) if self.rob is not None else ())
+                        for i in self.instructions],
+        }
+
+
+_programs = {} # traces already read by this process, by path
+_digests = {} # digests of those traces for the result cache, by path
+
+def _run_job(job, engine="cycle", cache=None):
+    program, config = job
+    digest = None
+    if isinstance(program, str):
+        if program not in _programs:
+            _programs[program] = load_program(program)
+        if cache is not None and program not in _digests:
+            from resultcache import trace_digest
+            _digests[program] = trace_digest(_programs[program])
+        digest = _digests.get(program)
+        program = _programs[program]
+    if cache is not None:
+        return cache.run(program, config, engine=engine, digest=digest)
+    return Simulator(program, config, engine=engine).run()
+
+
+def run_many(jobs, workers=None, mode="process", chunksize=None, engine="cycle", cache=None):
+    # run independent (program, config) jobs in parallel and return their summaries
+    # in the same order; program may also be the path of a trace file
+    # processes use all cores, threads are cheaper to start but share the GIL
+    # with a resultcache.ResultCache as cache, the workers look every job up in it first
+    jobs = list(jobs)
+    run_job = partial(_run_job, engine=engine, cache=cache)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (workers * 4))
+    if mode == "process":
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(run_job, jobs, chunksize=chunksize))
+    elif mode == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(run_job, jobs))
+    elif mode == "serial":
+        return [run_job(job) for job in jobs]
+    else:
+        raise ValueError("unknown mode: " + mode)
 
-    state_str += "\n"
-    print(state_str)
-    file = open(OUTPUT_FILE, "a")
-    file.write(state_str)
-    file.write("\n")
-    file.close()
 
+# the module level state below mirrors the simulator driven by init()/tomasulo(),
+# it is kept for code that still reads the old globals
+Instructions = []
+Registers = []
+ReservationADDs = []
+ReservationMULs = []
+LoadBuffers = []
+StoreBuffers = []
+cycle = 0 # cycle number of the simulation
+pc = 0 # program counter
+memory_index = 0 # load result index,only use in loadBuffer.getResult
+_simulator = None
 
-def issue():
+def _sync():
     global Instructions, Registers, ReservationADDs, ReservationMULs, LoadBuffers, StoreBuffers, cycle, pc, memory_index
+    Instructions = _simulator.instructions
+    Registers = _simulator.registers
+    ReservationADDs = _simulator.reservationADDs
+    ReservationMULs = _simulator.reservationMULs
+    LoadBuffers = _simulator.loadBuffers
+    StoreBuffers = _simulator.storeBuffers
+    cycle = _simulator.cycle
+    pc = _simulator.pc
+    memory_index = _simulator.memory_index
 
-    if(pc < len(Instructions)):
-        # judge the operation type and set the time
-        op = Instructions[pc].op
-        if(op == "ADDD" or op == "SUBD"):
-            # find avaible reservation station
-            set = -1
-            for i in range(num_add):
-                if(ReservationADDs[i].isAvaible()):
-                    set = i
-                    break
-            if(set == -1):
-                # wait for next cycle
-                return False
-            
-            src1 = int(Instructions[pc].src1[1:])
-            if(Registers[src1].isBusy()):
-                # the source register is not ready
-                fu1 = Registers[src1].fu
-                src1 = ""
-            else:
-                fu1 = ""
-                src1 = Registers[src1].value
-            src2 = int(Instructions[pc].src2[1:])
-            if(Registers[src2].isBusy()):
-                # the source register is not ready
-                fu2 = Registers[src2].fu
-                src2 = ""
-            else:
-                fu2 = ""
-                src2 = Registers[src2].value
-            # issue in instrucction
-            Instructions[pc].issue(cycle)
-            if(fu1 == "" and fu2 == ""):
-                if(op == "ADDD"):
-                    Instructions[pc].setWriteTime(cycle + cycle_add + cycle_writeback)
-                else:
-                    Instructions[pc].setWriteTime(cycle + cycle_sub + cycle_writeback)
-            # issue in reservation station
-            ReservationADDs[set].occupy(op, fu1, fu2, src1, src2, pc)
-            # issue in register
-            dest = int(Instructions[pc].dest[1:])
-            Registers[dest].occupy(ReservationADDs[set].name)
+def init():
+    global _simulator
+    _simulator = Simulator.fromFile(INPUT_FILE, Config(), OUTPUT_FILE, echo=True)
+    _sync()
 
-        elif(op == "MULTD" or op == "DIVD"):
-            # find avaible reservation station
-            set = -1
-            for i in range(num_mul):
-                if(ReservationMULs[i].isAvaible()):
-                    set = i
-                    break
-            if(set == -1):
-                # wait for next cycle
-                return False
-            
-            src1 = int(Instructions[pc].src1[1:])
-            if(Registers[src1].isBusy()):
-                # the source register is not ready
-                fu1 = Registers[src1].fu
-                src1 = ""
-            else:
-                fu1 = ""
-                src1 = Registers[src1].value
-            src2 = int(Instructions[pc].src2[1:])
-            if(Registers[src2].isBusy()):
-                # the source register is not ready
-                fu2 = Registers[src2].fu
-                src2 = ""
-            else:
-                fu2 = ""
-                src2 = Registers[src2].value
-            # issue in instrucction
-            Instructions[pc].issue(cycle)
-            if(fu1 == "" and fu2 == ""):
-                if(op == "MULTD"):
-                    Instructions[pc].setWriteTime(cycle + cycle_mul + cycle_writeback)
-                else:
-                    Instructions[pc].setWriteTime(cycle + cycle_div + cycle_writeback)
-            # issue in reservation station
-            ReservationMULs[set].occupy(op, fu1, fu2, src1, src2, pc)
-            # issue in register
-            dest = int(Instructions[pc].dest[1:])
-            Registers[dest].occupy(ReservationMULs[set].name)
 
-        elif(op == "LD"):
-            # find avaible load buffer
-            set = -1
-            for i in range(num_load):
-                if(LoadBuffers[i].isAvaible()):
-                    set = i
-                    break
-            if(set == -1):
-                # wait for next cycle
-                return False
-            
-            if(Instructions[pc].src1 == "0"):
-                scr1 = Instructions[pc].src2
-            else:
-                scr1 = Instructions[pc].src1 + Instructions[pc].src2
-            dest = int(Instructions[pc].dest[1:])
-            # issue in instruction
-            Instructions[pc].issue(cycle)
-            Instructions[pc].setWriteTime(cycle + cycle_load + cycle_writeback)
-            # issue in load buffer
-            LoadBuffers[set].occupy(scr1, pc)
-            # issue in register
-            Registers[dest].occupy(LoadBuffers[set].name)
-
-        elif(op == "SD"):
-            # stor也需要像保留站一样考虑源寄存器是否空闲才设定写回时间
-            # find avaible store buffer
-            set = -1
-            for i in range(num_store):
-                if(StoreBuffers[i].isAvaible()):
-                    set = i
-                    break
-            if(set == -1):
-                # wait for next cycle
-                return False
-            
-            if(Instructions[pc].src1 == "0"):
-                dest = Instructions[pc].src2
-            else:
-                dest = Instructions[pc].src1 + Instructions[pc].src2
-            src1 = int(Instructions[pc].dest[1:])
-            if(Registers[src1].isBusy()):
-                # the source register is not ready
-                fu1 = Registers[src1].fu
-                src1 = ""
-            else:
-                fu1 = ""
-                src1 = Registers[src1].value
-            
-            # issue in instruction
-            Instructions[pc].issue(cycle)
-            if(fu1 == ""):
-                Instructions[pc].setWriteTime(cycle + cycle_store + cycle_writeback)
-            # issue in store buffer
-            StoreBuffers[set].occupy(src1, fu1, dest, pc)
-            # STORE does not need to occupy a register
-        pc += 1
+def print_state():
+    _simulator.print_state()
+
+
+def issue():
+    res = _simulator.issue()
+    _sync()
+    return res
 
 def write_back():
-    global Instructions, Registers, ReservationADDs, ReservationMULs, LoadBuffers, StoreBuffers, cycle, pc, memory_index
-    # pick the finished update(time = 0 and is busy) in reservation and laod
-    # update the register
-    # update the reservation and store(if they use the updated data as source)
-    # add instruction with writeTime
-
-    # pick the update info
-    update = []
-    for i in range(len(ReservationADDs)):
-        if(ReservationADDs[i].isEnd()):
-            res = []
-            res.append(ReservationADDs[i].name)
-            res.append(ReservationADDs[i].getResult())
-            update.append(res)
-            ReservationADDs[i].free()        
-    for i in range(len(ReservationMULs)):
-        if(ReservationMULs[i].isEnd()):
-            res = []
-            res.append(ReservationMULs[i].name)
-            res.append(ReservationMULs[i].getResult())
-            update.append(res)
-            ReservationMULs[i].free()
-    for i in range(len(LoadBuffers)):
-        if(LoadBuffers[i].isEnd()):
-            res = []
-            res.append(LoadBuffers[i].name)
-            res.append(LoadBuffers[i].getResult(memory_index))
-            memory_index += 1
-            update.append(res)
-            LoadBuffers[i].free()
-    
-    # update the register
-    for j in range(len(update)):
-        for i in range(len(Registers)):
-            if(Registers[i].fu == update[j][0]):
-                Registers[i].value = update[j][1]
-                Registers[i].free()
-
-    # update the reservation
-    for j in range(len(update)):
-        for i in range(len(ReservationADDs)):    
-            if (ReservationADDs[i].isBusy() and (ReservationADDs[i].fn1 != "" or ReservationADDs[i].fn2 != "")):
-                ReservationADDs[i].write(update[j][0], update[j][1])
-                if(ReservationADDs[i].fn1 == "" and ReservationADDs[i].fn2 == ""):
-                    ReservationADDs[i].time = getExecuteTime(ReservationADDs[i].op) + cycle_writeback
-                    # update the instruction
-                    # Instructions[ReservationADDs[i].instruction].setWriteTime(cycle + ReservationADDs[i].getExecuteTime() +  cycle_writeback)
-                    # 在类中引用全局变量行不通，因为类的实例化是在函数外部，而函数外部的变量在函数内部是不可见的
-                    Instructions[ReservationADDs[i].instruction].setWriteTime(cycle + getExecuteTime(ReservationADDs[i].op) +  cycle_writeback)
-    for i in range(len(ReservationMULs)):
-        for j in range(len(update)):
-            # if not(ReservationMULs[i].isAvailble()):
-            if (ReservationMULs[i].isBusy() and (ReservationMULs[i].fn1 != "" or ReservationMULs[i].fn2 != "")):
-                ReservationMULs[i].write(update[j][0], update[j][1])
-                if(ReservationMULs[i].fn1 == "" and ReservationMULs[i].fn2 == ""):
-                    ReservationMULs[i].time = getExecuteTime(ReservationMULs[i].op) + cycle_writeback
-                    # update the instruction
-                    Instructions[ReservationMULs[i].instruction].setWriteTime(cycle + getExecuteTime(ReservationMULs[i].op) +  cycle_writeback)
-
-    # update the store
-    for j in range(len(update)):
-        for i in range(len(StoreBuffers)):
-            # if not(StoreBuffers[i].isAvailble()):
-            if(StoreBuffers[i].isBusy() and StoreBuffers[i].fn1 != ""):
-                StoreBuffers[i].write(update[j][0], update[j][1])
-                if(StoreBuffers[i].fn1 == ""):
-                    StoreBuffers[i].time = getExecuteTime(StoreBuffers[i].op) + cycle_writeback
-                    # print("========================store time:", StoreBuffers[i].time)
-                    # print("========================store op:", StoreBuffers[i].op)
-                    # update the instruction
-                    Instructions[StoreBuffers[i].instruction].setWriteTime(cycle + getExecuteTime(StoreBuffers[i].op) +  cycle_writeback)
+    res = _simulator.write_back()
+    _sync()
+    return res
 
 
 def execute():
-    global Instructions, Registers, ReservationADDs, ReservationMULs, LoadBuffers, StoreBuffers, cycle, pc, memory_index
-    # execute in reservationADDs
-    for i in range(len(ReservationADDs)):
-        ReservationADDs[i].execute()
-    
-    # execute in reservationMULs
-    for i in range(len(ReservationMULs)):
-        ReservationMULs[i].execute()
-
-    # execute in load buffers
-    for i in range(len(LoadBuffers)):
-        LoadBuffers[i].execute()
+    _simulator.execute()
+    _sync()
 
-    # execute in store buffers
-    for i in range(len(StoreBuffers)):
-        StoreBuffers[i].execute()
-        
 
 def isAllFree():
-    for i in range(num_add):
-        if(ReservationADDs[i].isBusy()):
-            return False
-    for i in range(num_mul):
-        if(ReservationMULs[i].isBusy()):
-            return False    
-    for i in range(num_load):
-        if(LoadBuffers[i].isBusy()):
-            return False
-    for i in range(num_store):
-        if(StoreBuffers[i].isBusy()):
-            return False
-    return True
+    return _simulator.isAllFree()
 
 
 def tomasulo():
-    global Instructions, Registers, ReservationADDs, ReservationMULs, LoadBuffers, StoreBuffers, cycle, pc, memory_index
     init()
-    print_state()
-    cycle += 1
-    while(pc < len(Instructions)):
-        write_back()
-        execute()
-        issue()
-        print_state()
-        cycle += 1    
-        # time.sleep(1)
-
-    while not(isAllFree()):
-        write_back()
-        execute()
-        print_state()
-        cycle += 1
-        
-    
-    # print the result
-    res = ""
-    for i in range(len(Instructions)):
-        res += "Instruction " + str(i) + " : " + Instructions[i].toString() + " || " + str(Instructions[i].issueTime) + ", " + str(Instructions[i].writeTime - 1) + ", " + str(Instructions[i].writeTime) + "\n"
-    print(res)
-    file = open(OUTPUT_FILE, "a")
-    file.write(res)
-    file.close()
+    _simulator.run()
+    _simulator.close()
+    _sync()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="simulate a program with the tomasulo algorithm")
+    parser.add_argument("input", nargs="?", default=INPUT_FILE, help="trace to simulate")
+    parser.add_argument("output", nargs="?", default=OUTPUT_FILE, help="file the trace is appended to")
+    parser.add_argument("--trace", choices=TRACE_LEVELS, default=TRACE_FULL, help="what is written to the output")
+    parser.add_argument("--every", type=int, default=1, help="sampling period of --trace sampled")
+    parser.add_argument("--flush-size", type=int, default=1 << 16, help="characters buffered before writing the output")
+    parser.add_argument("--quiet", action="store_true", help="do not echo the trace on stdout")
+    parser.add_argument("--engine", choices=("cycle", "event"), default="cycle")
+    parser.add_argument("--format", choices=("text", "binary"), default="text", help="binary writes a delta encoded trace, see bintrace.py")
+    parser.add_argument("--keyframe-every", type=int, default=256, help="cycles between full states of a binary trace")
+    parser.add_argument("--stream", action="store_true", help="read the input as it is needed and drop retired instructions")
+    parser.add_argument("--results", help="with --stream, file for the final table instead of stdout")
+    parser.add_argument("--metrics", help="write phase times and per-cycle counters to this .json or .csv file")
+    parser.add_argument("--rob-size", type=int, default=rob_size, help="entries of the reorder buffer, 0 for none")
+    parser.add_argument("--commit-width", type=int, default=commit_width, help="instructions committed per cycle")
+    parser.add_argument("--disambiguate", action="store_true", help="loads wait for older stores to the same address")
+    parser.add_argument("--forward", action="store_true", help="loads take the data of older stores to the same address")
+    parser.add_argument("--cache-size", type=int, default=cache_size, help="bytes of data cache, 0 for fixed LD/SD latencies")
+    parser.add_argument("--cache-ways", type=int, default=cache_ways)
+    parser.add_argument("--cache-line", type=int, default=cache_line)
+    parser.add_argument("--cache-mshrs", type=int, default=cache_mshrs, help="outstanding misses, 0 for no limit")
+    parser.add_argument("--snapshot", help="save the state of the simulation to this file at --snapshot-at")
+    parser.add_argument("--snapshot-at", type=int, default=0, help="cycle of the --snapshot")
+    parser.add_argument("--resume", help="continue the simulation saved in this snapshot, with its machine configuration")
+    args = parser.parse_intermixed_args(argv)
+    config = Config(rob_size=args.rob_size, commit_width=args.commit_width,
+                    disambiguate=int(args.disambiguate), forward=int(args.forward),
+                    cache_size=args.cache_size, cache_ways=args.cache_ways, cache_line=args.cache_line,
+                    cache_mshrs=args.cache_mshrs)
+
+    if args.format == "binary":
+        sink = BinaryTraceSink(args.output, args.every, args.keyframe_every)
+    else:
+        sink = TraceSink(args.output, args.trace, args.every, not args.quiet, args.flush_size)
+    results = None
+    if args.stream:
+        results = ResultSink(args.results, echo=args.results is None, flush_size=args.flush_size)
+    try:
+        if args.resume:
+            # the trace goes on from the cycle of the snapshot
+            simulator = Simulator.restore(args.resume, read_program(args.input), sink, on_retire=results)
+            simulator.engine = args.engine
+        elif args.stream:
+            simulator = Simulator.fromFile(args.input, config, engine=args.engine, sink=sink,
+                                           stream=True, on_retire=results, symbolic=args.trace != TRACE_NONE)
+        else:
+            simulator = Simulator.fromFile(args.input, config, engine=args.engine, sink=sink)
+        if args.metrics:
+            # metrics.py imports this module, so it is only loaded when asked for
+            from metrics import Metrics
+            metrics = Metrics()
+            simulator.addHook(metrics)
+        if args.snapshot:
+            simulator.advance(args.snapshot_at)
+            simulator.save(args.snapshot)
+        result = simulator.run()
+    except DecodeError as error:
+        # a malformed trace line, found when the program is loaded or, with --stream, read
+        sys.exit(args.input + ": " + str(error))
+    simulator.close()
+    if args.metrics:
+        metrics.write(args.metrics)
+    if result["cache"] is not None:
+        # on stderr, stdout may be the trace
+        cache = result["cache"]
+        sys.stderr.write("cache: %d accesses, %d hits, %d misses, hit rate %.3f\n" % (
+            cache["accesses"], cache["hits"], cache["misses"], cache["hit_rate"]))
 
 
 if __name__ == "__main__":
-    tomasulo()
+    # run main() of the imported module, so that the classes in a snapshot belong to
+    # tomasulo and not to __main__
+    import tomasulo
+    tomasulo.main()
 
 
 # 按照属性对列表排序
-# b.sort(key=lambda x: x[1])
\ No newline at end of file
+# b.sort(key=lambda x: x[1])
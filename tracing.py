@@ -0,0 +1,107 @@
+import sys
+
+# where the per-cycle states and the final table of a simulation go
+
+# trace levels
+TRACE_NONE = "none" # nothing at all
+TRACE_FINAL = "final" # only the final issue/exec/write table
+TRACE_SAMPLED = "sampled" # the state of every N-th cycle and the final table
+TRACE_FULL = "full" # the state of every cycle and the final table, as output1.txt
+TRACE_LEVELS = (TRACE_NONE, TRACE_FINAL, TRACE_SAMPLED, TRACE_FULL)
+
+
+def render_state(cycle, stations, registers):
+    # the text of one cycle, stations are whole lines and registers are "F0: ...; " fields
+    parts = ["Cycle_", str(cycle), "\n"]
+    for line in stations:
+        parts.append(line)
+        parts.append("\n")
+    parts.extend(registers)
+    parts.append("\n")
+    return "".join(parts)
+
+
+class TraceSink:
+    # one buffered file handle that is opened on the first write and kept open,
+    # the buffer goes to the file once it holds flush_size characters
+    def __init__(self, path=None, level=TRACE_FULL, every=1, echo=False, flush_size=1 << 16):
+        if level not in TRACE_LEVELS:
+            raise ValueError("unknown trace level: " + str(level))
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.path = path
+        self.level = level
+        self.every = every
+        self.echo = echo
+        self.flush_size = flush_size
+        self.file = None
+        self.buffer = []
+        self.buffered = 0 # characters waiting in buffer
+
+    def wantsCycle(self, cycle):
+        # ask before rendering a state, so that skipped cycles cost nothing
+        if self.level == TRACE_FULL:
+            return True
+        if self.level == TRACE_SAMPLED:
+            return cycle % self.every == 0
+        return False
+
+    def wantsFinal(self):
+        return self.level != TRACE_NONE
+
+    def writeFile(self, text):
+        if self.path is None:
+            return
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.flush_size:
+            self.flush()
+
+    def writeState(self, cycle, stations, registers):
+        text = render_state(cycle, stations, registers) + "\n"
+        if self.echo:
+            sys.stdout.write(text)
+        self.writeFile(text)
+
+    def writeFinal(self, text):
+        # the final table has no blank line after it in the file, but has one on stdout
+        if self.echo:
+            sys.stdout.write(text + "\n")
+        self.writeFile(text)
+
+    def flush(self):
+        if self.buffer:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self.file.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+        if self.file is not None:
+            self.file.flush()
+        if self.echo:
+            sys.stdout.flush()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultSink(TraceSink):
+    # the rows of the final table of a streamed program, written as the instructions
+    # retire; it is passed to the simulator as on_retire
+    def __init__(self, path=None, echo=False, flush_size=1 << 16):
+        super().__init__(path, TRACE_FINAL, echo=echo, flush_size=flush_size)
+
+    def __call__(self, index, instruction):
+        line = instruction.toTableLine(index)
+        if self.echo:
+            sys.stdout.write(line)
+        self.writeFile(line)